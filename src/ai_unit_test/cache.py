@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Self
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = ".ai_unit_test_cache"
+DEFAULT_CACHE_MAX_SIZE_MB = 100
+CACHE_DB_NAME = "responses.sqlite3"
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of LLM responses stored in SQLite.
+    Entries are evicted in least-recently-used order once the total size exceeds `max_size_bytes`.
+    """
+
+    def __init__(self: Self, cache_dir: Path, max_size_bytes: int = DEFAULT_CACHE_MAX_SIZE_MB * 1024 * 1024) -> None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.path = cache_dir / CACHE_DB_NAME
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(self.path, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        logger.debug(f"Response cache opened at {self.path} (max size: {max_size_bytes} bytes)")
+
+    @staticmethod
+    def make_key(model: str, system_msg: str, user_msg: str, temperature: float) -> str:
+        """Builds the cache key from everything that determines the model's answer."""
+        payload = json.dumps([model, system_msg, user_msg, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def __contains__(self: Self, key: object) -> bool:
+        """Tells whether a response is cached for `key`, without counting a hit or refreshing the entry."""
+        return self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self: Self, key: str) -> str | None:
+        """Returns the cached response for `key`, or None on a miss."""
+        row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        response: str = row[0]
+        return response
+
+    def set(self: Self, key: str, response: str) -> None:
+        """Stores a response and evicts the least recently used entries if the cache is over its size cap."""
+        size = len(response.encode("utf-8"))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, response, size, time.time()),
+        )
+        self._evict()
+
+    def total_size(self: Self) -> int:
+        """Returns the total size in bytes of the cached responses."""
+        total: int = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return total
+
+    def _evict(self: Self) -> None:
+        excess = self.total_size() - self.max_size_bytes
+        if excess <= 0:
+            return
+        evicted: list[str] = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+            if excess <= 0:
+                break
+            evicted.append(key)
+            excess -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in evicted])
+        logger.debug(f"Evicted {len(evicted)} entries from the response cache.")
+
+    def close(self: Self) -> None:
+        """Closes the underlying database connection."""
+        logger.debug(f"Response cache closed ({self.hits} hits, {self.misses} misses).")
+        self._conn.close()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import random
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Self
+
+from ai_unit_test.cache import ResponseCache
+from ai_unit_test.file_helper import write_file_atomic
+from ai_unit_test.llm import MODEL, TEMPERATURE, GenerationTiming, LLMBackend
+from ai_unit_test.prompt import estimate_tokens
+from ai_unit_test.usage import TokenUsage
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+
+
+class CassetteMissError(RuntimeError):
+    """Raised when a replayed run sends a request that was not recorded."""
+
+
+class Cassette:
+    """
+    Request/response pairs of LLM calls stored in a JSON file, keyed like the response cache
+    (model, messages and temperature).
+    """
+
+    def __init__(self: Self, path: Path) -> None:
+        self.path = path
+        self.interactions: dict[str, dict[str, Any]] = {}
+
+    @classmethod
+    def load(cls: type[Self], path: Path) -> Self:
+        """Reads a recorded cassette."""
+        cassette = cls(path)
+        data = json.loads(path.read_text())
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"Cassette {path} was written by an incompatible version.")
+        cassette.interactions = data.get("interactions", {})
+        logger.info(f"Loaded {len(cassette.interactions)} recorded LLM interactions from {path}")
+        return cassette
+
+    @staticmethod
+    def key(system_msg: str, user_msg: str) -> str:
+        return ResponseCache.make_key(MODEL, system_msg, user_msg, TEMPERATURE)
+
+    def record(
+        self: Self, system_msg: str, user_msg: str, response: str, timing: GenerationTiming | None = None
+    ) -> None:
+        """Stores a request with its response and, when known, its latency and token usage."""
+        self.interactions[self.key(system_msg, user_msg)] = {
+            "system": system_msg,
+            "user": user_msg,
+            "response": response,
+            "time_to_first_token": timing.time_to_first_token if timing is not None else None,
+            "total_time": timing.total_time if timing is not None else None,
+            "usage": asdict(timing.usage) if timing is not None and timing.usage is not None else None,
+        }
+
+    def recorded_usage(self: Self, system_msg: str, user_msg: str) -> TokenUsage | None:
+        """Returns the token usage recorded for a request, if any."""
+        interaction = self.interactions.get(self.key(system_msg, user_msg))
+        usage = interaction.get("usage") if interaction is not None else None
+        return TokenUsage(**usage) if usage else None
+
+    def lookup(self: Self, system_msg: str, user_msg: str) -> str | None:
+        """Returns the recorded response of a request, or None if it was not recorded."""
+        interaction = self.interactions.get(self.key(system_msg, user_msg))
+        return None if interaction is None else str(interaction["response"])
+
+    def save(self: Self) -> None:
+        """Writes the cassette atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_file_atomic(
+            self.path,
+            json.dumps({"version": CASSETTE_VERSION, "interactions": self.interactions}, indent=2, ensure_ascii=False),
+        )
+        logger.info(f"Recorded {len(self.interactions)} LLM interactions to {self.path}")
+
+
+@dataclass
+class LatencyModel:
+    """
+    Synthetic latency of a completion: a time to first token, then the response generated at
+    `tokens_per_second`. Both are scaled by a random factor in [1 - jitter, 1 + jitter], drawn from a
+    generator seeded with `seed` so that runs are reproducible.
+    """
+
+    time_to_first_token: float = 0.0
+    tokens_per_second: float | None = None
+    jitter: float = 0.0
+    seed: int = 0
+
+    def __post_init__(self: Self) -> None:
+        self._rng = random.Random(self.seed)
+
+    def sample(self: Self, completion_tokens: int) -> tuple[float, float]:
+        """Returns (time to first token, total time) in seconds for a response of `completion_tokens`."""
+        scale = 1 + self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 1.0
+        first_token = self.time_to_first_token * scale
+        generation = completion_tokens / self.tokens_per_second * scale if self.tokens_per_second else 0.0
+        return first_token, first_token + generation
+
+
+class RecordingBackend(LLMBackend):
+    """Forwards requests to another backend and records every answered request in a cassette."""
+
+    def __init__(self: Self, backend: LLMBackend, cassette: Cassette) -> None:
+        self.backend = backend
+        self.cassette = cassette
+
+    async def complete(
+        self: Self,
+        system_msg: str,
+        user_msg: str,
+        json_output: bool = False,
+        stream: bool = False,
+        timing: GenerationTiming | None = None,
+    ) -> str:
+        timing = timing if timing is not None else GenerationTiming()
+        response = await self.backend.complete(system_msg, user_msg, json_output, stream, timing)
+        self.cassette.record(system_msg, user_msg, response, timing)
+        return response
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Answers requests from a cassette without any network access, after the delay given by a latency model.
+    A request missing from the cassette raises CassetteMissError.
+    """
+
+    def __init__(self: Self, cassette: Cassette, latency: LatencyModel | None = None) -> None:
+        self.cassette = cassette
+        self.latency = latency or LatencyModel()
+        self.hits = 0
+        self.misses = 0
+
+    async def complete(
+        self: Self,
+        system_msg: str,
+        user_msg: str,
+        json_output: bool = False,
+        stream: bool = False,
+        timing: GenerationTiming | None = None,
+    ) -> str:
+        response = self.cassette.lookup(system_msg, user_msg)
+        if response is None:
+            self.misses += 1
+            raise CassetteMissError(f"No recorded response for this request in {self.cassette.path}.")
+        self.hits += 1
+        first_token, total = self.latency.sample(estimate_tokens(response))
+        if total > 0:
+            await asyncio.sleep(total)
+        if timing is not None:
+            timing.time_to_first_token = first_token
+            timing.total_time = total
+            timing.usage = self.cassette.recorded_usage(system_msg, user_msg)
+        return response
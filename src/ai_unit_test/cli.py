@@ -1,24 +1,73 @@
-import ast
+from __future__ import annotations
+
 import asyncio
 import logging
+import statistics
 import sys
 import tomllib
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any, Self
 
 import typer
 
+from ai_unit_test.cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_SIZE_MB, ResponseCache
+from ai_unit_test.cassette import Cassette, LatencyModel, RecordingBackend, ReplayBackend
 from ai_unit_test.coverage_helper import collect_missing_lines
+from ai_unit_test.daemon import DEFAULT_SOCKET_PATH, Daemon, DaemonUnavailableError, send_request
 from ai_unit_test.file_helper import (
+    TEST_INDEX_FILE,
+    Chunk,
+    ParsedModule,
+    TestFileIndex,
+    assign_uncovered_lines,
     extract_function_source,
     find_relevant_tests,
     find_test_file,
     get_source_code_chunks,
-    insert_new_test,
-    read_file_content,
-    write_file_content,
+    parse_module,
+    slice_test_context,
+)
+from ai_unit_test.llm import (
+    DEFAULT_KEEPALIVE_EXPIRY,
+    DEFAULT_MAX_CONNECTIONS,
+    MODEL,
+    TEMPERATURE,
+    GenerationTiming,
+    LLMBackend,
+    MissingAPIKeyError,
+    OpenAIBackend,
+    build_batch_prompt,
+    build_chunk_prompt,
+    chunk_prompt_tokens,
+    open_client,
+    update_test_with_llm,
+    update_tests_batch_with_llm,
 )
-from ai_unit_test.llm import update_test_with_llm
+from ai_unit_test.manifest import DEFAULT_MANIFEST_FILE, Manifest, Outcome
+from ai_unit_test.overlay import EditOverlay
+from ai_unit_test.planner import (
+    DEFAULT_TIME_TO_FIRST_TOKEN,
+    DEFAULT_TOKENS_PER_SECOND,
+    Budget,
+    PlannedRequest,
+    RequestEstimate,
+    RunPlan,
+    estimate_prompt_tokens,
+    prioritize,
+)
+from ai_unit_test.prompt import DEFAULT_MAX_PROMPT_TOKENS, estimate_tokens, pack_batches
+from ai_unit_test.scheduler import COMPLETION_TOKENS_ESTIMATE, DEFAULT_MAX_RETRIES, RateLimitScheduler
+from ai_unit_test.shard import BundleError, Shard, merge_bundles, parse_shard, select_shard
+from ai_unit_test.state import WarmState
+from ai_unit_test.tracing import profiling, span
+from ai_unit_test.usage import DEFAULT_PRICES, ModelPrice, RequestUsage, TokenUsage, UsageReport, load_price_table
+from ai_unit_test.watch import DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, PollingWatcher, run_test_command
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +75,7 @@ app = typer.Typer()
 
 
 PYPROJECT_TOML_PATH = Path("pyproject.toml")
+DEFAULT_CONCURRENCY = 4
 
 
 def load_pyproject_config(pyproject_path: Path = PYPROJECT_TOML_PATH) -> dict[str, Any]:
@@ -104,71 +154,500 @@ def _resolve_paths_from_config(
 
 def _detect_test_style(test_file_path: Path) -> str:
     """Detects if the test file uses unittest.TestCase classes or pytest functions."""
-    test_content = read_file_content(test_file_path)
-    if not test_content:
-        return "unknown"
+    module = parse_module(test_file_path)
+    if module.text and module.syntax_error is not None:
+        logger.warning(f"Could not parse test file {test_file_path} for style detection.")
+    return module.test_style
+
+
+@dataclass
+class GenerationContext:
+    """Shared state of a test generation run."""
+
+    client: AsyncOpenAI | LLMBackend
+    semaphore: asyncio.Semaphore
+    cache: ResponseCache | None = None
+    manifest: Manifest | None = None
+    max_prompt_tokens: int | None = DEFAULT_MAX_PROMPT_TOKENS
+    batch_tokens: int | None = None
+    stream: bool = False
+    scheduler: RateLimitScheduler | None = None
+    overlay: EditOverlay = field(default_factory=EditOverlay)
+    timings: dict[tuple[Path, str], GenerationTiming] = field(default_factory=dict)
+    budget: Budget | None = None
+    full_test_context: bool = False
+
+    def timing_for(self: Self, source_file: Path, chunks: list[Chunk]) -> GenerationTiming:
+        """Returns the timing of a request for `chunks`, shared by all of them."""
+        timing = GenerationTiming()
+        for chunk in chunks:
+            self.timings[(source_file, chunk.name)] = timing
+        return timing
+
+
+def _log_timings(timings: dict[tuple[Path, str], GenerationTiming]) -> None:
+    """Logs the latency of every chunk and a summary over the requests sent to the LLM."""
+    requested: dict[int, GenerationTiming] = {}
+    for (source_file, chunk_name), timing in timings.items():
+        if timing.total_time is None:
+            continue
+        logger.debug(
+            f"Timing for {source_file}::{chunk_name}: time to first token {timing.time_to_first_token:.2f}s, "
+            f"total {timing.total_time:.2f}s"
+        )
+        requested[id(timing)] = timing
+    if not requested:
+        return
+    first_token = [t.time_to_first_token for t in requested.values() if t.time_to_first_token is not None]
+    totals = [t.total_time for t in requested.values() if t.total_time is not None]
+    logger.info(
+        f"LLM latency over {len(requested)} requests: time to first token median "
+        f"{statistics.median(first_token):.2f}s (max {max(first_token):.2f}s), "
+        f"generation median {statistics.median(totals):.2f}s (max {max(totals):.2f}s)"
+    )
+
+
+def _usage_report(timings: dict[tuple[Path, str], GenerationTiming], prices: dict[str, ModelPrice]) -> UsageReport:
+    """Groups the chunks by request, as the chunks of a batch share the timing of their request."""
+    requests: dict[int, RequestUsage] = {}
+    for (source_file, chunk_name), timing in timings.items():
+        if timing.usage is None and not timing.cached:
+            continue
+        if id(timing) not in requests:
+            requests[id(timing)] = RequestUsage(str(source_file), [], timing.usage or TokenUsage(), timing.cached)
+        requests[id(timing)].chunks.append(chunk_name)
+    return UsageReport(MODEL, requests.values(), prices)
+
+
+def _batch_source(chunks: list[tuple[Chunk, list[int]]]) -> str:
+    return "\n\n".join(chunk.source_code for chunk, _ in chunks)
+
+
+def _test_context(test_module: ParsedModule, target_source: str, full: bool = False) -> str:
+    """
+    The part of a test module sent as context of a request for `target_source`: the tests most similar to it
+    and what they depend on, or the whole module with `full`.
+    """
+    return test_module.text if full else slice_test_context(test_module, target_source)
+
+
+def _existing_tests(ctx: GenerationContext, request: PlannedRequest) -> str:
+    """
+    The existing tests sent with a request. The slice of the test file planned for the request does not change
+    as tests are added during the run, so that the prompt, and its cached response, do not depend on the order
+    in which requests complete. Whole test files include the tests added so far.
+    """
+    if ctx.full_test_context:
+        return ctx.overlay.read(request.test_file)
+    return request.other_tests_content
+
 
+async def _generate_test_for_chunk(ctx: GenerationContext, request: PlannedRequest) -> None:
+    """Generates a test for a single chunk and inserts it into its test file."""
+    source_file_path, test_file = request.source_file, request.test_file
+    chunk, chunk_uncovered_lines = request.chunks[0]
     try:
-        tree = ast.parse(test_content)
-        for node in ast.walk(tree):
-            if isinstance(node, ast.ClassDef):
-                for base in node.bases:
-                    if isinstance(base, ast.Attribute) and base.attr == "TestCase":
-                        return "unittest_class"
-                    elif isinstance(base, ast.Name) and base.id == "TestCase":
-                        return "unittest_class"
-        # If no TestCase classes are found, assume pytest function style
-        return "pytest_function"
-    except SyntaxError:
-        logger.warning(f"Could not parse test file {test_file_path} for style detection.")
-        return "unknown"
+        logger.info(
+            f"Updating {test_file} for chunk '{chunk.name}' "
+            f"(lines {chunk.start_line}-{chunk.end_line}) with uncovered lines: {chunk_uncovered_lines}"
+        )
+        updated_test: str = await update_test_with_llm(
+            chunk.source_code,  # Pass chunk source code
+            _existing_tests(ctx, request),
+            str(source_file_path),
+            chunk_uncovered_lines,  # Pass chunk-specific uncovered lines
+            request.other_tests_content,
+            request.test_style,  # Pass the detected test style
+            ctx.client,
+            ctx.cache,
+            chunk_context=chunk.context,
+            max_prompt_tokens=ctx.max_prompt_tokens,
+            stream=ctx.stream,
+            timing=ctx.timing_for(source_file_path, [chunk]),
+            scheduler=ctx.scheduler,
+        )
+        # Other chunks may have updated the same test file while we were waiting on the LLM; the overlay
+        # holds their edits, and inserting without awaiting cannot interleave with another insertion.
+        with span("insert", file=test_file):
+            ctx.overlay.insert_test(test_file, updated_test)
+        logger.info(f"✅ Test added for chunk '{chunk.name}' to {test_file}")
+        if ctx.manifest is not None:
+            ctx.manifest.record(source_file_path, chunk, chunk_uncovered_lines, "success")
+    except Exception as exc:  # pragma: no cover
+        logger.error(f"Error updating {test_file}: {exc}")
+        if ctx.manifest is not None:
+            ctx.manifest.record(source_file_path, chunk, chunk_uncovered_lines, "error")
+
+
+async def _generate_tests_for_batch(ctx: GenerationContext, request: PlannedRequest) -> None:
+    """Generates the tests of several chunks of a source file in one request and inserts each of them."""
+    source_file_path, test_file, batch = request.source_file, request.test_file, request.chunks
+    try:
+        logger.info(f"Updating {test_file} for {len(batch)} chunks of {source_file_path} in one request.")
+        tests = await update_tests_batch_with_llm(
+            batch,
+            _existing_tests(ctx, request),
+            str(source_file_path),
+            request.other_tests_content,
+            request.test_style,
+            ctx.client,
+            ctx.cache,
+            max_prompt_tokens=ctx.max_prompt_tokens,
+            stream=ctx.stream,
+            timing=ctx.timing_for(source_file_path, [chunk for chunk, _ in batch]),
+            scheduler=ctx.scheduler,
+        )
+        with span("insert", file=test_file, chunks=len(tests)):
+            for chunk, _ in batch:
+                if chunk.name in tests:
+                    ctx.overlay.insert_test(test_file, tests[chunk.name])
+        logger.info(f"✅ Tests added for {len(tests)}/{len(batch)} chunks to {test_file}")
+        if ctx.manifest is not None:
+            for chunk, chunk_uncovered_lines in batch:
+                outcome: Outcome = "success" if chunk.name in tests else "error"
+                ctx.manifest.record(source_file_path, chunk, chunk_uncovered_lines, outcome)
+    except Exception as exc:  # pragma: no cover
+        logger.error(f"Error updating {test_file}: {exc}")
+        if ctx.manifest is not None:
+            for chunk, chunk_uncovered_lines in batch:
+                ctx.manifest.record(source_file_path, chunk, chunk_uncovered_lines, "error")
+
+
+async def _run_request(ctx: GenerationContext, request: PlannedRequest) -> None:
+    """Sends a planned request once a concurrency slot is free, if the budget of the run still allows it."""
+    async with ctx.semaphore:
+        if ctx.budget is not None and not ctx.budget.admit(request.estimated_tokens):
+            logger.debug(f"Request for {request.source_file} left out by the budget.")
+            return
+        try:
+            if len(request.chunks) == 1:
+                await _generate_test_for_chunk(ctx, request)
+            else:
+                await _generate_tests_for_batch(ctx, request)
+        finally:
+            if ctx.budget is not None:
+                timing = ctx.timings.get((request.source_file, request.chunks[0][0].name))
+                ctx.budget.settle(
+                    request.estimated_tokens,
+                    timing.usage if timing is not None else None,
+                    cached=timing is not None and timing.cached,
+                )
 
 
-async def _process_missing_info(missing_info: dict[Path, list[int]], tests_folder: str) -> None:
+def _open_cache(use_cache: bool, cache_dir: str, cache_max_size: int) -> ResponseCache | None:
+    """Opens the persistent LLM response cache unless caching is disabled."""
+    if not use_cache:
+        logger.info("LLM response cache disabled.")
+        return None
+    logger.info(f"Using LLM response cache at: {cache_dir}")
+    return ResponseCache(Path(cache_dir), cache_max_size * 1024 * 1024)
+
+
+def _plan_requests(
+    missing_info: dict[Path, list[int]],
+    tests_folder: str,
+    index: TestFileIndex,
+    manifest: Manifest | None = None,
+    max_prompt_tokens: int | None = DEFAULT_MAX_PROMPT_TOKENS,
+    batch_tokens: int | None = None,
+    full_test_context: bool = False,
+) -> tuple[list[PlannedRequest], int]:
+    """
+    Finds the test file of every source file and assigns its uncovered lines to its chunks, then groups the
+    chunks into requests (batched up to `batch_tokens` source tokens). Each request carries the slice of the
+    test file its chunks need, or the whole file with `full_test_context`. Returns the requests in coverage
+    order, with the number of chunks skipped because the `manifest` has them unchanged.
+    """
+    requests: list[PlannedRequest] = []
+    skipped = 0
     for source_file_path, uncovered_lines_list in missing_info.items():
         logger.info(f"Processing source file: {source_file_path}")
-        test_file: Path | None = find_test_file(str(source_file_path), tests_folder)
+        with span("test_lookup", file=source_file_path):
+            test_file: Path | None = find_test_file(str(source_file_path), tests_folder, index)
         if not test_file:
             logger.warning(f"Test file not found for {source_file_path}, skipping.")
             continue
 
-        # Detect test style
-        test_style = _detect_test_style(test_file)
-        logger.debug(f"Detected test style for {test_file}: {test_style}")
+        with span("parse", file=source_file_path):
+            # Detect test style
+            test_style = _detect_test_style(test_file)
+            logger.debug(f"Detected test style for {test_file}: {test_style}")
 
-        # Get all logical chunks (classes and functions) from the source file
-        code_chunks = get_source_code_chunks(source_file_path)
+            # Get all logical chunks (classes, methods and functions) from the source file
+            code_chunks = get_source_code_chunks(source_file_path)
 
-        other_tests_content = read_file_content(test_file)
+            test_module = parse_module(test_file)
 
-        for chunk in code_chunks:
-            chunk_uncovered_lines = []
-            for line_num in uncovered_lines_list:
-                if chunk.start_line <= line_num <= chunk.end_line:
-                    chunk_uncovered_lines.append(line_num)
+        # Each uncovered line goes to the innermost chunk containing it; chunks without any are skipped
+        pending: list[tuple[Chunk, list[int]]] = []
+        for chunk, chunk_uncovered_lines in assign_uncovered_lines(code_chunks, uncovered_lines_list):
+            if manifest is not None and manifest.is_unchanged(source_file_path, chunk, chunk_uncovered_lines):
+                logger.debug(f"Chunk '{chunk.name}' in {source_file_path} unchanged since last run, skipping.")
+                skipped += 1
+                continue
+            pending.append((chunk, chunk_uncovered_lines))
 
-            if not chunk_uncovered_lines:
-                continue  # No uncovered lines in this chunk, skip
-
-            logger.info(
-                f"Updating {test_file} for chunk '{chunk.name}' "
-                f"(lines {chunk.start_line}-{chunk.end_line}) with uncovered lines: {chunk_uncovered_lines}"
-            )
-            try:
-                existing_content = read_file_content(test_file)
-                updated_test: str = await update_test_with_llm(
-                    chunk.source_code,  # Pass chunk source code
-                    existing_content or "",  # Still pass the whole test file for context
-                    str(source_file_path),
-                    chunk_uncovered_lines,  # Pass chunk-specific uncovered lines
+        if batch_tokens is None:
+            batches = [[item] for item in pending]
+        else:
+            batches = pack_batches(pending, lambda item: chunk_prompt_tokens(*item), batch_tokens)
+        for batch in batches:
+            # Only the part of the test file its chunks need goes with each request
+            other_tests_content = _test_context(test_module, _batch_source(batch), full_test_context)
+            context_tokens = estimate_tokens(other_tests_content)
+            requests.append(
+                PlannedRequest(
+                    source_file_path,
+                    test_file,
+                    batch,
+                    test_style,
                     other_tests_content,
-                    test_style,  # Pass the detected test style
+                    estimate_prompt_tokens(batch, context_tokens, max_prompt_tokens),
+                    order=len(requests),
                 )
-                new_content = insert_new_test(existing_content, updated_test)
-                write_file_content(test_file, new_content)  # Overwrite the file with the new content
-                logger.info(f"✅ Test file updated successfully: {test_file}")
-            except Exception as exc:  # pragma: no cover
-                logger.error(f"Error updating {test_file}: {exc}")
+            )
+    return requests, skipped
+
+
+async def _process_missing_info(
+    missing_info: dict[Path, list[int]],
+    tests_folder: str,
+    client: AsyncOpenAI | LLMBackend,
+    cache: ResponseCache | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    manifest: Manifest | None = None,
+    index: TestFileIndex | None = None,
+    max_prompt_tokens: int | None = DEFAULT_MAX_PROMPT_TOKENS,
+    batch_tokens: int | None = None,
+    stream: bool = False,
+    overlay: EditOverlay | None = None,
+    scheduler: RateLimitScheduler | None = None,
+    timings: dict[tuple[Path, str], GenerationTiming] | None = None,
+    budget: Budget | None = None,
+    full_test_context: bool = False,
+) -> None:
+    """
+    Generates tests for every uncovered chunk, keeping up to `concurrency` LLM requests in flight
+    across all files. New tests are collected in `overlay`, left for the caller to flush; without one,
+    each changed test file is written once at the end.
+    When a `manifest` is given, chunks already handled with the same source and uncovered lines are skipped.
+    With `batch_tokens`, the chunks of a source file are packed into requests of up to that many source tokens.
+    With `stream`, responses are streamed and checked as they arrive.
+    A `scheduler` keeps the requests within the provider rate limits and retries the throttled ones.
+    The latency and token usage of each chunk are collected in `timings`.
+    Requests are sent by descending number of uncovered lines per prompt token, and only while the `budget`
+    of the run, if any, allows it.
+    Each request gets the slice of its test file relevant to its chunks, or the whole file with
+    `full_test_context`.
+    """
+    own_overlay = overlay is None
+    ctx = GenerationContext(
+        client=client,
+        semaphore=asyncio.Semaphore(concurrency),
+        cache=cache,
+        manifest=manifest,
+        max_prompt_tokens=max_prompt_tokens,
+        batch_tokens=batch_tokens,
+        stream=stream,
+        overlay=overlay if overlay is not None else EditOverlay(),
+        scheduler=scheduler,
+        timings=timings if timings is not None else {},
+        budget=budget,
+        full_test_context=full_test_context,
+    )
+    if index is None:
+        index = TestFileIndex.build(tests_folder)
+    requests, skipped = _plan_requests(
+        missing_info, tests_folder, index, manifest, max_prompt_tokens, batch_tokens, full_test_context
+    )
+
+    if manifest is not None:
+        logger.info(f"Incremental mode: skipped {skipped} unchanged chunks.")
+    logger.info(f"Generating tests in {len(requests)} requests with concurrency {concurrency}.")
+    # Tasks take the concurrency slots in creation order: the most valuable requests are sent first
+    await asyncio.gather(*(_run_request(ctx, request) for request in prioritize(requests)))
+    _log_timings(ctx.timings)
+    if budget is not None:
+        budget.log_summary()
+    if scheduler is not None and (scheduler.retries or scheduler.throttled):
+        logger.info(
+            f"Rate limiting: {scheduler.retries} retries, {scheduler.throttled} throttled requests, "
+            f"final concurrency {scheduler.limit}."
+        )
+    if own_overlay:
+        with span("write"):
+            ctx.overlay.flush()
+
+
+def _estimate_requests(
+    requests: list[PlannedRequest],
+    cache: ResponseCache | None,
+    max_prompt_tokens: int | None,
+    latency: LatencyModel,
+) -> list[RequestEstimate]:
+    """
+    Builds the prompt of every request, in the order they would be sent, to estimate what each one costs and
+    whether its response is already cached. Nothing is sent.
+    """
+    estimates = []
+    for request in prioritize(requests):
+        # Before any test is added, the existing tests are the same test file context as the style references
+        test_code = request.other_tests_content
+        if len(request.chunks) == 1:
+            chunk, lines = request.chunks[0]
+            system_msg, prompt = build_chunk_prompt(
+                chunk.source_code,
+                test_code,
+                str(request.source_file),
+                lines,
+                request.other_tests_content,
+                request.test_style,
+                chunk.context,
+                max_prompt_tokens,
+            )
+        else:
+            system_msg, prompt = build_batch_prompt(
+                request.chunks,
+                test_code,
+                str(request.source_file),
+                request.other_tests_content,
+                request.test_style,
+                max_prompt_tokens,
+            )
+        cached = cache is not None and cache.make_key(MODEL, system_msg, prompt.text, TEMPERATURE) in cache
+        completion_tokens = COMPLETION_TOKENS_ESTIMATE * len(request.chunks)
+        estimates.append(
+            RequestEstimate(
+                str(request.source_file),
+                len(request.chunks),
+                request.uncovered_lines,
+                prompt.total_tokens + estimate_tokens(system_msg),
+                completion_tokens,
+                0.0 if cached else latency.sample(completion_tokens)[1],
+                cached,
+            )
+        )
+    return estimates
+
+
+def _report_plan(
+    missing_info: dict[Path, list[int]],
+    tests_folder: str,
+    index: TestFileIndex,
+    manifest: Manifest | None,
+    cache: ResponseCache | None,
+    max_prompt_tokens: int | None,
+    batch_tokens: int | None,
+    concurrency: int,
+    prices: dict[str, ModelPrice],
+    requests_per_minute: float | None,
+    tokens_per_minute: float | None,
+    latency: LatencyModel,
+    report_file: str | None,
+    full_test_context: bool = False,
+) -> None:
+    """
+    Logs what the run would send, and writes it to `report_file` when given, without sending anything. The
+    `cache` is only queried, then closed.
+    """
+    try:
+        with span("plan"):
+            requests, skipped = _plan_requests(
+                missing_info, tests_folder, index, manifest, max_prompt_tokens, batch_tokens, full_test_context
+            )
+            estimates = _estimate_requests(requests, cache, max_prompt_tokens, latency)
+    finally:
+        if cache is not None:
+            cache.close()
+    if manifest is not None:
+        logger.info(f"Incremental mode: {skipped} unchanged chunks would be skipped.")
+    run_plan = RunPlan(MODEL, estimates, concurrency, prices, requests_per_minute, tokens_per_minute)
+    run_plan.log_summary()
+    if report_file:
+        run_plan.write(Path(report_file))
+
+
+def _load_test_index(tests_folder: str, index_path: Path | None, state: WarmState | None) -> TestFileIndex:
+    if state is not None:
+        return state.test_index(tests_folder, index_path)
+    return TestFileIndex.load_or_build(tests_folder, index_path)
+
+
+def _parse_shard_option(shard: str | None) -> Shard | None:
+    if not shard:
+        return None
+    try:
+        return parse_shard(shard)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+def _select_shard(
+    missing_info: dict[Path, list[int]], tests_folder: str, index: TestFileIndex, shard: Shard | None
+) -> dict[Path, list[int]]:
+    if shard is None:
+        return missing_info
+    return select_shard(missing_info, lambda source: find_test_file(str(source), tests_folder, index), shard)
+
+
+def _write_results(
+    overlay: EditOverlay,
+    manifest: Manifest | None,
+    patch_file: str | None,
+    bundle_file: str | None,
+    shard: Shard | None,
+) -> None:
+    """
+    Writes the new tests of a run to the test files, a patch or a result bundle, then saves the manifest. A run
+    with nothing to do still writes its bundle, so that `merge` gets one from every shard.
+    """
+    if bundle_file:
+        overlay.write_bundle(Path(bundle_file), str(shard) if shard else None)
+    elif patch_file:
+        overlay.write_patch(Path(patch_file))
+    else:
+        overlay.flush()
+    if manifest is not None:
+        if patch_file or bundle_file:
+            # The tests are not in the tree until the patch is applied: they must not be skipped next time
+            logger.info("Manifest not updated: the generated tests were not written to the test files.")
+        else:
+            manifest.save()
+
+
+@asynccontextmanager
+async def _open_backend(
+    max_connections: int,
+    keepalive_expiry: float,
+    record_file: str | None = None,
+    replay_file: str | None = None,
+    latency: LatencyModel | None = None,
+    backend: LLMBackend | None = None,
+) -> AsyncIterator[AsyncOpenAI | LLMBackend]:
+    """
+    Opens what answers the LLM requests of a run: the shared OpenAI client, the same client recording every
+    interaction to a cassette, a replay of a cassette that needs no network access, or a given `backend`.
+    """
+    if backend is not None:
+        yield backend
+        return
+    if replay_file:
+        logger.info(f"Replaying LLM responses from {replay_file}, without network access.")
+        backend = ReplayBackend(Cassette.load(Path(replay_file)), latency)
+        yield backend
+        logger.info(f"Replay: {backend.hits} responses replayed, {backend.misses} requests not recorded.")
+        return
+    # Retries are done by the scheduler, which also adapts the concurrency, rather than by the client
+    async with open_client(max_connections, keepalive_expiry, max_retries=0) as client:
+        if not record_file:
+            yield client
+            return
+        cassette = Cassette(Path(record_file))
+        try:
+            yield RecordingBackend(OpenAIBackend(client), cassette)
+        finally:
+            cassette.save()
 
 
 async def _main(
@@ -176,16 +655,59 @@ async def _main(
     tests_folder: str | None = None,
     coverage_file: str = ".coverage",
     auto: bool = False,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+    use_cache: bool = True,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    cache_max_size: int = DEFAULT_CACHE_MAX_SIZE_MB,
+    incremental: bool = False,
+    manifest_file: str = DEFAULT_MANIFEST_FILE,
+    coverage_workers: int | None = None,
+    fast_coverage: bool = False,
+    max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+    batch_tokens: int | None = None,
+    stream: bool = False,
+    patch_file: str | None = None,
+    requests_per_minute: float | None = None,
+    tokens_per_minute: float | None = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    record_file: str | None = None,
+    replay_file: str | None = None,
+    replay_latency: LatencyModel | None = None,
+    backend: LLMBackend | None = None,
+    report_file: str | None = None,
+    price_table: str | None = None,
+    state: WarmState | None = None,
+    source_files: list[str] | None = None,
+    shard: str | None = None,
+    bundle_file: str | None = None,
+    max_tokens: int | None = None,
+    max_requests: int | None = None,
+    time_budget: float | None = None,
+    plan: bool = False,
+    plan_latency: float = DEFAULT_TIME_TO_FIRST_TOKEN,
+    plan_tokens_per_second: float = DEFAULT_TOKENS_PER_SECOND,
+    full_test_context: bool = False,
 ) -> None:
     logger.info("Starting AI Unit Test generation process.")
+    # The time budget counts from the start of the run
+    budget = Budget(max_tokens, max_requests, time_budget) if (max_tokens or max_requests or time_budget) else None
     logger.debug(
         f"Initial parameters: folders={folders}, "
         f"tests_folder={tests_folder}, "
         f"coverage_file={coverage_file}, "
-        f"auto={auto}"
+        f"auto={auto}, "
+        f"concurrency={concurrency}, "
+        f"max_connections={max_connections}, "
+        f"keepalive_expiry={keepalive_expiry}, "
+        f"use_cache={use_cache}, "
+        f"cache_dir={cache_dir}, "
+        f"incremental={incremental}"
     )
 
-    folders, tests_folder, coverage_file = _resolve_paths_from_config(folders, tests_folder, coverage_file, auto)
+    with span("config"):
+        folders, tests_folder, coverage_file = _resolve_paths_from_config(folders, tests_folder, coverage_file, auto)
 
     logger.info(f"Using source folders: {folders}")
     logger.info(f"Using tests folder: {tests_folder}")
@@ -195,35 +717,292 @@ async def _main(
         logger.error(f"Coverage file not found: {coverage_file}")
         sys.exit(1)
 
-    missing_info = collect_missing_lines(coverage_file)
+    selected_shard = _parse_shard_option(shard)
+
+    def collect() -> dict[Path, list[int]]:
+        return collect_missing_lines(
+            coverage_file,
+            folders,
+            [tests_folder],
+            coverage_workers,
+            fast=fast_coverage,
+            statement_cache_dir=Path(cache_dir) if use_cache else None,
+            only_files=source_files,
+        )
+
+    with span("coverage"):
+        if state is not None:
+            key = (tuple(folders), tests_folder, fast_coverage, None if source_files is None else tuple(source_files))
+            missing_info = state.missing_lines(coverage_file, key, collect)
+        else:
+            missing_info = collect()
     if not missing_info:
         logger.info("No files with missing coverage 🎉")
+        _write_results(EditOverlay(), None, None, bundle_file, selected_shard)
         return
     logger.info(f"👉 Found {len(missing_info)} files with missing coverage.")
 
-    await _process_missing_info(missing_info, tests_folder)
+    manifest: Manifest | None = None
+    if incremental:
+        logger.info(f"Incremental mode enabled, using manifest: {manifest_file}")
+        manifest = Manifest(Path(manifest_file))
+
+    # The test file index is persisted next to the response cache and rebuilt when the tests tree changes.
+    with span("test_index"):
+        index = _load_test_index(tests_folder, Path(cache_dir) / TEST_INDEX_FILE if use_cache else None, state)
+
+    missing_info = _select_shard(missing_info, tests_folder, index, selected_shard)
+    if not missing_info:
+        _write_results(EditOverlay(), None, None, bundle_file, selected_shard)
+        return
+
+    if plan:
+        _report_plan(
+            missing_info,
+            tests_folder,
+            index,
+            manifest,
+            _open_cache(use_cache, cache_dir, cache_max_size),
+            max_prompt_tokens,
+            batch_tokens,
+            concurrency,
+            load_price_table(Path(price_table)) if price_table else DEFAULT_PRICES,
+            requests_per_minute,
+            tokens_per_minute,
+            LatencyModel(plan_latency, plan_tokens_per_second),
+            report_file,
+            full_test_context,
+        )
+        return
+
+    # Every new test is kept in memory and each test file is written once at the end, even if the run is
+    # interrupted, so that no file is left half-edited.
+    overlay = EditOverlay()
+    scheduler = RateLimitScheduler(concurrency, requests_per_minute, tokens_per_minute, max_retries)
+    if use_cache and (record_file or replay_file):
+        # A cached response would never reach the cassette, or hide a missing one
+        logger.info("LLM response cache bypassed while recording or replaying.")
+        use_cache = False
+    cache = _open_cache(use_cache, cache_dir, cache_max_size)
+    prices = load_price_table(Path(price_table)) if price_table else DEFAULT_PRICES
+    timings: dict[tuple[Path, str], GenerationTiming] = {}
+    try:
+        async with _open_backend(
+            max_connections, keepalive_expiry, record_file, replay_file, replay_latency, backend
+        ) as client:
+            await _process_missing_info(
+                missing_info,
+                tests_folder,
+                client,
+                cache,
+                concurrency,
+                manifest,
+                index,
+                max_prompt_tokens,
+                batch_tokens,
+                stream,
+                overlay,
+                scheduler,
+                timings,
+                budget,
+                full_test_context,
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+        report = _usage_report(timings, prices)
+        report.log_summary()
+        if report_file:
+            report.write(Path(report_file))
+        with span("write"):
+            _write_results(overlay, manifest, patch_file, bundle_file, selected_shard)
 
 
 DEFAULT_FOLDERS_OPTION = typer.Option(None, "--folders", help="Source code folders to analyze.")
 DEFAULT_TESTS_FOLDER_OPTION = typer.Option(None, "--tests-folder", help="Folder where the tests are located.")
 DEFAULT_COVERAGE_FILE_OPTION = typer.Option(".coverage", "--coverage-file", help=".coverage file.")
 DEFAULT_AUTO_OPTION = typer.Option(False, "--auto", help="Try to discover folders/tests from pyproject.toml.")
+DEFAULT_CONCURRENCY_OPTION = typer.Option(
+    DEFAULT_CONCURRENCY, "--concurrency", min=1, help="Maximum number of LLM requests in flight."
+)
+DEFAULT_MAX_CONNECTIONS_OPTION = typer.Option(
+    DEFAULT_MAX_CONNECTIONS, "--max-connections", min=1, help="Size of the shared HTTP connection pool."
+)
+DEFAULT_KEEPALIVE_EXPIRY_OPTION = typer.Option(
+    DEFAULT_KEEPALIVE_EXPIRY, "--keepalive-expiry", min=0.0, help="Seconds to keep idle connections alive."
+)
+DEFAULT_NO_CACHE_OPTION = typer.Option(False, "--no-cache", help="Disable the persistent LLM response cache.")
+DEFAULT_CACHE_DIR_OPTION = typer.Option(
+    DEFAULT_CACHE_DIR, "--cache-dir", help="Directory of the persistent LLM response cache."
+)
+DEFAULT_CACHE_MAX_SIZE_OPTION = typer.Option(
+    DEFAULT_CACHE_MAX_SIZE_MB, "--cache-max-size", min=1, help="Maximum cache size in MB (LRU eviction)."
+)
+DEFAULT_INCREMENTAL_OPTION = typer.Option(
+    False, "--incremental", help="Skip chunks unchanged and already handled since the last run."
+)
+DEFAULT_MANIFEST_FILE_OPTION = typer.Option(
+    DEFAULT_MANIFEST_FILE, "--manifest-file", help="Manifest used by --incremental to track handled chunks."
+)
+DEFAULT_COVERAGE_WORKERS_OPTION = typer.Option(
+    None, "--coverage-workers", min=1, help="Processes used to analyze coverage data (default: one per CPU)."
+)
+DEFAULT_FAST_COVERAGE_OPTION = typer.Option(
+    False, "--fast-coverage", help="Read the .coverage database directly instead of analyzing file by file."
+)
+DEFAULT_MAX_PROMPT_TOKENS_OPTION = typer.Option(
+    DEFAULT_MAX_PROMPT_TOKENS, "--max-prompt-tokens", min=1, help="Approximate token budget of each prompt."
+)
+DEFAULT_FULL_TEST_CONTEXT_OPTION = typer.Option(
+    False,
+    "--full-test-context",
+    help="Send whole test files as context, instead of the tests most similar to each chunk and their fixtures.",
+)
+DEFAULT_BATCH_TOKENS_OPTION = typer.Option(
+    None,
+    "--batch-tokens",
+    min=1,
+    help="Pack the uncovered chunks of a file into requests of up to this many source tokens (default: no batching).",
+)
+DEFAULT_STREAM_OPTION = typer.Option(
+    False, "--stream", help="Stream LLM responses, cancelling malformed ones early and recording latencies."
+)
+DEFAULT_PATCH_OPTION = typer.Option(
+    None, "--patch", help="Write the new tests as a unified diff to this file instead of editing the test files."
+)
+DEFAULT_SHARD_OPTION = typer.Option(
+    None,
+    "--shard",
+    help="Handle only shard i of n of the files to cover (e.g. 1/4). Files sharing a test file stay in one shard.",
+)
+DEFAULT_BUNDLE_OPTION = typer.Option(
+    None,
+    "--bundle",
+    help="Write the new tests to this result bundle instead of editing the test files, to `merge` them later.",
+)
+DEFAULT_MAX_TOKENS_OPTION = typer.Option(
+    None, "--max-tokens", min=1, help="Stop sending requests once about this many tokens are spent."
+)
+DEFAULT_MAX_REQUESTS_OPTION = typer.Option(
+    None, "--max-requests", min=1, help="Stop sending requests once this many were sent."
+)
+DEFAULT_TIME_BUDGET_OPTION = typer.Option(
+    None, "--time-budget", min=0.0, help="Stop sending requests this many seconds after the start of the run."
+)
+DEFAULT_PLAN_OPTION = typer.Option(
+    False,
+    "--plan",
+    help="Build every prompt and report the requests, tokens, time and cost of the run, without sending any.",
+)
+DEFAULT_PLAN_LATENCY_OPTION = typer.Option(
+    DEFAULT_TIME_TO_FIRST_TOKEN, "--plan-latency", min=0.0, help="Time to first token assumed by --plan, in seconds."
+)
+DEFAULT_PLAN_TOKENS_PER_SECOND_OPTION = typer.Option(
+    DEFAULT_TOKENS_PER_SECOND, "--plan-tokens-per-second", min=1.0, help="Generation speed assumed by --plan."
+)
+DEFAULT_RPM_OPTION = typer.Option(
+    None, "--rpm", min=1, help="Requests per minute allowed by the provider (default: unlimited)."
+)
+DEFAULT_TPM_OPTION = typer.Option(
+    None, "--tpm", min=1, help="Tokens per minute allowed by the provider (default: unlimited)."
+)
+DEFAULT_MAX_RETRIES_OPTION = typer.Option(
+    DEFAULT_MAX_RETRIES, "--max-retries", min=0, help="Retries of a request throttled (429) or failed (5xx)."
+)
+DEFAULT_RECORD_OPTION = typer.Option(
+    None, "--record", help="Record every LLM request and response of the run to this cassette file."
+)
+DEFAULT_REPLAY_OPTION = typer.Option(
+    None, "--replay", help="Answer LLM requests from this cassette file, without network access."
+)
+DEFAULT_REPLAY_LATENCY_OPTION = typer.Option(
+    0.0, "--replay-latency", min=0.0, help="Synthetic time to first token of replayed responses, in seconds."
+)
+DEFAULT_REPLAY_TOKENS_PER_SECOND_OPTION = typer.Option(
+    None, "--replay-tokens-per-second", min=1.0, help="Synthetic generation speed of replayed responses."
+)
+DEFAULT_REPLAY_JITTER_OPTION = typer.Option(
+    0.0, "--replay-jitter", min=0.0, max=1.0, help="Random variation of the synthetic latency, as a fraction."
+)
+DEFAULT_REPORT_OPTION = typer.Option(
+    None,
+    "--report",
+    help="Write the token usage and estimated cost per chunk, file and run to this JSON file. With --plan, write "
+    "the run plan instead: estimated requests, tokens, time and cost per file and for the run.",
+)
+DEFAULT_PRICE_TABLE_OPTION = typer.Option(
+    None, "--price-table", help="JSON file of model prices in USD per million tokens, used to estimate costs."
+)
+DEFAULT_PROFILE_OPTION = typer.Option(
+    None,
+    "--profile",
+    help="Write a Chrome trace (Perfetto) of the pipeline stages to this file and log the time spent in each.",
+)
+DEFAULT_DAEMON_OPTION = typer.Option(
+    None,
+    "--daemon",
+    help=f"Run in the daemon started by `serve` listening on this socket (e.g. {DEFAULT_SOCKET_PATH}).",
+)
+DEFAULT_SOCKET_OPTION = typer.Option(DEFAULT_SOCKET_PATH, "--socket", help="Unix socket the daemon listens on.")
+DEFAULT_STOP_OPTION = typer.Option(False, "--stop", help="Stop the daemon listening on the socket.")
+DEFAULT_TEST_COMMAND_OPTION = typer.Option(
+    None,
+    "--test-command",
+    help="Command run on the test files of the changed sources to refresh their coverage, "
+    "e.g. 'coverage run -m pytest'.",
+)
+DEFAULT_POLL_INTERVAL_OPTION = typer.Option(
+    DEFAULT_POLL_INTERVAL, "--poll-interval", min=0.01, help="Seconds between two scans of the source folders."
+)
+DEFAULT_DEBOUNCE_OPTION = typer.Option(
+    DEFAULT_DEBOUNCE, "--debounce", min=0.0, help="Seconds without changes to wait for before a run."
+)
+DEFAULT_BUNDLES_ARGUMENT = typer.Argument(..., help="Result bundles written by `main --bundle`.")
 DEFAULT_FILE_PATH_ARGUMENT = typer.Argument(..., help="Path to the source file.")
 DEFAULT_FUNCTION_NAME_ARGUMENT = typer.Argument(..., help="Name of the function to test.")
 
 
-@app.command()
-def func(
-    file_path: str = DEFAULT_FILE_PATH_ARGUMENT,
-    function_name: str = DEFAULT_FUNCTION_NAME_ARGUMENT,
-    tests_folder: str | None = DEFAULT_TESTS_FOLDER_OPTION,
-    auto: bool = DEFAULT_AUTO_OPTION,
-) -> None:
-    """
-    Generates a test for a specific function in a file.
-    """
-    logger.info(f"Generating test for function '{function_name}' in file '{file_path}'.")
+async def _generate_with_client(
+    source_code: str,
+    existing_content: str,
+    file_name: str,
+    other_tests_content: str,
+    test_style: str,
+    max_connections: int,
+    keepalive_expiry: float,
+    cache: ResponseCache | None,
+    max_prompt_tokens: int,
+    backend: LLMBackend | None = None,
+) -> str:
+    """Generates a single `func` test with `backend`, or with a client session opened for this call only."""
+    if backend is not None:
+        return await update_test_with_llm(
+            source_code,
+            existing_content,
+            file_name,
+            [],
+            other_tests_content,
+            test_style,
+            backend,
+            cache,
+            max_prompt_tokens=max_prompt_tokens,
+        )
+    async with open_client(max_connections, keepalive_expiry) as client:
+        return await update_test_with_llm(
+            source_code,
+            existing_content,
+            file_name,
+            [],
+            other_tests_content,
+            test_style,
+            client,
+            cache,
+            max_prompt_tokens=max_prompt_tokens,
+        )
 
+
+def _resolve_tests_folder(tests_folder: str | None, auto: bool) -> str:
+    """Returns the tests folder of `func`, read from pyproject.toml when not given, or exits if there is none."""
     if auto or not tests_folder:
         logger.info("Auto-discovery enabled or tests_folder not provided. Loading from pyproject.toml.")
         cfg: dict[str, Any] = load_pyproject_config()
@@ -236,13 +1015,35 @@ def func(
     if not tests_folder:
         logger.error("Tests folder not defined (--tests-folder) and not found in pyproject.toml.")
         sys.exit(1)
+    return tests_folder
+
+
+async def _func(
+    file_path: str,
+    function_name: str,
+    tests_folder: str | None = None,
+    auto: bool = False,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+    use_cache: bool = True,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    cache_max_size: int = DEFAULT_CACHE_MAX_SIZE_MB,
+    max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+    patch_file: str | None = None,
+    backend: LLMBackend | None = None,
+    state: WarmState | None = None,
+    full_test_context: bool = False,
+) -> None:
+    logger.info(f"Generating test for function '{function_name}' in file '{file_path}'.")
+    tests_folder = _resolve_tests_folder(tests_folder, auto)
 
     source_code = extract_function_source(file_path, function_name)
     if not source_code:
         logger.error(f"Function '{function_name}' not found in '{file_path}'.")
         sys.exit(1)
 
-    test_file: Path | None = find_test_file(file_path, tests_folder)
+    index = state.test_index(tests_folder, None) if state is not None else TestFileIndex.build(tests_folder)
+    test_file: Path | None = find_test_file(file_path, tests_folder, index)
     if not test_file:
         logger.warning(f"Test file not found for {file_path}, skipping.")
         return
@@ -252,19 +1053,101 @@ def func(
     logger.debug(f"Detected test style for {test_file}: {test_style}")
 
     # Read all other test files for context
-    other_tests_content = find_relevant_tests(file_path, tests_folder)
+    other_tests_content = find_relevant_tests(file_path, tests_folder, index)
 
     logger.info(f"Updating {test_file} for function '{function_name}'.")
+    cache = _open_cache(use_cache, cache_dir, cache_max_size)
+    overlay = EditOverlay()
     try:
-        existing_content = read_file_content(test_file)
-        updated_test: str = asyncio.run(
-            update_test_with_llm(source_code, existing_content, str(file_path), [], other_tests_content, test_style)
+        existing_content = overlay.read(test_file)
+        if not full_test_context:
+            existing_content = other_tests_content = _test_context(parse_module(test_file), source_code)
+        updated_test: str = await _generate_with_client(
+            source_code,
+            existing_content,
+            str(file_path),
+            other_tests_content,
+            test_style,
+            max_connections,
+            keepalive_expiry,
+            cache,
+            max_prompt_tokens,
+            backend,
         )
-        new_content = insert_new_test(existing_content, updated_test)
-        write_file_content(test_file, new_content)
-        logger.info(f"✅ Test file updated successfully: {test_file}")
+        overlay.insert_test(test_file, updated_test)
+        if patch_file:
+            overlay.write_patch(Path(patch_file))
+        else:
+            overlay.flush()
+            logger.info(f"✅ Test file updated successfully: {test_file}")
+    except MissingAPIKeyError:
+        raise
     except Exception as exc:  # pragma: no cover
         logger.error(f"Error updating {test_file}: {exc}")
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+@contextmanager
+def _exit_on_missing_api_key() -> Iterator[None]:
+    """Exits with the logged error, rather than a traceback, when a run needs OPENAI_API_KEY and it is not set."""
+    try:
+        yield
+    except MissingAPIKeyError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+def _forward_to_daemon(socket_path: str, command: str, options: dict[str, Any], profile: str | None = None) -> None:
+    """Runs a command in the daemon listening on `socket_path` and exits with its exit code."""
+    try:
+        exit_code = send_request(Path(socket_path), command, options, profile)
+    except DaemonUnavailableError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    if exit_code:
+        sys.exit(exit_code)
+
+
+@app.command()
+def func(
+    file_path: str = DEFAULT_FILE_PATH_ARGUMENT,
+    function_name: str = DEFAULT_FUNCTION_NAME_ARGUMENT,
+    tests_folder: str | None = DEFAULT_TESTS_FOLDER_OPTION,
+    auto: bool = DEFAULT_AUTO_OPTION,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS_OPTION,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY_OPTION,
+    no_cache: bool = DEFAULT_NO_CACHE_OPTION,
+    cache_dir: str = DEFAULT_CACHE_DIR_OPTION,
+    cache_max_size: int = DEFAULT_CACHE_MAX_SIZE_OPTION,
+    max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS_OPTION,
+    full_test_context: bool = DEFAULT_FULL_TEST_CONTEXT_OPTION,
+    patch: str | None = DEFAULT_PATCH_OPTION,
+    daemon: str | None = DEFAULT_DAEMON_OPTION,
+) -> None:
+    """
+    Generates a test for a specific function in a file.
+    """
+    options: dict[str, Any] = {
+        "file_path": file_path,
+        "function_name": function_name,
+        "tests_folder": tests_folder,
+        "auto": auto,
+        "max_connections": max_connections,
+        "keepalive_expiry": keepalive_expiry,
+        "use_cache": not no_cache,
+        "cache_dir": cache_dir,
+        "cache_max_size": cache_max_size,
+        "max_prompt_tokens": max_prompt_tokens,
+        "full_test_context": full_test_context,
+        "patch_file": patch,
+    }
+    if daemon:
+        _forward_to_daemon(daemon, "func", options)
+        return
+    with _exit_on_missing_api_key():
+        asyncio.run(_func(**options))
 
 
 @app.command()
@@ -273,17 +1156,274 @@ def main(
     tests_folder: str | None = DEFAULT_TESTS_FOLDER_OPTION,
     coverage_file: str = DEFAULT_COVERAGE_FILE_OPTION,
     auto: bool = DEFAULT_AUTO_OPTION,
+    concurrency: int = DEFAULT_CONCURRENCY_OPTION,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS_OPTION,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY_OPTION,
+    no_cache: bool = DEFAULT_NO_CACHE_OPTION,
+    cache_dir: str = DEFAULT_CACHE_DIR_OPTION,
+    cache_max_size: int = DEFAULT_CACHE_MAX_SIZE_OPTION,
+    incremental: bool = DEFAULT_INCREMENTAL_OPTION,
+    manifest_file: str = DEFAULT_MANIFEST_FILE_OPTION,
+    coverage_workers: int | None = DEFAULT_COVERAGE_WORKERS_OPTION,
+    fast_coverage: bool = DEFAULT_FAST_COVERAGE_OPTION,
+    max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS_OPTION,
+    full_test_context: bool = DEFAULT_FULL_TEST_CONTEXT_OPTION,
+    batch_tokens: int | None = DEFAULT_BATCH_TOKENS_OPTION,
+    stream: bool = DEFAULT_STREAM_OPTION,
+    patch: str | None = DEFAULT_PATCH_OPTION,
+    shard: str | None = DEFAULT_SHARD_OPTION,
+    bundle: str | None = DEFAULT_BUNDLE_OPTION,
+    max_tokens: int | None = DEFAULT_MAX_TOKENS_OPTION,
+    max_requests: int | None = DEFAULT_MAX_REQUESTS_OPTION,
+    time_budget: float | None = DEFAULT_TIME_BUDGET_OPTION,
+    plan: bool = DEFAULT_PLAN_OPTION,
+    plan_latency: float = DEFAULT_PLAN_LATENCY_OPTION,
+    plan_tokens_per_second: float = DEFAULT_PLAN_TOKENS_PER_SECOND_OPTION,
+    rpm: int | None = DEFAULT_RPM_OPTION,
+    tpm: int | None = DEFAULT_TPM_OPTION,
+    max_retries: int = DEFAULT_MAX_RETRIES_OPTION,
+    record: str | None = DEFAULT_RECORD_OPTION,
+    replay: str | None = DEFAULT_REPLAY_OPTION,
+    replay_latency: float = DEFAULT_REPLAY_LATENCY_OPTION,
+    replay_tokens_per_second: float | None = DEFAULT_REPLAY_TOKENS_PER_SECOND_OPTION,
+    replay_jitter: float = DEFAULT_REPLAY_JITTER_OPTION,
+    report: str | None = DEFAULT_REPORT_OPTION,
+    price_table: str | None = DEFAULT_PRICE_TABLE_OPTION,
+    profile: str | None = DEFAULT_PROFILE_OPTION,
+    daemon: str | None = DEFAULT_DAEMON_OPTION,
 ) -> None:
     """
     Automatically updates unit tests using the .coverage file and
     the settings declared in pyproject.toml
     """
     logger.debug("CLI 'main' command invoked.")
-    asyncio.run(
-        _main(
-            folders=folders,
-            tests_folder=tests_folder,
-            coverage_file=coverage_file,
-            auto=auto,
+    options: dict[str, Any] = {
+        "folders": folders,
+        "tests_folder": tests_folder,
+        "coverage_file": coverage_file,
+        "auto": auto,
+        "concurrency": concurrency,
+        "max_connections": max_connections,
+        "keepalive_expiry": keepalive_expiry,
+        "use_cache": not no_cache,
+        "cache_dir": cache_dir,
+        "cache_max_size": cache_max_size,
+        "incremental": incremental,
+        "manifest_file": manifest_file,
+        "coverage_workers": coverage_workers,
+        "fast_coverage": fast_coverage,
+        "max_prompt_tokens": max_prompt_tokens,
+        "full_test_context": full_test_context,
+        "batch_tokens": batch_tokens,
+        "stream": stream,
+        "patch_file": patch,
+        "shard": shard,
+        "bundle_file": bundle,
+        "max_tokens": max_tokens,
+        "max_requests": max_requests,
+        "time_budget": time_budget,
+        "plan": plan,
+        "plan_latency": plan_latency,
+        "plan_tokens_per_second": plan_tokens_per_second,
+        "requests_per_minute": rpm,
+        "tokens_per_minute": tpm,
+        "max_retries": max_retries,
+        "report_file": report,
+        "price_table": price_table,
+    }
+    if daemon:
+        if record or replay:
+            logger.error("--record and --replay cannot be used with --daemon, which uses its own LLM client.")
+            sys.exit(1)
+        _forward_to_daemon(daemon, "main", options, profile)
+        return
+    with _exit_on_missing_api_key(), profiling(Path(profile) if profile else None):
+        asyncio.run(
+            _main(
+                **options,
+                record_file=record,
+                replay_file=replay,
+                replay_latency=LatencyModel(replay_latency, replay_tokens_per_second, replay_jitter),
+            )
         )
+
+
+@app.command()
+def serve(
+    socket_path: str = DEFAULT_SOCKET_OPTION,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS_OPTION,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY_OPTION,
+    stop: bool = DEFAULT_STOP_OPTION,
+) -> None:
+    """
+    Runs a daemon that keeps the LLM connections, coverage data and test indexes warm for `main --daemon` and
+    `func --daemon`.
+    """
+    if stop:
+        _forward_to_daemon(socket_path, "shutdown", {})
+        return
+    try:
+        asyncio.run(Daemon(Path(socket_path), max_connections, keepalive_expiry).serve())
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+def _drop_stale_sources(changed: list[str], coverage_file: str) -> list[str]:
+    """
+    Returns the changed source files whose coverage data is up to date, warning about the ones saved after
+    `coverage_file` was written: their uncovered lines may have moved, and tests generated from them would be wrong.
+    """
+    coverage_path = Path(coverage_file)
+    if not coverage_path.exists():
+        return changed
+    coverage_mtime = coverage_path.stat().st_mtime_ns
+    fresh: list[str] = []
+    for source in changed:
+        source_path = Path(source)
+        if source_path.exists() and source_path.stat().st_mtime_ns > coverage_mtime:
+            logger.warning(
+                f"{source} changed after {coverage_file} was written, skipping it until its tests run again."
+            )
+        else:
+            fresh.append(source)
+    return fresh
+
+
+async def _watch(
+    main_options: dict[str, Any],
+    test_command: str | None = None,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    debounce: float = DEFAULT_DEBOUNCE,
+    backend: LLMBackend | None = None,
+    max_runs: int | None = None,
+) -> None:
+    """
+    Runs `main` on the source files changed since the previous run, each time they are saved. Only the coverage
+    of the changed files is analyzed again, after running their test files with `test_command` if given; the
+    changed files newer than the coverage data are skipped. The manifest of incremental runs skips the chunks
+    whose uncovered lines did not change. The LLM client, coverage results, test indexes and parsed modules are
+    kept in memory from one run to the next.
+    """
+    folders, tests_folder, coverage_file = _resolve_paths_from_config(
+        main_options.get("folders"),
+        main_options.get("tests_folder"),
+        main_options.get("coverage_file", ".coverage"),
+        main_options.get("auto", False),
     )
+    options = {
+        **main_options,
+        "folders": folders,
+        "tests_folder": tests_folder,
+        "coverage_file": coverage_file,
+        "auto": False,
+        "incremental": True,
+    }
+    state = WarmState()
+    use_cache = options.get("use_cache", True)
+    index_path = Path(options.get("cache_dir", DEFAULT_CACHE_DIR)) / TEST_INDEX_FILE if use_cache else None
+    # The tests written by a run must not trigger the next one
+    watcher = PollingWatcher(folders, [tests_folder], poll_interval, debounce)
+    async with _open_backend(
+        options.get("max_connections", DEFAULT_MAX_CONNECTIONS),
+        options.get("keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY),
+        backend=backend,
+    ) as client:
+        run_backend = client if isinstance(client, LLMBackend) else OpenAIBackend(client)
+        logger.info(f"Watching {', '.join(folders)} for changes. Press Ctrl+C to stop.")
+        runs = 0
+        while max_runs is None or runs < max_runs:
+            changed = sorted(str(path) for path in await watcher.next_changes())
+            runs += 1
+            logger.info(f"Changed: {', '.join(changed)}")
+            if test_command:
+                index = state.test_index(tests_folder, index_path)
+                test_files = sorted(
+                    {str(test_file) for source in changed if (test_file := find_test_file(source, tests_folder, index))}
+                )
+                if test_files:
+                    exit_code = await run_test_command(test_command, test_files)
+                    if exit_code:
+                        logger.warning(f"Test command exited with code {exit_code}.")
+                else:
+                    logger.info("No test file found for the changed files, using the current coverage data.")
+            changed = _drop_stale_sources(changed, coverage_file)
+            if not changed:
+                continue
+            try:
+                await _main(**options, backend=run_backend, state=state, source_files=changed)
+            except SystemExit:
+                logger.warning("Run failed, waiting for the next change.")
+
+
+@app.command()
+def watch(
+    folders: list[str] | None = DEFAULT_FOLDERS_OPTION,
+    tests_folder: str | None = DEFAULT_TESTS_FOLDER_OPTION,
+    coverage_file: str = DEFAULT_COVERAGE_FILE_OPTION,
+    auto: bool = DEFAULT_AUTO_OPTION,
+    test_command: str | None = DEFAULT_TEST_COMMAND_OPTION,
+    poll_interval: float = DEFAULT_POLL_INTERVAL_OPTION,
+    debounce: float = DEFAULT_DEBOUNCE_OPTION,
+    concurrency: int = DEFAULT_CONCURRENCY_OPTION,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS_OPTION,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY_OPTION,
+    no_cache: bool = DEFAULT_NO_CACHE_OPTION,
+    cache_dir: str = DEFAULT_CACHE_DIR_OPTION,
+    cache_max_size: int = DEFAULT_CACHE_MAX_SIZE_OPTION,
+    manifest_file: str = DEFAULT_MANIFEST_FILE_OPTION,
+    fast_coverage: bool = DEFAULT_FAST_COVERAGE_OPTION,
+    max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS_OPTION,
+    batch_tokens: int | None = DEFAULT_BATCH_TOKENS_OPTION,
+    stream: bool = DEFAULT_STREAM_OPTION,
+    rpm: int | None = DEFAULT_RPM_OPTION,
+    tpm: int | None = DEFAULT_TPM_OPTION,
+    max_retries: int = DEFAULT_MAX_RETRIES_OPTION,
+) -> None:
+    """
+    Watches the source folders and generates tests for the newly uncovered code of each file saved.
+    """
+    options: dict[str, Any] = {
+        "folders": folders,
+        "tests_folder": tests_folder,
+        "coverage_file": coverage_file,
+        "auto": auto,
+        "concurrency": concurrency,
+        "max_connections": max_connections,
+        "keepalive_expiry": keepalive_expiry,
+        "use_cache": not no_cache,
+        "cache_dir": cache_dir,
+        "cache_max_size": cache_max_size,
+        "manifest_file": manifest_file,
+        "fast_coverage": fast_coverage,
+        "max_prompt_tokens": max_prompt_tokens,
+        "batch_tokens": batch_tokens,
+        "stream": stream,
+        "requests_per_minute": rpm,
+        "tokens_per_minute": tpm,
+        "max_retries": max_retries,
+    }
+    try:
+        with _exit_on_missing_api_key():
+            asyncio.run(_watch(options, test_command, poll_interval, debounce))
+    except KeyboardInterrupt:
+        logger.info("Watch stopped.")
+
+
+@app.command()
+def merge(
+    bundles: list[str] = DEFAULT_BUNDLES_ARGUMENT,
+    patch: str | None = DEFAULT_PATCH_OPTION,
+) -> None:
+    """
+    Merges the result bundles of sharded runs into the test files, or into a single patch.
+    """
+    try:
+        overlay = merge_bundles([Path(bundle) for bundle in bundles])
+    except (BundleError, OSError, ValueError) as e:
+        logger.error(f"Could not merge the bundles: {e}")
+        sys.exit(1)
+    if patch:
+        overlay.write_patch(Path(patch))
+    else:
+        overlay.flush()
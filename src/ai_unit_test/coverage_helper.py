@@ -1,26 +1,261 @@
+from __future__ import annotations
+
+import json
 import logging
+import os
+import sqlite3
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING, Self
 
-from coverage import Coverage
+# coverage is imported where it is used, so that it is only loaded by the runs that read coverage data
+if TYPE_CHECKING:
+    from coverage import Coverage
 
 logger = logging.getLogger(__name__)
 
+# Below this many files the process pool start-up costs more than it saves
+PARALLEL_ANALYSIS_MIN_FILES = 64
 
-def collect_missing_lines(data_file: str) -> dict[Path, list[int]]:
-    """Returns a mapping {file: [lines without coverage]} using the .coverage file."""
-    logger.debug(f"Collecting missing lines from {data_file}")
-    cov = Coverage(data_file=data_file)
-    cov.load()
-    missing: dict[Path, list[int]] = {}
-    measured_files = cov.get_data().measured_files()
-    logger.debug(f"Measured files by coverage: {measured_files}")
+STATEMENT_CACHE_DB_NAME = "statements.sqlite3"
+
+_worker_coverage: Coverage | None = None
+
+
+def _folder_roots(folders: Iterable[str]) -> tuple[str, ...]:
+    roots: set[str] = set()
+    for folder in folders:
+        roots.add(os.path.join(os.path.abspath(folder), ""))
+        roots.add(os.path.join(os.path.realpath(folder), ""))
+    return tuple(roots)
+
+
+def _file_paths(file: str) -> tuple[str, str]:
+    return os.path.abspath(file), os.path.realpath(file)
+
+
+def filter_measured_files(
+    measured_files: Iterable[str],
+    folders: list[str] | None = None,
+    exclude_folders: list[str] | None = None,
+    only_files: Iterable[str] | None = None,
+) -> list[str]:
+    """
+    Keeps the measured files located under one of `folders` and not under any of `exclude_folders`, and among
+    `only_files` when it is given.
+    """
+    include_roots = _folder_roots(folders) if folders else ()
+    exclude_roots = _folder_roots(exclude_folders) if exclude_folders else ()
+    only_paths = None if only_files is None else {path for file in only_files for path in _file_paths(file)}
+    selected: list[str] = []
     for file_path_str in measured_files:
+        abs_path = os.path.abspath(file_path_str)
+        if include_roots and not abs_path.startswith(include_roots):
+            continue
+        if only_paths is not None and abs_path not in only_paths:
+            continue
+        if exclude_roots and abs_path.startswith(exclude_roots):
+            continue
+        selected.append(file_path_str)
+    return selected
+
+
+def _init_worker(data_file: str) -> None:
+    from coverage import Coverage
+
+    global _worker_coverage
+    _worker_coverage = Coverage(data_file=data_file)
+    _worker_coverage.load()
+
+
+def _analyze_in_worker(file_path_str: str) -> tuple[str, list[int]]:
+    assert _worker_coverage is not None
+    _, _, missing_lines, _ = _worker_coverage.analysis(file_path_str)
+    return file_path_str, missing_lines
+
+
+def _analyze_in_pool(data_file: str, files: list[str], workers: int) -> list[tuple[str, list[int]]]:
+    logger.debug(f"Analyzing {len(files)} files in a pool of {workers} processes.")
+    chunksize = max(1, len(files) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data_file,)) as executor:
+        return list(executor.map(_analyze_in_worker, files, chunksize=chunksize))
+
+
+def _analyze_serially(cov: Coverage, files: list[str]) -> Iterable[tuple[str, list[int]]]:
+    for file_path_str in files:
         logger.debug(f"Processing measured file: {file_path_str}")
         # The method analysis2 is marked as private by the library, but it is the best way to get the missing lines.
         # The official API does not provide a direct way to get the missing lines for a specific file.
         # The analysis method returns (statements, excluded, missing, annotate_html)
         _, _, missing_lines, _ = cov.analysis(file_path_str)
         logger.debug(f"Analysis for {file_path_str}: missing_lines={missing_lines}")
+        yield file_path_str, missing_lines
+
+
+class StatementTable:
+    """
+    Per-file statement lines and multi-line statement mapping, as computed by coverage's Python reporter.
+    Entries are keyed by (path, mtime, size) and optionally persisted in SQLite under `cache_dir`.
+    """
+
+    def __init__(self: Self, cov: Coverage, cache_dir: Path | None = None) -> None:
+        self._cov = cov
+        self._memory: dict[str, tuple[int, int, set[int], dict[int, int]]] = {}
+        self._conn: sqlite3.Connection | None = None
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(cache_dir / STATEMENT_CACHE_DB_NAME)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS statements ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, statements TEXT, multiline TEXT)"
+            )
+
+    def get(self: Self, path: str) -> tuple[set[int], dict[int, int]]:
+        """Returns (statement lines, {line of a multi-line statement: its first line}) for a source file."""
+        stat = os.stat(path)
+        entry = self._memory.get(path)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            return entry[2], entry[3]
+        if self._conn is not None:
+            row = self._conn.execute(
+                "SELECT statements, multiline FROM statements WHERE path = ? AND mtime_ns = ? AND size = ?",
+                (path, stat.st_mtime_ns, stat.st_size),
+            ).fetchone()
+            if row is not None:
+                cached_statements = set(json.loads(row[0]))
+                cached_multiline = {int(line): first for line, first in json.loads(row[1]).items()}
+                self._memory[path] = (stat.st_mtime_ns, stat.st_size, cached_statements, cached_multiline)
+                return cached_statements, cached_multiline
+
+        from coverage.python import PythonFileReporter
+
+        reporter = PythonFileReporter(path, coverage=self._cov)
+        statements = set(reporter.lines())
+        multiline: dict[int, int] = {}
+        for line in range(1, len(reporter.source().splitlines()) + 1):
+            if line not in statements:
+                translated = reporter.translate_lines([line])
+                if len(translated) == 1 and line not in translated:
+                    multiline[line] = next(iter(translated))
+        self._memory[path] = (stat.st_mtime_ns, stat.st_size, statements, multiline)
+        if self._conn is not None:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO statements VALUES (?, ?, ?, ?, ?)",
+                (path, stat.st_mtime_ns, stat.st_size, json.dumps(sorted(statements)), json.dumps(multiline)),
+            )
+        return statements, multiline
+
+    def close(self: Self) -> None:
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+
+
+def read_executed_lines(data_file: str) -> dict[str, set[int]]:
+    """
+    Reads the executed lines of every measured file straight from the .coverage SQLite database,
+    with one bulk query over all files and contexts.
+    """
+    from coverage.numbits import numbits_to_nums
+
+    conn = sqlite3.connect(f"file:{data_file}?mode=ro", uri=True)
+    try:
+        executed: dict[str, set[int]] = {path: set() for (path,) in conn.execute("SELECT path FROM file")}
+        has_arcs = conn.execute("SELECT value FROM meta WHERE key = 'has_arcs'").fetchone()
+        if has_arcs is not None and int(has_arcs[0]):
+            # Line numbers of arcs, without the negative entry/exit markers, deduplicated by SQLite
+            rows = conn.execute(
+                "SELECT file.path, arc_lines.line FROM ("
+                "SELECT file_id, fromno AS line FROM arc WHERE fromno > 0 "
+                "UNION SELECT file_id, tono FROM arc WHERE tono > 0"
+                ") AS arc_lines JOIN file ON file.id = arc_lines.file_id"
+            )
+            for path, line in rows:
+                executed[path].add(line)
+        else:
+            rows = conn.execute(
+                "SELECT file.path, line_bits.numbits FROM line_bits JOIN file ON file.id = line_bits.file_id"
+            )
+            for path, numbits in rows:
+                executed[path].update(numbits_to_nums(numbits))
+        return executed
+    finally:
+        conn.close()
+
+
+def _collect_missing_lines_fast(
+    data_file: str,
+    folders: list[str] | None,
+    exclude_folders: list[str] | None,
+    statement_cache_dir: Path | None,
+    only_files: list[str] | None = None,
+) -> dict[Path, list[int]]:
+    from coverage import Coverage
+
+    executed_by_file = read_executed_lines(data_file)
+    files = filter_measured_files(executed_by_file, folders, exclude_folders, only_files)
+    if len(files) != len(executed_by_file):
+        logger.info(f"Analyzing {len(files)} of {len(executed_by_file)} measured files under {folders}")
+    cov = Coverage(data_file=data_file)
+    table = StatementTable(cov, statement_cache_dir)
+    missing: dict[Path, list[int]] = {}
+    try:
+        for file_path_str in files:
+            try:
+                statements, multiline = table.get(file_path_str)
+            except OSError as e:
+                logger.warning(f"Could not analyze {file_path_str}: {e}")
+                continue
+            executed = {multiline.get(line, line) for line in executed_by_file[file_path_str]}
+            missing_lines = sorted(statements - executed)
+            if missing_lines:
+                logger.debug(f"Found {len(missing_lines)} missing lines in {file_path_str}")
+                missing[Path(file_path_str)] = missing_lines
+    finally:
+        table.close()
+    logger.info(f"Found {len(missing)} files with missing lines")
+    return missing
+
+
+def collect_missing_lines(
+    data_file: str,
+    folders: list[str] | None = None,
+    exclude_folders: list[str] | None = None,
+    workers: int | None = None,
+    fast: bool = False,
+    statement_cache_dir: Path | None = None,
+    only_files: list[str] | None = None,
+) -> dict[Path, list[int]]:
+    """
+    Returns a mapping {file: [lines without coverage]} using the .coverage file.
+    Only files under `folders` (and not under `exclude_folders`), and among `only_files` if given, are analyzed.
+    Large file sets are analyzed in parallel by a pool of `workers` processes (default: one per CPU).
+    With `fast`, executed lines are read in bulk straight from the SQLite data file and compared with
+    statement tables cached per source file (persisted under `statement_cache_dir` if given).
+    """
+    from coverage import Coverage
+
+    logger.debug(f"Collecting missing lines from {data_file}")
+    if fast:
+        return _collect_missing_lines_fast(data_file, folders, exclude_folders, statement_cache_dir, only_files)
+    cov = Coverage(data_file=data_file)
+    cov.load()
+    missing: dict[Path, list[int]] = {}
+    measured_files = cov.get_data().measured_files()
+    logger.debug(f"Measured files by coverage: {measured_files}")
+    files = filter_measured_files(measured_files, folders, exclude_folders, only_files)
+    if len(files) != len(measured_files):
+        logger.info(f"Analyzing {len(files)} of {len(measured_files)} measured files under {folders}")
+
+    workers = workers or os.cpu_count() or 1
+    analyses: Iterable[tuple[str, list[int]]]
+    if workers > 1 and len(files) >= PARALLEL_ANALYSIS_MIN_FILES:
+        analyses = _analyze_in_pool(data_file, files, workers)
+    else:
+        analyses = _analyze_serially(cov, files)
+
+    for file_path_str, missing_lines in analyses:
         if missing_lines:
             logger.debug(f"Found {len(missing_lines)} missing lines in {file_path_str}")
             missing[Path(file_path_str)] = missing_lines
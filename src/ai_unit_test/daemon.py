@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from pathlib import Path
+from typing import Any, Self
+
+from ai_unit_test.cache import DEFAULT_CACHE_DIR
+from ai_unit_test.llm import DEFAULT_KEEPALIVE_EXPIRY, DEFAULT_MAX_CONNECTIONS, LLMBackend, OpenAIBackend, open_client
+from ai_unit_test.state import WarmState
+from ai_unit_test.tracing import profiling
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = f"{DEFAULT_CACHE_DIR}/daemon.sock"
+# Commands run in the daemon; "ping" and "shutdown" control the daemon itself
+RUN_COMMANDS = ("main", "func")
+
+
+class DaemonUnavailableError(RuntimeError):
+    """Raised by the client when no daemon answers on the socket."""
+
+
+class _ForwardingHandler(logging.Handler):
+    """Sends the log records of a request back to its client, one JSON line each."""
+
+    def __init__(self: Self, writer: asyncio.StreamWriter, level: int) -> None:
+        super().__init__(level)
+        self._writer = writer
+
+    def emit(self: Self, record: logging.LogRecord) -> None:
+        try:
+            line = json.dumps({"log": self.format(record), "level": record.levelno, "logger": record.name})
+            self._writer.write(line.encode() + b"\n")
+        except Exception:
+            self.handleError(record)
+
+
+def _is_listening(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+class Daemon:
+    """
+    Serves `main` and `func` runs on a Unix socket. The LLM client and its connection pool, the coverage results,
+    the test file indexes and the parsed modules stay in memory between runs, so that a run only pays for what
+    changed. Runs are served one at a time, in the working directory of their client, and their log records are
+    sent back to it. Retries are left to the scheduler of `main` runs, as with a client opened by `main`.
+    """
+
+    def __init__(
+        self: Self,
+        socket_path: Path,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+        backend: LLMBackend | None = None,
+    ) -> None:
+        self.socket_path = socket_path.absolute()
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.backend = backend
+        self.state = WarmState()
+        self.runs = 0
+        # Set once the socket accepts requests
+        self.listening = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._stopped = asyncio.Event()
+
+    async def serve(self: Self) -> None:
+        """Listens until a shutdown request, opening the shared LLM client unless a backend was given."""
+        if self.backend is not None:
+            await self._listen()
+            return
+        async with open_client(self.max_connections, self.keepalive_expiry, max_retries=0) as client:
+            self.backend = OpenAIBackend(client)
+            await self._listen()
+
+    def stop(self: Self) -> None:
+        self._stopped.set()
+
+    async def _listen(self: Self) -> None:
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            if _is_listening(self.socket_path):
+                raise RuntimeError(f"A daemon is already listening on {self.socket_path}.")
+            # Left behind by a daemon that did not stop cleanly
+            self.socket_path.unlink()
+        server = await asyncio.start_unix_server(self._handle, path=str(self.socket_path))
+        self.listening.set()
+        logger.info(f"Daemon listening on {self.socket_path}")
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            self.socket_path.unlink(missing_ok=True)
+            logger.info(f"Daemon stopped after {self.runs} runs.")
+
+    async def _handle(self: Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request: dict[str, Any] = json.loads(await reader.readline())
+            command = request.get("command")
+            if command == "ping":
+                exit_code = 0
+            elif command == "shutdown":
+                self.stop()
+                exit_code = 0
+            elif command in RUN_COMMANDS:
+                exit_code = await self._run(request, writer)
+            else:
+                logger.error(f"Unknown daemon command: {command}")
+                exit_code = 2
+            writer.write(json.dumps({"exit_code": exit_code}).encode() + b"\n")
+            await writer.drain()
+        except (ValueError, ConnectionError) as e:
+            logger.warning(f"Dropped a daemon request: {e}")
+        finally:
+            writer.close()
+
+    async def _run(self: Self, request: dict[str, Any], writer: asyncio.StreamWriter) -> int:
+        from ai_unit_test import cli
+
+        async with self._lock:
+            self.runs += 1
+            handler = _ForwardingHandler(writer, request.get("log_level", logging.INFO))
+            root = logging.getLogger()
+            previous_level = root.level
+            root.addHandler(handler)
+            root.setLevel(min(previous_level, handler.level))
+            cwd = os.getcwd()
+            profile = request.get("profile")
+            try:
+                os.chdir(request["cwd"])
+                run = cli._main if request["command"] == "main" else cli._func
+                with profiling(Path(profile) if profile else None):
+                    await run(**request.get("options", {}), backend=self.backend, state=self.state)
+                return 0
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                logger.error(f"Daemon run failed: {e}")
+                return 1
+            finally:
+                os.chdir(cwd)
+                root.removeHandler(handler)
+                root.setLevel(previous_level)
+
+
+def send_request(
+    socket_path: Path, command: str, options: dict[str, Any] | None = None, profile: str | None = None
+) -> int:
+    """
+    Sends a command to the daemon and logs the records it sends back, as if the command ran here.
+    Returns the exit code of the command.
+    """
+    request = {
+        "command": command,
+        "cwd": os.getcwd(),
+        "options": options or {},
+        "profile": profile,
+        "log_level": logging.getLogger().getEffectiveLevel(),
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError as e:
+            raise DaemonUnavailableError(
+                f"No daemon listening on {socket_path} ({e}); start one with `ai-unit-test serve`."
+            ) from e
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as replies:
+            for line in replies:
+                reply = json.loads(line)
+                if "exit_code" in reply:
+                    return int(reply["exit_code"])
+                logging.getLogger(reply["logger"]).log(reply["level"], reply["log"])
+    raise DaemonUnavailableError(f"The daemon on {socket_path} closed the connection before the end of the run.")
@@ -1,40 +1,534 @@
 import ast
+import json
 import logging
+import os
+import re
+import stat
+import tempfile
+from collections.abc import Callable
 from dataclasses import dataclass
+from functools import cached_property
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Self
 
 logger = logging.getLogger(__name__)
 
 
+DefinitionNode = ast.ClassDef | ast.FunctionDef | ast.AsyncFunctionDef
+
+
 @dataclass
 class Chunk:
     name: str
-    type: Literal["class", "function"]
+    type: Literal["class", "method", "function"]
     source_code: str
     start_line: int
     end_line: int
+    # Headers of the enclosing definitions and the enclosing class' `__init__`
+    context: str = ""
 
 
-def find_test_file(source_file_path: str, tests_folder: str) -> Path | None:
-    """Finds the corresponding test file for a given source file."""
-    source_file = Path(source_file_path)
-    test_file_name = f"test_{source_file.name}"
-    # Look for the test file in the tests_folder and its subdirectories
-    test_files = list(Path(tests_folder).rglob(test_file_name))
-    if test_files:
-        return test_files[0]
-    return None
+# Same line splitting as `ast.get_source_segment`, so that AST column offsets line up
+_LINE_PATTERN = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$")
+
+
+class ParsedModule:
+    """
+    The text of a Python file together with its AST and the facts derived from it.
+    Each of them is computed at most once, on first access.
+    """
+
+    def __init__(self: Self, path: str, text: str) -> None:
+        self.path = path
+        self.text = text
+        self._syntax_error: SyntaxError | None = None
+
+    @cached_property
+    def tree(self: Self) -> ast.Module | None:
+        """The parsed module, or None if the file has a syntax error."""
+        try:
+            return ast.parse(self.text)
+        except SyntaxError as e:
+            self._syntax_error = e
+            return None
+
+    @property
+    def syntax_error(self: Self) -> SyntaxError | None:
+        self.tree  # noqa: B018 - parsing records the syntax error
+        return self._syntax_error
+
+    @cached_property
+    def lines(self: Self) -> list[str]:
+        return _LINE_PATTERN.findall(self.text)
+
+    def segment(self: Self, node: ast.stmt) -> str | None:
+        """Equivalent to `ast.get_source_segment`, without re-splitting the whole file on every call."""
+        if node.end_lineno is None or node.end_col_offset is None:
+            return None
+        start, end = node.lineno - 1, node.end_lineno - 1
+        col, end_col = node.col_offset, node.end_col_offset
+        if start == end:
+            return self.lines[start].encode()[col:end_col].decode()
+        first = self.lines[start].encode()[col:].decode()
+        last = self.lines[end].encode()[:end_col].decode()
+        middle = self.lines[start + 1 : end]  # noqa: E203
+        return "".join([first, *middle, last])
+
+    def header(self: Self, node: DefinitionNode) -> str:
+        """The decorators, signature and docstring of a class or function, without the rest of its body."""
+        start = _first_line(node)
+        first_statement = node.body[0]
+        if _is_docstring(first_statement) and first_statement.end_lineno is not None:
+            end = first_statement.end_lineno
+        else:
+            end = max(_first_line(first_statement) - 1, node.lineno)
+        return "".join(self.lines[start - 1 : end]).rstrip()  # noqa: E203
+
+    @cached_property
+    def chunks(self: Self) -> list[Chunk]:
+        """
+        Classes, methods, functions and nested functions of the module (async ones included),
+        with every chunk listed before the chunks nested inside it.
+        """
+        if self.tree is None:
+            return []
+        chunks: list[Chunk] = []
+        self._collect_chunks(self.tree.body, [], chunks)
+        return chunks
+
+    def _collect_chunks(self: Self, body: list[ast.stmt], enclosing: list[DefinitionNode], chunks: list[Chunk]) -> None:
+        parent = enclosing[-1] if enclosing else None
+        for node in body:
+            if not isinstance(node, DefinitionNode):
+                continue
+            source_segment = self.segment(node)
+            if source_segment is None:
+                continue
+            chunk_type: Literal["class", "method", "function"]
+            if isinstance(node, ast.ClassDef):
+                chunk_type = "class"
+            elif isinstance(parent, ast.ClassDef):
+                chunk_type = "method"
+            else:
+                chunk_type = "function"
+            chunks.append(
+                Chunk(
+                    name=".".join([*(outer.name for outer in enclosing), node.name]),
+                    type=chunk_type,
+                    source_code=source_segment,
+                    start_line=node.lineno,
+                    end_line=node.end_lineno if node.end_lineno is not None else node.lineno,
+                    context=self._chunk_context(node, enclosing),
+                )
+            )
+            self._collect_chunks(node.body, [*enclosing, node], chunks)
+
+    def _chunk_context(self: Self, node: DefinitionNode, enclosing: list[DefinitionNode]) -> str:
+        parts = [self.header(outer) for outer in enclosing]
+        parent = enclosing[-1] if enclosing else None
+        if isinstance(parent, ast.ClassDef):
+            for sibling in parent.body:
+                if isinstance(sibling, (ast.FunctionDef, ast.AsyncFunctionDef)) and sibling.name == "__init__":
+                    if sibling is not node and sibling.end_lineno is not None:
+                        init_lines = self.lines[_first_line(sibling) - 1 : sibling.end_lineno]  # noqa: E203
+                        parts.append("".join(init_lines).rstrip())
+                    break
+        return "\n".join(part for part in parts if part)
+
+    @cached_property
+    def test_words(self: Self) -> dict[ast.stmt, set[str]]:
+        """The identifier words of every test of the module, which rank the tests by similarity to new code."""
+        if self.tree is None:
+            return {}
+        return {test: _words(_source(self, test)) for test in _collect_tests(self.tree)[0]}
+
+    @cached_property
+    def test_style(self: Self) -> str:
+        """Whether the module holds unittest.TestCase classes or pytest functions ("unknown" if unparsable)."""
+        if not self.text or self.tree is None:
+            return "unknown"
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.ClassDef):
+                for base in node.bases:
+                    if isinstance(base, ast.Attribute) and base.attr == "TestCase":
+                        return "unittest_class"
+                    elif isinstance(base, ast.Name) and base.id == "TestCase":
+                        return "unittest_class"
+        # If no TestCase classes are found, assume pytest function style
+        return "pytest_function"
+
+
+def _first_line(node: ast.stmt) -> int:
+    """The first line of a statement, including its decorators."""
+    decorators: list[ast.expr] = getattr(node, "decorator_list", [])
+    return min([node.lineno, *(decorator.lineno for decorator in decorators)])
+
+
+def _is_docstring(node: ast.stmt) -> bool:
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+def assign_uncovered_lines(chunks: list[Chunk], uncovered_lines: list[int]) -> list[tuple[Chunk, list[int]]]:
+    """
+    Maps every uncovered line to the innermost chunk enclosing it and returns the chunks that got lines,
+    in chunk order. `chunks` must list outer chunks before the chunks nested inside them.
+    """
+    uncovered = set(uncovered_lines)
+    owner: dict[int, int] = {}
+    for position, chunk in enumerate(chunks):
+        for line in range(chunk.start_line, chunk.end_line + 1):
+            if line in uncovered:
+                owner[line] = position  # Inner chunks come later and override their enclosing chunk
+    lines_by_chunk: dict[int, list[int]] = {}
+    for line in sorted(owner):
+        lines_by_chunk.setdefault(owner[line], []).append(line)
+    return [(chunks[position], lines) for position, lines in sorted(lines_by_chunk.items())]
+
+
+# Existing tests kept in the context of a new test, the most similar to the code to test
+SIMILAR_TESTS = 3
+# Kept with the header of a test class, along with its class attributes
+_FIXTURE_METHODS = frozenset(
+    {
+        "setUp",
+        "tearDown",
+        "setUpClass",
+        "tearDownClass",
+        "asyncSetUp",
+        "asyncTearDown",
+        "setup_method",
+        "teardown_method",
+        "setup_class",
+        "teardown_class",
+    }
+)
+_WORD_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+")
+# Words found in nearly every test, which say nothing about what it tests
+_COMMON_WORDS = frozenset({"self", "cls", "test", "tests", "assert", "def", "return", "none", "true", "false"})
+
+ImportNode = ast.Import | ast.ImportFrom
+
+
+def _is_test(node: ast.stmt) -> bool:
+    return isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test")
+
+
+def _is_autouse_fixture(node: ast.stmt) -> bool:
+    if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return False
+    return any(
+        keyword.arg == "autouse" and isinstance(keyword.value, ast.Constant) and keyword.value.value is True
+        for decorator in node.decorator_list
+        if isinstance(decorator, ast.Call)
+        for keyword in decorator.keywords
+    )
+
+
+def _words(text: str) -> set[str]:
+    """The lowercase words of the identifiers in `text`, split on underscores and camel case."""
+    words = {word.lower() for word in _WORD_PATTERN.findall(text)}
+    return {word for word in words if len(word) > 2 and word not in _COMMON_WORDS}
+
+
+def _defined_names(node: ast.stmt) -> set[str]:
+    if isinstance(node, DefinitionNode):
+        return {node.name}
+    if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        return {name.id for target in targets for name in ast.walk(target) if isinstance(name, ast.Name)}
+    return set()
+
+
+def _used_names(nodes: list[ast.AST]) -> set[str]:
+    """
+    Names that `nodes` refer to: variables, arguments (which may be pytest fixtures) and attributes of `self`
+    or `cls` (which may be helper methods or class attributes).
+    """
+    names: set[str] = set()
+    for node in nodes:
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name):
+                names.add(child.id)
+            elif isinstance(child, ast.arg):
+                names.add(child.arg)
+            elif isinstance(child, ast.Attribute) and isinstance(child.value, ast.Name):
+                if child.value.id in ("self", "cls"):
+                    names.add(child.attr)
+    return names
+
+
+def _with_dependencies(
+    kept: list[ast.stmt], candidates: list[ast.stmt], parts: Callable[[ast.stmt], list[ast.AST]]
+) -> set[ast.stmt]:
+    """Adds to `kept` the candidates defining a name used by a kept statement, until none is missing."""
+    selected = set(kept)
+    used = _used_names([part for node in kept for part in parts(node)])
+    added = True
+    while added:
+        added = False
+        for node in candidates:
+            if node not in selected and _defined_names(node) & used:
+                selected.add(node)
+                used |= _used_names(parts(node))
+                added = True
+    return selected
+
+
+def _source(module: ParsedModule, node: ast.stmt) -> str:
+    end = node.end_lineno if node.end_lineno is not None else node.lineno
+    return "".join(module.lines[_first_line(node) - 1 : end]).rstrip()  # noqa: E203
+
+
+def _class_members(cls: ast.ClassDef, selected_tests: set[ast.stmt]) -> list[ast.stmt]:
+    """
+    The members of a test class kept in its slice: the selected tests, the fixture methods, the class attributes
+    and the helper methods they use.
+    """
+    members = [member for member in cls.body if not (member is cls.body[0] and _is_docstring(member))]
+    kept = [
+        member
+        for member in members
+        if member in selected_tests
+        or (not isinstance(member, DefinitionNode) and not _is_test(member))
+        or (isinstance(member, DefinitionNode) and member.name in _FIXTURE_METHODS)
+    ]
+    helpers = [member for member in members if not _is_test(member)]
+    selected = _with_dependencies(kept, helpers, lambda node: [node])
+    return [member for member in members if member in selected]
+
+
+def _collect_tests(tree: ast.Module) -> tuple[list[ast.stmt], dict[ast.stmt, ast.ClassDef]]:
+    """The tests of a module, in file order, and the class of each test method."""
+    tests: list[ast.stmt] = []
+    test_classes: dict[ast.stmt, ast.ClassDef] = {}
+    for node in tree.body:
+        if _is_test(node):
+            tests.append(node)
+        elif isinstance(node, ast.ClassDef):
+            for member in node.body:
+                if _is_test(member):
+                    tests.append(member)
+                    test_classes[member] = node
+    return tests, test_classes
+
+
+def _render_slice(
+    module: ParsedModule, body: list[ast.stmt], selected: set[ast.stmt], members: dict[ast.ClassDef, list[ast.stmt]]
+) -> str:
+    pieces: list[str] = []
+    previous: ast.stmt | None = None
+    for position, node in enumerate(body):
+        if node not in selected:
+            continue
+        if isinstance(node, ast.ClassDef) and node in members:
+            text = "\n\n".join([module.header(node), *(_source(module, member) for member in members[node])])
+        else:
+            text = _source(module, node)
+        if previous is not None and position > 0 and body[position - 1] is previous and previous.end_lineno:
+            # Statements next to each other in the file keep the blank lines and comments between them
+            pieces.append("\n" + "".join(module.lines[previous.end_lineno : _first_line(node) - 1]))  # noqa: E203
+        elif previous is not None:
+            pieces.append("\n" if isinstance(previous, ImportNode) and isinstance(node, ImportNode) else "\n\n\n")
+        pieces.append(text)
+        previous = node
+    return "".join(pieces) + "\n"
 
 
-def find_relevant_tests(source_file_path: str, tests_folder: str) -> str:
+def slice_test_context(module: ParsedModule, target_source: str, max_tests: int = SIMILAR_TESTS) -> str:
+    """
+    The part of a test module a new test for `target_source` needs: its imports, the `max_tests` existing tests
+    most similar to the target (by shared identifier words), the headers, fixture methods and class attributes
+    of their test classes, and the fixtures, helpers and constants they use, in file order. Modules with no more
+    tests than that, or that cannot be parsed, are returned whole.
+    """
+    if module.tree is None:
+        return module.text
+    tests, test_classes = _collect_tests(module.tree)
+    if len(tests) <= max_tests:
+        return module.text
+
+    target_words = _words(target_source)
+
+    def similarity(test: ast.stmt) -> float:
+        words = module.test_words[test]
+        return len(words & target_words) / max(len(words | target_words), 1)
+
+    ranked = sorted(range(len(tests)), key=lambda position: (-similarity(tests[position]), position))
+    selected_tests = {tests[position] for position in ranked[:max_tests]}
+    members = {cls: _class_members(cls, selected_tests) for cls in set(test_classes.values())}
+
+    def parts(node: ast.stmt) -> list[ast.AST]:
+        if isinstance(node, ast.ClassDef) and node in members:
+            return [*node.bases, *node.decorator_list, *members[node]]
+        return [node]
+
+    selected_classes = {test_classes[test] for test in selected_tests if test in test_classes}
+    kept = [
+        node
+        for node in module.tree.body
+        if isinstance(node, ImportNode)
+        or node in selected_tests
+        or node in selected_classes
+        or _is_autouse_fixture(node)
+    ]
+    candidates = [node for node in module.tree.body if not _is_test(node)]
+    selected = _with_dependencies(kept, candidates, parts)
+    return _render_slice(module, module.tree.body, selected, members)
+
+
+class ModuleCache:
+    """
+    Keeps one ParsedModule per file, keyed by (path, mtime, size), so each file is read and parsed
+    at most once as long as it does not change.
+    """
+
+    def __init__(self: Self) -> None:
+        self._entries: dict[str, tuple[tuple[int, int], ParsedModule]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self: Self, file_path: Path | str) -> ParsedModule:
+        path = str(file_path)
+        try:
+            stat = os.stat(path)
+            key: tuple[int, int] | None = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            key = None  # Not cacheable, read_file_content reports the problem
+        if key is not None:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        module = ParsedModule(path, read_file_content(path))
+        if key is not None:
+            self._entries[path] = (key, module)
+        return module
+
+    def invalidate(self: Self, file_path: Path | str) -> None:
+        self._entries.pop(str(file_path), None)
+
+    def clear(self: Self) -> None:
+        self._entries.clear()
+
+
+module_cache = ModuleCache()
+
+
+def parse_module(file_path: Path | str) -> ParsedModule:
+    """Returns the parsed module for a file from the shared per-process module cache."""
+    return module_cache.get(file_path)
+
+
+TEST_INDEX_VERSION = 1
+TEST_INDEX_FILE = "test_index.json"
+
+
+class TestFileIndex:
+    """
+    Maps test file basenames to their paths under a tests folder, built with a single directory walk.
+    The modification time of every walked directory is kept so a persisted index can be validated cheaply.
+    """
+
+    __test__ = False  # Not a pytest test class
+
+    def __init__(self: Self, tests_folder: str, files: dict[str, list[str]], dir_mtimes: dict[str, int]) -> None:
+        self.tests_folder = tests_folder
+        self.files = files
+        self.dir_mtimes = dir_mtimes
+
+    @classmethod
+    def build(cls: type[Self], tests_folder: str) -> Self:
+        """Walks the tests folder once and indexes every `test_*` file by basename."""
+        files: dict[str, list[str]] = {}
+        dir_mtimes: dict[str, int] = {}
+        for dir_path, dir_names, file_names in os.walk(tests_folder):
+            dir_names.sort()
+            dir_mtimes[dir_path] = os.stat(dir_path).st_mtime_ns
+            for file_name in file_names:
+                if file_name.startswith("test_"):
+                    files.setdefault(file_name, []).append(os.path.join(dir_path, file_name))
+        logger.debug(f"Indexed {sum(len(p) for p in files.values())} test files in {len(dir_mtimes)} directories.")
+        return cls(tests_folder, files, dir_mtimes)
+
+    @classmethod
+    def load_or_build(cls: type[Self], tests_folder: str, index_path: Path | None) -> Self:
+        """
+        Loads a persisted index if none of its directories changed since it was saved,
+        otherwise rebuilds it and saves it to `index_path`.
+        """
+        if index_path is not None and index_path.exists():
+            try:
+                data = json.loads(index_path.read_text())
+                index = cls(data["tests_folder"], data["files"], data["dir_mtimes"])
+                if (
+                    data.get("version") == TEST_INDEX_VERSION
+                    and index.tests_folder == tests_folder
+                    and index.is_fresh()
+                ):
+                    logger.debug(f"Reusing test file index from {index_path}")
+                    return index
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not read test file index {index_path}: {e}")
+        index = cls.build(tests_folder)
+        if index_path is not None:
+            index.save(index_path)
+        return index
+
+    def is_fresh(self: Self) -> bool:
+        """Returns True if no indexed directory was modified (files added, removed or renamed) since indexing."""
+        try:
+            return all(os.stat(d).st_mtime_ns == mtime for d, mtime in self.dir_mtimes.items())
+        except OSError:
+            return False
+
+    def save(self: Self, index_path: Path) -> None:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": TEST_INDEX_VERSION,
+            "tests_folder": self.tests_folder,
+            "files": self.files,
+            "dir_mtimes": self.dir_mtimes,
+        }
+        index_path.write_text(json.dumps(data))
+
+    def find(self: Self, source_file_path: str) -> Path | None:
+        """
+        Returns the test file for a source file. When several test files share the same name, the one whose
+        directories best match the source file's directories wins, then the shallowest, then the first by path.
+        """
+        source_file = Path(source_file_path)
+        candidates = self.files.get(f"test_{source_file.name}")
+        if not candidates:
+            return None
+        source_dirs = set(source_file.parent.parts)
+
+        def rank(candidate: str) -> tuple[int, int, str]:
+            candidate_dirs = Path(os.path.relpath(candidate, self.tests_folder)).parent.parts
+            shared = sum(1 for part in candidate_dirs if part in source_dirs)
+            return (-shared, len(candidate_dirs), candidate)
+
+        return Path(min(candidates, key=rank))
+
+
+def find_test_file(source_file_path: str, tests_folder: str, index: TestFileIndex | None = None) -> Path | None:
+    """
+    Finds the corresponding test file for a given source file.
+    Pass an `index` built once per run to avoid walking the tests folder for every source file.
+    """
+    if index is None:
+        index = TestFileIndex.build(tests_folder)
+    return index.find(source_file_path)
+
+
+def find_relevant_tests(source_file_path: str, tests_folder: str, index: TestFileIndex | None = None) -> str:
     """
     Finds the most relevant test file for a given source file and returns its content.
     The primary strategy is to find a test file with a similar name.
     """
-    test_file_path = find_test_file(source_file_path, tests_folder)
+    test_file_path = find_test_file(source_file_path, tests_folder, index)
     if test_file_path:
-        return read_file_content(test_file_path)
+        return parse_module(test_file_path).text
     return ""
 
 
@@ -52,12 +546,64 @@ def write_file_content(file_path: Path, content: str, mode: str = "w") -> None:
     """Writes content to a file."""
     with open(file_path, mode) as f:
         f.write(content)
+    module_cache.invalidate(file_path)
+
+
+def write_file_atomic(file_path: Path, content: str) -> None:
+    """
+    Writes content to a file through a temporary file renamed over it, so that readers (and a crash)
+    only ever see the old or the new content. The permissions of an existing file are kept.
+    """
+    mode = stat.S_IMODE(file_path.stat().st_mode) if file_path.exists() else 0o644
+    fd, tmp_name = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    module_cache.invalidate(file_path)
+
+
+def _top_level_tests(code: str) -> list[DefinitionNode]:
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+    return [node for node in tree.body if isinstance(node, DefinitionNode) and node.name.startswith(("test", "Test"))]
+
+
+def _rename_clashing_tests(existing_content: str, new_test: str) -> str:
+    """
+    Renames the top-level tests (and test classes) of `new_test` already defined in `existing_content` with a
+    numbered suffix: appended as they are, they would silently shadow the existing ones.
+    """
+    taken = {node.name for node in _top_level_tests(existing_content)}
+    lines = new_test.splitlines(keepends=True)
+    for node in _top_level_tests(new_test):
+        if node.name not in taken:
+            taken.add(node.name)
+            continue
+        suffix = 2
+        while f"{node.name}_{suffix}" in taken:
+            suffix += 1
+        new_name = f"{node.name}_{suffix}"
+        taken.add(new_name)
+        lines[node.lineno - 1] = re.sub(
+            rf"^(\s*(?:async\s+)?(?:def|class)\s+){node.name}\b", rf"\g<1>{new_name}", lines[node.lineno - 1]
+        )
+        logger.debug(f"Renamed new test '{node.name}' to '{new_name}', already defined in the test file.")
+    return "".join(lines)
 
 
 def insert_new_test(existing_content: str, new_test: str) -> str:
     """
     Inserts a new test into the existing content, before the `if __name__ == "__main__":` block if it exists.
+    New tests named like existing ones are renamed rather than shadowing them.
     """
+    new_test = _rename_clashing_tests(existing_content, new_test)
     main_guard = 'if __name__ == "__main__":'
     if main_guard in existing_content:
         parts = existing_content.split(main_guard)
@@ -70,12 +616,12 @@ def insert_new_test(existing_content: str, new_test: str) -> str:
 def extract_function_source(file_path: str, function_name: str) -> str | None:
     """Extracts the source code of a specific function from a file."""
     try:
-        with open(file_path) as f:
-            file_content = f.read()
-            tree = ast.parse(file_content)
-            for node in ast.walk(tree):
-                if isinstance(node, ast.FunctionDef) and node.name == function_name:
-                    return ast.get_source_segment(file_content, node)
+        module = parse_module(file_path)
+        if module.tree is None:
+            raise module.syntax_error or SyntaxError(f"Could not parse {file_path}")
+        for node in ast.walk(module.tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == function_name:
+                return module.segment(node)
     except (FileNotFoundError, SyntaxError) as e:
         logger.error(f"Error reading or parsing {file_path}: {e}")
     return None
@@ -83,30 +629,13 @@ def extract_function_source(file_path: str, function_name: str) -> str | None:
 
 def get_source_code_chunks(file_path: Path) -> list[Chunk]:
     """
-    Extracts top-level classes and functions from a Python file as code chunks.
+    Extracts classes, methods and functions (nested ones included) from a Python file as code chunks.
     """
-    chunks: list[Chunk] = []
     try:
-        file_content = read_file_content(file_path)
-        tree = ast.parse(file_content)
-
-        for node in tree.body:
-            if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
-                source_segment = ast.get_source_segment(file_content, node)
-                if source_segment is not None:
-                    chunks.append(
-                        Chunk(
-                            name=node.name,
-                            type="class" if isinstance(node, ast.ClassDef) else "function",
-                            source_code=source_segment,
-                            start_line=node.lineno,
-                            end_line=(
-                                node.end_lineno
-                                if hasattr(node, "end_lineno") and node.end_lineno is not None
-                                else node.lineno
-                            ),
-                        )
-                    )
+        module = parse_module(file_path)
+        if module.syntax_error is not None:
+            raise module.syntax_error
+        return module.chunks
     except (FileNotFoundError, SyntaxError) as e:
         logger.error(f"Error reading or parsing {file_path}: {e}")
-    return chunks
+    return []
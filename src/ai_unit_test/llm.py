@@ -1,36 +1,145 @@
+from __future__ import annotations
+
+import json
 import logging
 import os
+import time
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Self
+
+from ai_unit_test.cache import ResponseCache
+from ai_unit_test.file_helper import Chunk
+from ai_unit_test.prompt import (
+    DEFAULT_MAX_PROMPT_TOKENS,
+    BuiltPrompt,
+    PromptSection,
+    build_prompt,
+    estimate_tokens,
+)
+from ai_unit_test.scheduler import COMPLETION_TOKENS_ESTIMATE, RateLimitScheduler
+from ai_unit_test.streaming import IncrementalTestParser, MalformedResponseError
+from ai_unit_test.tracing import span
+from ai_unit_test.usage import TokenUsage
 
-from openai import AsyncOpenAI
+# openai, and httpx and pydantic with it, take most of the start-up time of the CLI: they are imported by the
+# functions that talk to the API, so that commands failing early or printing help do not pay for them.
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from openai.types import CompletionUsage
+    from openai.types.chat import ChatCompletionMessageParam
 
 logger = logging.getLogger(__name__)
 
 MODEL = "gpt-4o-mini"
+TEMPERATURE = 0.1
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
 
 
-async def update_test_with_llm(
-    source_code: str,
-    test_code: str,
-    file_name: str,
-    coverage_lines: list[int],
-    other_tests_content: str,
-    test_style: str,
-) -> str:
-    """Calls the chat model to generate the new test file."""
-    logger.info(f"Updating test for {file_name} with LLM.")
-    logger.debug(
-        f"Source code length: {len(source_code)}, Test code length: {len(test_code)}, Uncovered lines: {coverage_lines}"
-    )
+class MissingAPIKeyError(RuntimeError):
+    """Raised when a client is needed but the OPENAI_API_KEY environment variable is not set."""
+
+
+@dataclass
+class GenerationTiming:
+    """
+    Latency of one completion, in seconds, and its token usage when the backend reports it. Without streaming
+    the whole response arrives at once, so the time to first token is the total time.
+    """
+
+    time_to_first_token: float | None = None
+    total_time: float | None = None
+    cached: bool = False
+    usage: TokenUsage | None = None
+
+
+class LLMBackend(ABC):
+    """Answers chat completion requests. The OpenAI API is the default backend; others record or replay it."""
+
+    @abstractmethod
+    async def complete(
+        self: Self,
+        system_msg: str,
+        user_msg: str,
+        json_output: bool = False,
+        stream: bool = False,
+        timing: GenerationTiming | None = None,
+    ) -> str:
+        """Returns the completion of the messages, filling `timing` when one is given."""
+
+
+class OpenAIBackend(LLMBackend):
+    """Sends requests to the OpenAI API through a shared client."""
+
+    def __init__(self: Self, client: AsyncOpenAI) -> None:
+        self.client = client
+
+    async def complete(
+        self: Self,
+        system_msg: str,
+        user_msg: str,
+        json_output: bool = False,
+        stream: bool = False,
+        timing: GenerationTiming | None = None,
+    ) -> str:
+        return await _request_completion(self.client, system_msg, user_msg, json_output, stream, timing)
+
+
+def create_client(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+    max_retries: int | None = None,
+) -> AsyncOpenAI:
+    """
+    Creates an AsyncOpenAI client backed by a pooled keep-alive HTTP connection pool.
+    `max_retries` is the number of retries done by the client itself (default: the SDK default); use 0 when a
+    scheduler retries requests.
+    """
+    import httpx
+    from openai import DEFAULT_MAX_RETRIES, AsyncOpenAI
 
     api_key_val: str | None = os.environ.get("OPENAI_API_KEY")
     if not api_key_val:
-        logger.error("OPENAI_API_KEY environment variable not set.")
-        raise RuntimeError("Set the OPENAI_API_KEY environment variable with your OpenAI key.")
+        raise MissingAPIKeyError("Set the OPENAI_API_KEY environment variable with your OpenAI key.")
 
     api_url: str | None = os.environ.get("OPENAI_API_URL")
 
-    client: AsyncOpenAI = AsyncOpenAI(api_key=api_key_val, base_url=api_url)
+    logger.debug(f"Creating OpenAI client: max_connections={max_connections}, keepalive_expiry={keepalive_expiry}")
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+    )
+    return AsyncOpenAI(
+        api_key=api_key_val,
+        base_url=api_url,
+        http_client=http_client,
+        max_retries=DEFAULT_MAX_RETRIES if max_retries is None else max_retries,
+    )
+
+
+@asynccontextmanager
+async def open_client(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+    max_retries: int | None = None,
+) -> AsyncIterator[AsyncOpenAI]:
+    """Opens a client session to be shared by every request of a run and closes it afterwards."""
+    client = create_client(max_connections, keepalive_expiry, max_retries)
+    try:
+        yield client
+    finally:
+        await client.close()
+        logger.debug("OpenAI client closed.")
+
 
+def _system_message(test_style: str) -> str:
+    """Builds the system message for the detected test style."""
     system_msg_base = (
         "You are an expert Python test developer. Your task is to write new unit tests to cover missing lines "
         "in a given code chunk. You must follow the style of existing tests provided as reference. "
@@ -48,46 +157,357 @@ async def update_test_with_llm(
     else:
         system_msg_specific = "Generate a new test function or method, adapting to the existing test file's style."
 
-    system_msg = f"{system_msg_base} {system_msg_specific}"
+    return f"{system_msg_base} {system_msg_specific}"
 
-    user_msg: str = f"""Here is the information for the test generation:
 
-<file_to_be_tested>
-{file_name}
-</file_to_be_tested>
+def _log_prompt(file_name: str, system_msg: str, prompt: BuiltPrompt) -> None:
+    logger.info(
+        f"Prompt for {file_name}: ~{prompt.total_tokens + estimate_tokens(system_msg)} tokens "
+        f"(system={estimate_tokens(system_msg)}, "
+        + ", ".join(f"{name}={tokens}" for name, tokens in prompt.section_tokens.items())
+        + ")"
+    )
+    if prompt.dropped or prompt.trimmed:
+        logger.debug(f"Prompt context dropped: {prompt.dropped}, trimmed: {prompt.trimmed}")
+    logger.debug(f"User message for LLM: {prompt.text}")
 
-<uncovered_lines>
-{coverage_lines}
-</uncovered_lines>
 
-<source_code_chunk>
-{source_code}
-</source_code_chunk>
+def build_chunk_prompt(
+    source_code: str,
+    test_code: str,
+    file_name: str,
+    coverage_lines: list[int],
+    other_tests_content: str,
+    test_style: str,
+    chunk_context: str = "",
+    max_prompt_tokens: int | None = DEFAULT_MAX_PROMPT_TOKENS,
+) -> tuple[str, BuiltPrompt]:
+    """Returns the system message and the prompt of a request for a single chunk."""
+    system_msg = _system_message(test_style)
 
-<existing_tests>
-{test_code}
-</existing_tests>
+    # Existing tests and style references often are the same file: duplicates are dropped, then the least
+    # valuable context is trimmed to fit the token budget.
+    prompt = build_prompt(
+        "Here is the information for the test generation:",
+        [
+            PromptSection("file_to_be_tested", file_name, priority=100, trimmable=False),
+            PromptSection("uncovered_lines", str(coverage_lines), priority=100, trimmable=False),
+            PromptSection("enclosing_context", chunk_context, priority=50),
+            PromptSection("source_code_chunk", source_code, priority=90, trimmable=False),
+            PromptSection("existing_tests", test_code, priority=30),
+            PromptSection("style_reference_tests", other_tests_content, priority=10),
+        ],
+        max_tokens=max_prompt_tokens,
+        reserved_tokens=estimate_tokens(system_msg),
+    )
+    return system_msg, prompt
 
-<style_reference_tests>
-{other_tests_content}
-</style_reference_tests>
-"""
 
-    logger.debug(f"User message for LLM: {user_msg}")
+async def update_test_with_llm(
+    source_code: str,
+    test_code: str,
+    file_name: str,
+    coverage_lines: list[int],
+    other_tests_content: str,
+    test_style: str,
+    client: AsyncOpenAI | LLMBackend | None = None,
+    cache: ResponseCache | None = None,
+    chunk_context: str = "",
+    max_prompt_tokens: int | None = DEFAULT_MAX_PROMPT_TOKENS,
+    stream: bool = False,
+    timing: GenerationTiming | None = None,
+    scheduler: RateLimitScheduler | None = None,
+) -> str:
+    """
+    Calls the chat model to generate the new test file.
+    `client` is a shared OpenAI client or another `LLMBackend`; when none is given, a short-lived OpenAI client
+    is opened for this call only.
+    Responses are looked up in and stored to `cache` when one is given.
+    `chunk_context` carries the enclosing class/function headers of a nested chunk.
+    Duplicated context is removed and the prompt is trimmed to about `max_prompt_tokens` tokens.
+    With `stream`, the response is checked while it arrives and a malformed one is cancelled early.
+    The latency of the request is recorded in `timing` when one is given.
+    A `scheduler` paces the request within the rate limits and retries it on throttling and server errors.
+    """
+    logger.info(f"Updating test for {file_name} with LLM.")
+    logger.debug(
+        f"Source code length: {len(source_code)}, Test code length: {len(test_code)}, Uncovered lines: {coverage_lines}"
+    )
+
+    with span("prompt_build", file=file_name):
+        system_msg, prompt = build_chunk_prompt(
+            source_code,
+            test_code,
+            file_name,
+            coverage_lines,
+            other_tests_content,
+            test_style,
+            chunk_context,
+            max_prompt_tokens,
+        )
+    _log_prompt(file_name, system_msg, prompt)
+    return await _complete(
+        file_name, system_msg, prompt.text, client, cache, stream=stream, timing=timing, scheduler=scheduler
+    )
+
+
+async def _complete(
+    file_name: str,
+    system_msg: str,
+    user_msg: str,
+    client: AsyncOpenAI | LLMBackend | None,
+    cache: ResponseCache | None,
+    json_output: bool = False,
+    stream: bool = False,
+    timing: GenerationTiming | None = None,
+    scheduler: RateLimitScheduler | None = None,
+) -> str:
+    """Returns the cached response for the messages, or requests a completion and caches it."""
+    cache_key: str | None = None
+    if cache is not None:
+        cache_key = cache.make_key(MODEL, system_msg, user_msg, TEMPERATURE)
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            logger.info(f"Using cached LLM response for {file_name}.")
+            if timing is not None:
+                timing.cached = True
+            return cached_response
+
+    async def send(backend: LLMBackend) -> str:
+        if scheduler is None:
+            return await backend.complete(system_msg, user_msg, json_output, stream, timing)
+        estimated_tokens = estimate_tokens(system_msg) + estimate_tokens(user_msg) + COMPLETION_TOKENS_ESTIMATE
+        return await scheduler.run(
+            lambda: backend.complete(system_msg, user_msg, json_output, stream, timing), estimated_tokens
+        )
+
+    with span("llm_wait", file=file_name):
+        if client is None:
+            async with open_client() as own_client:
+                response_content = await send(OpenAIBackend(own_client))
+        elif isinstance(client, LLMBackend):
+            response_content = await send(client)
+        else:
+            response_content = await send(OpenAIBackend(client))
+
+    if cache is not None and cache_key is not None:
+        cache.set(cache_key, response_content)
+    return response_content
+
+
+def chunk_prompt_tokens(chunk: Chunk, coverage_lines: list[int]) -> int:
+    """Estimates the tokens a chunk adds to a batched prompt, used to cap the size of a batch."""
+    return estimate_tokens(chunk.name) + estimate_tokens(str(coverage_lines)) + estimate_tokens(chunk.source_code)
+
+
+def parse_batch_response(content: str, chunk_names: list[str]) -> dict[str, str]:
+    """
+    Extracts the test code of each requested chunk from a batched JSON response.
+    Entries for unknown chunks, empty entries and malformed responses are ignored.
+    """
+    text = content.strip()
+    if text.startswith("```"):
+        # Some models wrap JSON in a markdown fence despite the instructions
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
     try:
-        rsp = await client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": system_msg},
-                {"role": "user", "content": user_msg},
-            ],
-            temperature=0.1,
+        data = json.loads(text)
+    except ValueError as e:
+        logger.error(f"Could not parse batched LLM response as JSON: {e}")
+        return {}
+    if isinstance(data, dict) and isinstance(data.get("tests"), dict):
+        data = data["tests"]
+    if not isinstance(data, dict):
+        logger.error("Batched LLM response is not a JSON object.")
+        return {}
+    return {name: code for name, code in data.items() if name in chunk_names and isinstance(code, str) and code.strip()}
+
+
+def build_batch_prompt(
+    chunks: list[tuple[Chunk, list[int]]],
+    test_code: str,
+    file_name: str,
+    other_tests_content: str,
+    test_style: str,
+    max_prompt_tokens: int | None = DEFAULT_MAX_PROMPT_TOKENS,
+) -> tuple[str, BuiltPrompt]:
+    """
+    Returns the system message and the prompt of a request for several chunks of a source file, which asks for
+    a JSON object mapping each chunk name to its test.
+    """
+    system_msg = (
+        f"{_system_message(test_style)} "
+        "Several code chunks are given, each one with its name. Write the tests of every chunk and respond "
+        'with a JSON object only, mapping each chunk name to its new test code, like {"chunk_name": "<test code>"}.'
+    )
+
+    # Methods of the same class share their enclosing context, which is sent only once
+    contexts = list(dict.fromkeys(chunk.context for chunk, _ in chunks if chunk.context))
+    sections = [
+        PromptSection("file_to_be_tested", file_name, priority=100, trimmable=False),
+        PromptSection("enclosing_context", "\n\n".join(contexts), priority=50),
+    ]
+    for position, (chunk, coverage_lines) in enumerate(chunks, start=1):
+        sections.append(
+            PromptSection(
+                f"chunk_{position}",
+                f"name: {chunk.name}\nuncovered_lines: {coverage_lines}\n{chunk.source_code}",
+                priority=90,
+                trimmable=False,
+            )
         )
-        response_content: str | None = rsp.choices[0].message.content
-        if response_content is None:
-            response_content = ""
+    sections += [
+        PromptSection("existing_tests", test_code, priority=30),
+        PromptSection("style_reference_tests", other_tests_content, priority=10),
+    ]
+    prompt = build_prompt(
+        "Here is the information for the test generation:",
+        sections,
+        max_tokens=max_prompt_tokens,
+        reserved_tokens=estimate_tokens(system_msg),
+    )
+    return system_msg, prompt
+
+
+async def update_tests_batch_with_llm(
+    chunks: list[tuple[Chunk, list[int]]],
+    test_code: str,
+    file_name: str,
+    other_tests_content: str,
+    test_style: str,
+    client: AsyncOpenAI | LLMBackend | None = None,
+    cache: ResponseCache | None = None,
+    max_prompt_tokens: int | None = DEFAULT_MAX_PROMPT_TOKENS,
+    stream: bool = False,
+    timing: GenerationTiming | None = None,
+    scheduler: RateLimitScheduler | None = None,
+) -> dict[str, str]:
+    """
+    Generates tests for several chunks of the same source file in a single request.
+    The test file and style references are sent once for the whole batch, and the model answers with a JSON
+    object mapping each chunk name to its new test code. Returns {chunk name: test code} for the chunks answered.
+    """
+    chunk_names = [chunk.name for chunk, _ in chunks]
+    logger.info(f"Updating tests for {file_name} with LLM, batching {len(chunks)} chunks: {chunk_names}")
+
+    with span("prompt_build", file=file_name, chunks=len(chunks)):
+        system_msg, prompt = build_batch_prompt(
+            chunks, test_code, file_name, other_tests_content, test_style, max_prompt_tokens
+        )
+    _log_prompt(file_name, system_msg, prompt)
+
+    response_content = await _complete(
+        file_name,
+        system_msg,
+        prompt.text,
+        client,
+        cache,
+        json_output=True,
+        stream=stream,
+        timing=timing,
+        scheduler=scheduler,
+    )
+    tests = parse_batch_response(response_content, chunk_names)
+    missing = [name for name in chunk_names if name not in tests]
+    if missing:
+        logger.warning(f"Batched LLM response for {file_name} has no test for chunks: {missing}")
+    return tests
+
+
+async def _request_completion(
+    client: AsyncOpenAI,
+    system_msg: str,
+    user_msg: str,
+    json_output: bool = False,
+    stream: bool = False,
+    timing: GenerationTiming | None = None,
+) -> str:
+    """Sends the chat completion request and returns the response text."""
+    from openai import omit
+
+    messages: list[ChatCompletionMessageParam] = [
+        {"role": "system", "content": system_msg},
+        {"role": "user", "content": user_msg},
+    ]
+    started = time.perf_counter()
+    if timing is not None:
+        # A retried request is timed from its last attempt
+        timing.time_to_first_token = None
+        timing.usage = None
+    try:
+        if stream:
+            response_content = await _stream_completion(client, messages, json_output, started, timing)
+        else:
+            rsp = await client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=TEMPERATURE,
+                response_format={"type": "json_object"} if json_output else omit,
+            )
+            response_content = rsp.choices[0].message.content or ""
+            if timing is not None:
+                timing.time_to_first_token = time.perf_counter() - started
+                timing.usage = _token_usage(rsp.usage)
+        if timing is not None:
+            timing.total_time = time.perf_counter() - started
         logger.debug(f"LLM response received: {response_content[:100]}...")
         return response_content
     except Exception as e:
         logger.error(f"Error calling OpenAI API: {e}")
         raise
+
+
+def _token_usage(usage: CompletionUsage | None) -> TokenUsage | None:
+    if usage is None:
+        return None
+    details = usage.prompt_tokens_details
+    cached_tokens = details.cached_tokens if details is not None and details.cached_tokens else 0
+    return TokenUsage(usage.prompt_tokens, usage.completion_tokens, cached_tokens)
+
+
+async def _stream_completion(
+    client: AsyncOpenAI,
+    messages: list[ChatCompletionMessageParam],
+    json_output: bool,
+    started: float,
+    timing: GenerationTiming | None,
+) -> str:
+    """
+    Streams the completion. Test code is checked block by block as it arrives and the request is cancelled
+    as soon as a complete block is not valid Python. JSON responses are only collected.
+    """
+    from openai import omit
+
+    response_stream = await client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        temperature=TEMPERATURE,
+        response_format={"type": "json_object"} if json_output else omit,
+        stream=True,
+        # The usage comes in a last event, without choices
+        stream_options={"include_usage": True},
+    )
+    parser = IncrementalTestParser()
+    parts: list[str] = []
+    try:
+        async for event in response_stream:
+            if event.usage is not None and timing is not None:
+                timing.usage = _token_usage(event.usage)
+            delta = event.choices[0].delta.content if event.choices else None
+            if not delta:
+                continue
+            if timing is not None and timing.time_to_first_token is None:
+                timing.time_to_first_token = time.perf_counter() - started
+            parts.append(delta)
+            if not json_output:
+                parser.feed(delta)
+        if not json_output:
+            parser.close()
+    except MalformedResponseError:
+        logger.warning(f"Cancelling malformed streamed response after {len(''.join(parts))} characters.")
+        raise
+    finally:
+        await response_stream.close()
+    if not json_output:
+        logger.debug(f"Streamed {len(parser.tests)} complete tests: {parser.tests}")
+    return "".join(parts)
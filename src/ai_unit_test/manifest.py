@@ -0,0 +1,69 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Literal, Self
+
+from ai_unit_test.file_helper import Chunk, write_file_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANIFEST_FILE = ".ai_unit_test_cache/manifest.json"
+MANIFEST_VERSION = 1
+
+Outcome = Literal["success", "error"]
+
+
+class Manifest:
+    """
+    Records, for every chunk, the hash of its source, its uncovered lines and the outcome of the last generation.
+    Uncovered lines are stored relative to the chunk start so that code moving inside the file does not
+    invalidate an entry.
+    """
+
+    def __init__(self: Self, path: Path) -> None:
+        self.path = path
+        self.entries: dict[str, dict[str, Any]] = {}
+        if path.exists():
+            try:
+                data = json.loads(path.read_text())
+                if data.get("version") == MANIFEST_VERSION:
+                    self.entries = data.get("chunks", {})
+                else:
+                    logger.warning(f"Ignoring manifest {path} written by an incompatible version.")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read manifest {path}: {e}")
+        logger.debug(f"Loaded {len(self.entries)} manifest entries from {path}")
+
+    @staticmethod
+    def chunk_key(source_file: Path, chunk: Chunk) -> str:
+        return f"{source_file}::{chunk.type}:{chunk.name}"
+
+    @staticmethod
+    def _fingerprint(chunk: Chunk, uncovered_lines: list[int]) -> tuple[str, list[int]]:
+        source_hash = hashlib.sha256(chunk.source_code.encode("utf-8")).hexdigest()
+        relative_lines = sorted(line - chunk.start_line for line in uncovered_lines)
+        return source_hash, relative_lines
+
+    def is_unchanged(self: Self, source_file: Path, chunk: Chunk, uncovered_lines: list[int]) -> bool:
+        """Returns True if the chunk was already handled successfully with the same source and uncovered lines."""
+        entry = self.entries.get(self.chunk_key(source_file, chunk))
+        if entry is None or entry.get("outcome") != "success":
+            return False
+        source_hash, relative_lines = self._fingerprint(chunk, uncovered_lines)
+        return bool(entry.get("source_hash") == source_hash and entry.get("uncovered_lines") == relative_lines)
+
+    def record(self: Self, source_file: Path, chunk: Chunk, uncovered_lines: list[int], outcome: Outcome) -> None:
+        """Stores the outcome of a generation attempt for a chunk."""
+        source_hash, relative_lines = self._fingerprint(chunk, uncovered_lines)
+        self.entries[self.chunk_key(source_file, chunk)] = {
+            "source_hash": source_hash,
+            "uncovered_lines": relative_lines,
+            "outcome": outcome,
+        }
+
+    def save(self: Self) -> None:
+        """Writes the manifest atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_file_atomic(self.path, json.dumps({"version": MANIFEST_VERSION, "chunks": self.entries}, indent=2))
+        logger.debug(f"Saved {len(self.entries)} manifest entries to {self.path}")
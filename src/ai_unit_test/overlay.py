@@ -0,0 +1,108 @@
+import difflib
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Self
+
+from ai_unit_test.file_helper import insert_new_test, read_file_content, write_file_atomic
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _relative_name(path: Path) -> str:
+    return Path(os.path.relpath(path) if path.is_absolute() else path).as_posix()
+
+
+class EditOverlay:
+    """
+    Keeps the pending edits of test files in memory, on top of their content on disk.
+    Each edited file is read once, and written once when the overlay is flushed, or exported as a patch or a
+    result bundle.
+    """
+
+    def __init__(self: Self) -> None:
+        self._original: dict[Path, str] = {}
+        self._current: dict[Path, str] = {}
+
+    def read(self: Self, path: Path) -> str:
+        """Returns the content of a file with its pending edits applied."""
+        if path not in self._current:
+            content = read_file_content(path)
+            self._original[path] = content
+            self._current[path] = content
+        return self._current[path]
+
+    def write(self: Self, path: Path, content: str) -> None:
+        """Replaces the content of a file in the overlay."""
+        self.read(path)
+        self._current[path] = content
+
+    def insert_test(self: Self, path: Path, new_test: str) -> None:
+        """Inserts a new test into a file of the overlay."""
+        self.write(path, insert_new_test(self.read(path), new_test))
+
+    @property
+    def changed_files(self: Self) -> list[Path]:
+        return [path for path, content in self._current.items() if content != self._original[path]]
+
+    def diff(self: Self) -> str:
+        """Returns the pending edits as a unified diff, with paths relative to the working directory."""
+        parts: list[str] = []
+        for path in self.changed_files:
+            name = _relative_name(path)
+            for line in difflib.unified_diff(
+                self._original[path].splitlines(keepends=True),
+                self._current[path].splitlines(keepends=True),
+                fromfile=f"a/{name}",
+                tofile=f"b/{name}",
+            ):
+                # Same marker as git, so that the patch applies to files without a final newline
+                parts.append(line if line.endswith("\n") else f"{line}\n\\ No newline at end of file\n")
+        return "".join(parts)
+
+    def write_patch(self: Self, patch_path: Path) -> None:
+        """Writes the pending edits to a patch file instead of the edited files."""
+        write_file_atomic(patch_path, self.diff())
+        logger.info(f"Wrote a patch for {len(self.changed_files)} test files to {patch_path}")
+
+    def bundle(self: Self, shard: str | None = None) -> dict[str, Any]:
+        """
+        Returns the pending edits as a result bundle: the new content of each changed file, with the hash of the
+        content it replaces so that merging it into a tree that changed meanwhile can be refused.
+        """
+        return {
+            "version": BUNDLE_VERSION,
+            "shard": shard,
+            "files": {
+                _relative_name(path): {
+                    "original_sha256": content_hash(self._original[path]),
+                    "content": self._current[path],
+                }
+                for path in self.changed_files
+            },
+        }
+
+    def write_bundle(self: Self, bundle_path: Path, shard: str | None = None) -> None:
+        """Writes the pending edits to a result bundle instead of the edited files."""
+        bundle_path.parent.mkdir(parents=True, exist_ok=True)
+        write_file_atomic(bundle_path, json.dumps(self.bundle(shard), indent=2))
+        logger.info(f"Wrote a result bundle for {len(self.changed_files)} test files to {bundle_path}")
+
+    def flush(self: Self) -> list[Path]:
+        """Writes every changed file once, atomically, and returns the written paths."""
+        written = self.changed_files
+        for path in written:
+            write_file_atomic(path, self._current[path])
+            self._original[path] = self._current[path]
+            logger.debug(f"Flushed pending edits to {path}")
+        if written:
+            logger.info(f"Wrote {len(written)} test files.")
+        return written
@@ -0,0 +1,261 @@
+import heapq
+import json
+import logging
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Self
+
+from ai_unit_test.file_helper import Chunk, write_file_atomic
+from ai_unit_test.llm import chunk_prompt_tokens
+from ai_unit_test.scheduler import COMPLETION_TOKENS_ESTIMATE
+from ai_unit_test.usage import ModelPrice, TokenUsage
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+# Typical latency of a small chat model, used to estimate the wall time of a run
+DEFAULT_TIME_TO_FIRST_TOKEN = 0.6
+DEFAULT_TOKENS_PER_SECOND = 80.0
+
+
+@dataclass
+class PlannedRequest:
+    """
+    A request of a run: one chunk, or several chunks of a source file batched together, with the test file
+    context sent along and an estimate of its prompt size.
+    """
+
+    source_file: Path
+    test_file: Path
+    chunks: list[tuple[Chunk, list[int]]]
+    test_style: str
+    other_tests_content: str
+    prompt_tokens: int
+    # Position in coverage order, which breaks ties between equal scores
+    order: int = 0
+
+    @property
+    def uncovered_lines(self: Self) -> int:
+        return sum(len(lines) for _, lines in self.chunks)
+
+    @property
+    def estimated_tokens(self: Self) -> int:
+        """Prompt and completion tokens the request is expected to cost."""
+        return self.prompt_tokens + COMPLETION_TOKENS_ESTIMATE
+
+    @property
+    def score(self: Self) -> float:
+        """Uncovered lines the request may cover per prompt token."""
+        return self.uncovered_lines / max(self.prompt_tokens, 1)
+
+
+def estimate_prompt_tokens(
+    chunks: list[tuple[Chunk, list[int]]], context_tokens: int, max_prompt_tokens: int | None
+) -> int:
+    """
+    Estimates the prompt of a request from the size of its chunks and of the test file context, which is trimmed
+    to fit `max_prompt_tokens` while the chunks never are.
+    """
+    chunk_tokens = sum(chunk_prompt_tokens(chunk, lines) for chunk, lines in chunks)
+    tokens = chunk_tokens + context_tokens
+    if max_prompt_tokens is None:
+        return tokens
+    return min(tokens, max(max_prompt_tokens, chunk_tokens))
+
+
+def prioritize(requests: list[PlannedRequest]) -> list[PlannedRequest]:
+    """Orders requests by descending score, so that a run cut short has covered the most lines it could."""
+    return sorted(requests, key=lambda request: (-request.score, request.order))
+
+
+class Budget:
+    """
+    Limits on what a run may spend: tokens, LLM requests and wall time from the creation of the budget.
+    Requests are admitted while the budget lasts and those in flight always complete. A request that would
+    exceed the token budget is left out, but a smaller one may still fit; once the request count or the time
+    is used up, no request is sent anymore.
+    """
+
+    def __init__(
+        self: Self,
+        max_tokens: int | None = None,
+        max_requests: int | None = None,
+        time_budget: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.max_requests = max_requests
+        self.time_budget = time_budget
+        self._clock = clock
+        self._started = clock()
+        self._reserved_tokens = 0
+        self.spent_tokens = 0
+        self.requests = 0
+        self.left_out = 0
+        self.exhausted: str | None = None
+
+    def _stop_reason(self: Self) -> str | None:
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return f"{self.max_requests} requests sent"
+        if self.time_budget is not None and self._clock() - self._started >= self.time_budget:
+            return f"time budget of {self.time_budget:g}s elapsed"
+        return None
+
+    def admit(self: Self, estimated_tokens: int) -> bool:
+        """Reserves the tokens of a request about to be sent, or returns False if the budget cannot afford it."""
+        if self.exhausted is None:
+            self.exhausted = self._stop_reason()
+            if self.exhausted is not None:
+                logger.info(f"Budget exhausted ({self.exhausted}), no more requests are sent.")
+        if self.exhausted is not None:
+            self.left_out += 1
+            return False
+        if self.max_tokens is not None:
+            if self.spent_tokens + self._reserved_tokens + estimated_tokens > self.max_tokens:
+                self.left_out += 1
+                return False
+        self.requests += 1
+        self._reserved_tokens += estimated_tokens
+        return True
+
+    def settle(self: Self, estimated_tokens: int, usage: TokenUsage | None, cached: bool = False) -> None:
+        """Replaces the reservation of a finished request by its actual usage, when the provider reported it."""
+        self._reserved_tokens -= estimated_tokens
+        if cached:
+            # Answered by the response cache: neither a request nor tokens were spent
+            self.requests -= 1
+            return
+        self.spent_tokens += usage.total_tokens if usage is not None else estimated_tokens
+
+    def log_summary(self: Self) -> None:
+        logger.info(
+            f"Budget: {self.requests} requests sent, ~{self.spent_tokens} tokens spent, "
+            f"{self.left_out} requests left out" + (f" ({self.exhausted})." if self.exhausted else ".")
+        )
+
+
+@dataclass
+class RequestEstimate:
+    """Estimated cost of a planned request, from its actual prompt. `duration` is 0 for a cached response."""
+
+    source_file: str
+    chunks: int
+    uncovered_lines: int
+    prompt_tokens: int
+    completion_tokens: int
+    duration: float
+    cached: bool = False
+
+
+def estimate_wall_time(
+    durations: list[float],
+    concurrency: int,
+    requests_per_minute: float | None = None,
+    tokens_per_minute: float | None = None,
+    total_tokens: int = 0,
+) -> float:
+    """
+    Estimates the wall time of requests sent in the given order with up to `concurrency` in flight, each starting
+    as soon as one finishes, and no shorter than the rate limits allow.
+    """
+    slots = [0.0] * concurrency
+    for duration in durations:
+        heapq.heappush(slots, heapq.heappop(slots) + duration)
+    wall_time = max(slots)
+    if requests_per_minute:
+        wall_time = max(wall_time, len(durations) / requests_per_minute * 60)
+    if tokens_per_minute:
+        wall_time = max(wall_time, total_tokens / tokens_per_minute * 60)
+    return wall_time
+
+
+class RunPlan:
+    """
+    What a run would send, estimated without sending anything: requests, tokens, wall time and cost, per source
+    file and for the whole run. Responses already in the cache are counted apart and cost nothing.
+    """
+
+    def __init__(
+        self: Self,
+        model: str,
+        estimates: list[RequestEstimate],
+        concurrency: int,
+        prices: dict[str, ModelPrice],
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+    ) -> None:
+        self.model = model
+        self.estimates = estimates
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.price = prices.get(model)
+        if self.price is None:
+            logger.warning(f"No price known for model {model}, costs are not estimated.")
+
+    def _entry(self: Self, estimates: list[RequestEstimate], **fields: object) -> dict[str, Any]:
+        sent = [estimate for estimate in estimates if not estimate.cached]
+        usage = TokenUsage(
+            sum(estimate.prompt_tokens for estimate in sent), sum(estimate.completion_tokens for estimate in sent)
+        )
+        return {
+            **fields,
+            "requests": len(estimates),
+            "cached_requests": len(estimates) - len(sent),
+            "chunks": sum(estimate.chunks for estimate in estimates),
+            "uncovered_lines": sum(estimate.uncovered_lines for estimate in estimates),
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+            "wall_time_s": round(
+                estimate_wall_time(
+                    [estimate.duration for estimate in sent],
+                    self.concurrency,
+                    self.requests_per_minute,
+                    self.tokens_per_minute,
+                    usage.total_tokens,
+                ),
+                1,
+            ),
+            "cost_usd": None if self.price is None else round(self.price.cost(usage), 6),
+        }
+
+    def to_dict(self: Self) -> dict[str, Any]:
+        files: dict[str, list[RequestEstimate]] = {}
+        for estimate in self.estimates:
+            files.setdefault(estimate.source_file, []).append(estimate)
+        file_entries = [self._entry(estimates, source_file=source_file) for source_file, estimates in files.items()]
+        return {
+            "version": PLAN_VERSION,
+            "model": self.model,
+            "concurrency": self.concurrency,
+            "price_usd_per_million_tokens": None if self.price is None else vars(self.price),
+            "run": self._entry(self.estimates),
+            "files": sorted(file_entries, key=lambda entry: -entry["total_tokens"]),
+        }
+
+    def log_summary(self: Self) -> None:
+        """Logs the estimates of every source file, largest first, then of the whole run."""
+        plan = self.to_dict()
+        logger.info(f"{'Source file':<50}{'Requests':>10}{'Input tok':>12}{'Output tok':>12}{'Cost ($)':>10}")
+        for entry in [*plan["files"], {**plan["run"], "source_file": "Total"}]:
+            cost = entry["cost_usd"]
+            logger.info(
+                f"{entry['source_file']:<50}{entry['requests']:>10}{entry['prompt_tokens']:>12}"
+                f"{entry['completion_tokens']:>12}{'-' if cost is None else f'{cost:.4f}':>10}"
+            )
+        run = plan["run"]
+        logger.info(
+            f"Plan: {run['requests']} requests ({run['cached_requests']} cached) for {run['chunks']} chunks, "
+            f"~{run['total_tokens']} tokens, ~{run['wall_time_s']}s at concurrency {self.concurrency}"
+            + ("" if run["cost_usd"] is None else f", estimated cost ${run['cost_usd']:.4f}")
+            + ". Nothing was sent."
+        )
+
+    def write(self: Self, path: Path) -> None:
+        """Writes the plan as JSON, atomically."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_file_atomic(path, json.dumps(self.to_dict(), indent=2))
+        logger.info(f"Run plan written to {path}")
@@ -0,0 +1,129 @@
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Self, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Rough average for code with an OpenAI-style BPE tokenizer; good enough for budgeting
+CHARS_PER_TOKEN = 4
+DEFAULT_MAX_PROMPT_TOKENS = 16000
+TRUNCATION_MARKER = "# ... (truncated)"
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximates the number of tokens of a text without a tokenizer."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+@dataclass
+class PromptSection:
+    name: str
+    content: str
+    # Higher is more valuable: lower priority sections are deduplicated against and trimmed first
+    priority: int
+    trimmable: bool = True
+
+    def render(self: Self) -> str:
+        return f"<{self.name}>\n{self.content}\n</{self.name}>"
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    section_tokens: dict[str, int] = field(default_factory=dict)
+    dropped: list[str] = field(default_factory=list)
+    trimmed: list[str] = field(default_factory=list)
+
+    @property
+    def total_tokens(self: Self) -> int:
+        return estimate_tokens(self.text)
+
+
+def deduplicate_sections(sections: list[PromptSection]) -> tuple[list[PromptSection], list[str]]:
+    """
+    Drops empty trimmable sections and those whose content is already contained in a more valuable section.
+    Returns the kept sections, in their original order, and the names of the dropped ones.
+    """
+    kept: list[PromptSection] = []
+    dropped: list[str] = []
+    for section in sorted(sections, key=lambda s: -s.priority):
+        content = section.content.strip()
+        if section.trimmable and (not content or any(content in other.content for other in kept)):
+            dropped.append(section.name)
+        else:
+            kept.append(section)
+    kept_ids = {id(section) for section in kept}
+    return [section for section in sections if id(section) in kept_ids], dropped
+
+
+def _truncate(content: str, max_tokens: int) -> str:
+    """Keeps the head of the content (imports, fixtures, first tests) within `max_tokens`, on a line boundary."""
+    max_chars = max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARKER) - 1
+    head = content[: max(max_chars, 0)]
+    if "\n" in head:
+        head = head[: head.rindex("\n")]
+    return f"{head}\n{TRUNCATION_MARKER}" if head else TRUNCATION_MARKER
+
+
+def build_prompt(
+    header: str,
+    sections: list[PromptSection],
+    max_tokens: int | None = None,
+    reserved_tokens: int = 0,
+) -> BuiltPrompt:
+    """
+    Renders the prompt sections under a header, after removing duplicated context.
+    When `max_tokens` is given, the lowest priority trimmable sections are cut (then dropped) until the prompt,
+    plus `reserved_tokens` for the rest of the request (e.g. the system message), fits the budget.
+    """
+    kept, dropped = deduplicate_sections(sections)
+    trimmed: list[str] = []
+
+    def render(parts: list[PromptSection]) -> str:
+        return header + "\n\n" + "\n\n".join(part.render() for part in parts) + "\n"
+
+    if max_tokens is not None:
+        for section in sorted((s for s in kept if s.trimmable), key=lambda s: s.priority):
+            excess = reserved_tokens + estimate_tokens(render(kept)) - max_tokens
+            if excess <= 0:
+                break
+            section_tokens = estimate_tokens(section.content)
+            if section_tokens - excess < estimate_tokens(TRUNCATION_MARKER) * 4:
+                kept.remove(section)
+                dropped.append(section.name)
+            else:
+                section.content = _truncate(section.content, section_tokens - excess)
+                trimmed.append(section.name)
+        total = reserved_tokens + estimate_tokens(render(kept))
+        if total > max_tokens:
+            logger.warning(f"Prompt needs ~{total} tokens, above the budget of {max_tokens}, after trimming context.")
+
+    return BuiltPrompt(
+        text=render(kept),
+        section_tokens={section.name: estimate_tokens(section.render()) for section in kept},
+        dropped=dropped,
+        trimmed=trimmed,
+    )
+
+
+def pack_batches(items: list[T], cost: Callable[[T], int], max_tokens: int) -> list[list[T]]:
+    """
+    Groups consecutive items into batches whose total cost stays within `max_tokens`.
+    An item costing more than the budget on its own gets a batch of its own.
+    """
+    batches: list[list[T]] = []
+    current: list[T] = []
+    current_tokens = 0
+    for item in items:
+        item_tokens = cost(item)
+        if current and current_tokens + item_tokens > max_tokens:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += item_tokens
+    if current:
+        batches.append(current)
+    return batches
@@ -0,0 +1,192 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from typing import Self, TypeVar
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+# Completion size is unknown before the request: this is what a generated test usually costs
+COMPLETION_TOKENS_ESTIMATE = 500
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` units per second, holding at most `capacity` units.
+    It starts full, so that a run can use its whole budget right away.
+    """
+
+    def __init__(self: Self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls: type[Self], limit: float) -> Self:
+        return cls(rate=limit / 60.0, capacity=limit)
+
+    def _refill(self: Self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay_for(self: Self, amount: float) -> float:
+        """Returns how long to wait until `amount` units are available (0 if they already are)."""
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self._tokens) / self.rate)
+
+    async def acquire(self: Self, amount: float) -> None:
+        """Waits until `amount` units are available and takes them. Requests above the capacity take it all."""
+        amount = min(amount, self.capacity)
+        # Callers are served in order: one waiting for a large amount is not starved by smaller ones
+        async with self._lock:
+            while (delay := self.delay_for(amount)) > 0:
+                await asyncio.sleep(delay)
+            self._tokens -= amount
+
+
+def _status_code(error: Exception) -> int | None:
+    from openai import APIStatusError
+
+    return error.status_code if isinstance(error, APIStatusError) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Throttling (429), server errors (5xx) and connection failures are worth retrying."""
+    from openai import APIConnectionError
+
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, APIConnectionError)
+
+
+def retry_after(error: Exception) -> float | None:
+    """Returns the delay requested by the provider in `retry-after-ms` or `retry-after` headers, in seconds."""
+    from openai import APIStatusError
+
+    if not isinstance(error, APIStatusError):
+        return None
+    headers = error.response.headers
+    if (value := headers.get("retry-after-ms")) is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    if (value := headers.get("retry-after")) is not None:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        # retry-after may also be an HTTP date
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, date.timestamp() - time.time())
+    return None
+
+
+class RateLimitScheduler:
+    """
+    Runs LLM requests within requests-per-minute and tokens-per-minute budgets (token buckets), retrying
+    throttled and failed requests with exponential backoff and full jitter, or after the delay asked by the
+    provider. Concurrency adapts to throttling: it is halved on a 429 and grows back by one after as many
+    successes in a row as the current limit (additive increase, multiplicative decrease). The 429s of requests
+    that were already in flight within `base_delay` of a decrease do not lower it again.
+    """
+
+    def __init__(
+        self: Self,
+        max_concurrency: int,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = TokenBucket.per_minute(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket.per_minute(tokens_per_minute) if tokens_per_minute else None
+        self.retries = 0
+        self.throttled = 0
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease = float("-inf")
+        self._slot_freed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def _slot(self: Self) -> AsyncIterator[None]:
+        async with self._slot_freed:
+            await self._slot_freed.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._slot_freed:
+                self._in_flight -= 1
+                self._slot_freed.notify_all()
+
+    def _on_success(self: Self) -> None:
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_concurrency:
+            self.limit += 1
+            self._successes = 0
+            logger.debug(f"No throttling lately, concurrency raised to {self.limit}.")
+
+    def _on_throttled(self: Self) -> None:
+        self.throttled += 1
+        self._successes = 0
+        now = time.monotonic()
+        if self.limit > 1 and now - self._last_decrease >= self.base_delay:
+            self._last_decrease = now
+            self.limit = max(1, self.limit // 2)
+            logger.info(f"Throttled by the provider, concurrency lowered to {self.limit}.")
+
+    def backoff_delay(self: Self, error: Exception, attempt: int) -> float:
+        """Returns the delay before retrying a request that failed with `error` on its `attempt`-th try."""
+        requested = retry_after(error)
+        if requested is not None:
+            return min(requested, self.max_delay) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def run(self: Self, request: Callable[[], Awaitable[T]], estimated_tokens: int = 0) -> T:
+        """Sends `request` when the budgets allow it, retrying it on transient failures."""
+        attempt = 0
+        while True:
+            async with self._slot():
+                if self.requests is not None:
+                    await self.requests.acquire(1)
+                if self.tokens is not None:
+                    await self.tokens.acquire(estimated_tokens)
+                try:
+                    result = await request()
+                except Exception as e:
+                    if not is_retryable(e) or attempt >= self.max_retries:
+                        raise
+                    if _status_code(e) == 429:
+                        self._on_throttled()
+                    delay = self.backoff_delay(e, attempt)
+                    failure = e
+                else:
+                    self._on_success()
+                    return result
+            attempt += 1
+            self.retries += 1
+            logger.warning(f"LLM request failed ({failure}), retry {attempt}/{self.max_retries} in {delay:.1f}s.")
+            await asyncio.sleep(delay)
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import re
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Self
+
+from ai_unit_test.overlay import BUNDLE_VERSION, EditOverlay, content_hash
+
+logger = logging.getLogger(__name__)
+
+_SHARD_RE = re.compile(r"^(\d+)/(\d+)$")
+
+
+class BundleError(RuntimeError):
+    """Raised when result bundles cannot be merged safely."""
+
+
+@dataclass(frozen=True)
+class Shard:
+    """Shard `index` (from 1) of `count` shards of a run."""
+
+    index: int
+    count: int
+
+    def __str__(self: Self) -> str:
+        return f"{self.index}/{self.count}"
+
+
+def parse_shard(spec: str) -> Shard:
+    """Parses a shard written as `i/n`, with 1 <= i <= n."""
+    match = _SHARD_RE.match(spec.strip())
+    if match is None:
+        raise ValueError(f"Invalid shard {spec!r}, expected i/n, e.g. 1/4.")
+    shard = Shard(int(match.group(1)), int(match.group(2)))
+    if not 1 <= shard.index <= shard.count:
+        raise ValueError(f"Invalid shard {spec!r}, i must be between 1 and n.")
+    return shard
+
+
+def assign_shards(
+    missing_info: dict[Path, list[int]], test_file_of: Callable[[Path], Path | None], count: int
+) -> list[dict[Path, list[int]]]:
+    """
+    Splits the source files to cover between `count` shards. Source files tested by the same test file go to the
+    same shard, so that two shards never edit the same file. Groups are spread by number of uncovered lines,
+    largest first, each to the least loaded shard. The split only depends on the coverage data and on the
+    paths relative to the working directory, so every worker computes the same one.
+    """
+    groups: dict[str, dict[Path, list[int]]] = {}
+    for source_file, lines in missing_info.items():
+        test_file = test_file_of(source_file)
+        # Files without a test file are skipped by the run, but still counted once
+        key = os.path.relpath(test_file if test_file is not None else source_file)
+        groups.setdefault(key, {})[source_file] = lines
+
+    def weight(group: dict[Path, list[int]]) -> int:
+        return sum(len(lines) for lines in group.values())
+
+    shards: list[dict[Path, list[int]]] = [{} for _ in range(count)]
+    loads = [0] * count
+    for key in sorted(groups, key=lambda key: (-weight(groups[key]), Path(key).as_posix())):
+        target = min(range(count), key=lambda i: (loads[i], i))
+        shards[target].update(groups[key])
+        loads[target] += weight(groups[key])
+    return shards
+
+
+def select_shard(
+    missing_info: dict[Path, list[int]], test_file_of: Callable[[Path], Path | None], shard: Shard
+) -> dict[Path, list[int]]:
+    """Returns the part of `missing_info` handled by `shard`."""
+    selected = assign_shards(missing_info, test_file_of, shard.count)[shard.index - 1]
+    logger.info(f"Shard {shard}: {len(selected)} of {len(missing_info)} files with missing coverage.")
+    return selected
+
+
+def merge_bundles(bundle_paths: list[Path]) -> EditOverlay:
+    """
+    Loads the result bundles of sharded runs into an overlay of the test files. Fails if two bundles edit the
+    same file, or if a file changed since its bundle was produced.
+    """
+    overlay = EditOverlay()
+    edited_by: dict[str, Path] = {}
+    for bundle_path in bundle_paths:
+        data = json.loads(bundle_path.read_text())
+        if data.get("version") != BUNDLE_VERSION:
+            raise BundleError(f"{bundle_path} was written by an incompatible version.")
+        for name, entry in data["files"].items():
+            if name in edited_by:
+                raise BundleError(
+                    f"{name} is edited by both {edited_by[name]} and {bundle_path}; "
+                    "were the shards run with the same coverage data and shard count?"
+                )
+            path = Path(name)
+            if content_hash(overlay.read(path)) != entry["original_sha256"]:
+                raise BundleError(f"{name} changed since {bundle_path} was produced.")
+            overlay.write(path, entry["content"])
+            edited_by[name] = bundle_path
+        logger.info(f"Loaded {len(data['files'])} test files from {bundle_path} (shard {data.get('shard')}).")
+    return overlay
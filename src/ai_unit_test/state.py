@@ -0,0 +1,52 @@
+import logging
+import os
+from collections.abc import Callable, Hashable
+from pathlib import Path
+from typing import Self
+
+from ai_unit_test.file_helper import TestFileIndex
+
+logger = logging.getLogger(__name__)
+
+
+class WarmState:
+    """
+    What a long-running process (the daemon, the watch mode) keeps in memory from one run to the next: the missing
+    lines of a coverage file until that file changes, and the test file index of a tests folder until a file is
+    added to or removed from it. Parsed modules are kept by the module cache of file_helper, per (mtime, size).
+    Entries are keyed by the working directory too, since paths given by a run are relative to it.
+    """
+
+    def __init__(self: Self) -> None:
+        self._missing_lines: dict[tuple[Hashable, ...], tuple[tuple[int, int], dict[Path, list[int]]]] = {}
+        self._indexes: dict[tuple[str, str], TestFileIndex] = {}
+
+    def missing_lines(
+        self: Self, coverage_file: str, key: tuple[Hashable, ...], collect: Callable[[], dict[Path, list[int]]]
+    ) -> dict[Path, list[int]]:
+        """
+        Returns the missing lines computed by `collect` for the coverage file and the options in `key`, computing
+        them again only when the coverage file changed.
+        """
+        stat = os.stat(coverage_file)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        full_key = (os.getcwd(), coverage_file, *key)
+        entry = self._missing_lines.get(full_key)
+        if entry is not None and entry[0] == stamp:
+            logger.info(f"Coverage data unchanged, reusing the missing lines of {coverage_file}.")
+            return entry[1]
+        missing_info = collect()
+        self._missing_lines[full_key] = (stamp, missing_info)
+        return missing_info
+
+    def test_index(self: Self, tests_folder: str, index_path: Path | None) -> TestFileIndex:
+        """Returns the test file index of a tests folder, rebuilt (or loaded from `index_path`) once it is stale."""
+        key = (os.getcwd(), tests_folder)
+        index = self._indexes.get(key)
+        if index is None or not index.is_fresh():
+            index = self._indexes[key] = TestFileIndex.load_or_build(tests_folder, index_path)
+        return index
+
+    def clear(self: Self) -> None:
+        self._missing_lines.clear()
+        self._indexes.clear()
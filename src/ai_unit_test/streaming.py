@@ -0,0 +1,109 @@
+import ast
+import io
+import logging
+import re
+import textwrap
+import tokenize
+from typing import Self
+
+logger = logging.getLogger(__name__)
+
+# Lines that can only start a new statement, never continue the previous one
+_BLOCK_START = re.compile(r"(?:@|(?:async\s+)?def\s|class\s|import\s|from\s)")
+_NON_CODE_TOKENS = {tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER}
+
+
+class MalformedResponseError(RuntimeError):
+    """Raised when a streamed response is clearly not the expected Python test code."""
+
+
+def _continues(lines: list[str]) -> bool:
+    """
+    Tells whether the line after `lines` belongs to their last statement: it is inside a bracket, a multi-line
+    string or a line continuation, or the statement is a decorator waiting for its definition.
+    """
+    readline = io.StringIO(textwrap.dedent("\n".join(lines)) + "\n").readline
+    statement_start = ""
+    at_start = True
+    try:
+        for token in tokenize.generate_tokens(readline):
+            if token.type == tokenize.NEWLINE:
+                at_start = True
+            elif at_start and token.type not in _NON_CODE_TOKENS:
+                statement_start = token.string
+                at_start = False
+    except tokenize.TokenError as e:
+        return "EOF in multi-line" in str(e.args[0])
+    except SyntaxError:
+        # Inconsistent indentation: the block is complete, and invalid
+        return False
+    return statement_start == "@"
+
+
+class IncrementalTestParser:
+    """
+    Checks streamed test code block by block, as it arrives.
+    A block is a top-level statement (at the indentation of the first code line, so that methods of a
+    unittest class are handled too) with its decorators, possibly spanning several lines. Once the next block
+    starts, the previous one is complete and must be valid Python, otherwise the response is malformed.
+    Markdown fences are ignored.
+    """
+
+    def __init__(self: Self) -> None:
+        self.text = ""
+        self.tests: list[str] = []
+        self._pending = ""
+        self._block: list[str] = []
+        self._indent: str | None = None
+
+    def feed(self: Self, delta: str) -> None:
+        """Adds streamed text, checking every block completed by it."""
+        self.text += delta
+        self._pending += delta
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            self._add_line(line)
+
+    def close(self: Self) -> None:
+        """Checks the last block once the stream has ended."""
+        if self._pending:
+            self._add_line(self._pending)
+            self._pending = ""
+        self._check_block(final=True)
+
+    def _add_line(self: Self, line: str) -> None:
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            return
+        if self._indent is None:
+            if not stripped:
+                return
+            self._indent = line[: len(line) - len(line.lstrip())]
+        starts_block = (
+            stripped
+            and line.startswith(self._indent)
+            and not line[len(self._indent) :].startswith((" ", "\t"))  # noqa: E203
+            and _BLOCK_START.match(stripped)
+        )
+        # Decorators belong to the definition that follows them, and unfinished statements to their next line
+        if starts_block and not (self._block and _continues(self._block)):
+            self._check_block()
+            self._block = []
+        self._block.append(line)
+
+    def _check_block(self: Self, final: bool = False) -> None:
+        code = textwrap.dedent("\n".join(self._block)).strip()
+        if not code:
+            return
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            if final:
+                # The model may still have produced something usable: the caller decides what to do with it
+                logger.warning(f"Streamed response ends with invalid Python code: {e}")
+                return
+            raise MalformedResponseError(f"Streamed response is not valid Python code: {e}") from e
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test"):
+                self.tests.append(node.name)
+                logger.debug(f"Streamed test '{node.name}' is complete and valid.")
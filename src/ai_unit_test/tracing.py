@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Self
+
+logger = logging.getLogger(__name__)
+
+# Track of the spans recorded outside of any asyncio task
+MAIN_TRACK = "main"
+
+
+@dataclass
+class Span:
+    """A timed pipeline stage. `start` is relative to the creation of the tracer; times are in seconds."""
+
+    name: str
+    start: float
+    duration: float
+    track: str
+    args: dict[str, object] = field(default_factory=dict)
+
+
+@dataclass
+class StageStats:
+    count: int
+    total: float
+    p50: float
+    p95: float
+    p99: float
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Tracer:
+    """
+    Records spans around pipeline stages. Spans of concurrent asyncio tasks are kept on one track per task,
+    so that overlapping requests show side by side in a trace viewer.
+    """
+
+    def __init__(self: Self, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.spans: list[Span] = []
+        self._clock = clock
+        self._origin = clock()
+
+    @staticmethod
+    def _current_track() -> str:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            return MAIN_TRACK
+        return task.get_name() if task is not None else MAIN_TRACK
+
+    @contextmanager
+    def span(self: Self, name: str, **args: object) -> Iterator[None]:
+        """Times the enclosed block as a span of stage `name`; `args` are shown with it in the trace."""
+        track = self._current_track()
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self.spans.append(Span(name, started - self._origin, self._clock() - started, track, args))
+
+    def summary(self: Self) -> dict[str, StageStats]:
+        """Returns the number of spans, total time and percentiles of each stage, in order of first appearance."""
+        durations: dict[str, list[float]] = {}
+        for span in self.spans:
+            durations.setdefault(span.name, []).append(span.duration)
+        stats: dict[str, StageStats] = {}
+        for name, values in durations.items():
+            values.sort()
+            stats[name] = StageStats(
+                len(values), sum(values), percentile(values, 50), percentile(values, 95), percentile(values, 99)
+            )
+        return stats
+
+    def log_summary(self: Self) -> None:
+        """Logs a table of the time spent in each stage."""
+        logger.info(f"{'Stage':<20}{'Count':>7}{'Total (s)':>11}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+        for name, stats in self.summary().items():
+            logger.info(
+                f"{name:<20}{stats.count:>7}{stats.total:>11.3f}"
+                f"{stats.p50 * 1000:>10.1f}{stats.p95 * 1000:>10.1f}{stats.p99 * 1000:>10.1f}"
+            )
+
+    def chrome_trace(self: Self) -> dict[str, Any]:
+        """Returns the spans in the Chrome trace event format, which Perfetto and chrome://tracing open."""
+        pid = os.getpid()
+        tracks: dict[str, int] = {}
+        events: list[dict[str, Any]] = []
+        for span in self.spans:
+            if span.track not in tracks:
+                tracks[span.track] = len(tracks)
+                # Names the track of each task in the viewer
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": tracks[span.track],
+                        "args": {"name": span.track},
+                    }
+                )
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": "ai_unit_test",
+                    "ph": "X",
+                    "ts": round(span.start * 1_000_000, 3),
+                    "dur": round(span.duration * 1_000_000, 3),
+                    "pid": pid,
+                    "tid": tracks[span.track],
+                    "args": {key: str(value) for key, value in span.args.items()},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self: Self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.chrome_trace()))
+        logger.info(f"Trace of {len(self.spans)} spans written to {path}")
+
+
+_tracer: Tracer | None = None
+_NO_SPAN = nullcontext()
+
+
+def span(name: str, **args: object) -> AbstractContextManager[None]:
+    """Times the enclosed block when profiling is enabled, and costs next to nothing otherwise."""
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, **args)
+
+
+@contextmanager
+def profiling(trace_file: Path | None) -> Iterator[Tracer | None]:
+    """
+    Records spans while the context is active, then logs the time spent in each stage and writes them to
+    `trace_file`. Without a file, nothing is recorded.
+    """
+    global _tracer
+    if trace_file is None:
+        yield None
+        return
+    tracer = _tracer = Tracer()
+    try:
+        yield tracer
+    finally:
+        _tracer = None
+        tracer.log_summary()
+        tracer.write_chrome_trace(trace_file)
@@ -0,0 +1,156 @@
+import json
+import logging
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Self
+
+from ai_unit_test.file_helper import write_file_atomic
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+
+@dataclass
+class TokenUsage:
+    """Tokens billed for LLM requests. `cached_tokens` are the part of the prompt served from the provider cache."""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+
+    def __add__(self: Self, other: "TokenUsage") -> "TokenUsage":
+        return TokenUsage(
+            self.prompt_tokens + other.prompt_tokens,
+            self.completion_tokens + other.completion_tokens,
+            self.cached_tokens + other.cached_tokens,
+        )
+
+    @property
+    def total_tokens(self: Self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+@dataclass
+class ModelPrice:
+    """Prices of a model in USD per million tokens. Cached prompt tokens cost `cached_input` when it is known."""
+
+    input: float
+    output: float
+    cached_input: float | None = None
+
+    def cost(self: Self, usage: TokenUsage) -> float:
+        cached_price = self.input if self.cached_input is None else self.cached_input
+        uncached = usage.prompt_tokens - usage.cached_tokens
+        return (
+            uncached * self.input + usage.cached_tokens * cached_price + usage.completion_tokens * self.output
+        ) / 1_000_000
+
+
+DEFAULT_PRICES: dict[str, ModelPrice] = {
+    "gpt-4o-mini": ModelPrice(input=0.15, output=0.60, cached_input=0.075),
+    "gpt-4o": ModelPrice(input=2.50, output=10.00, cached_input=1.25),
+}
+
+
+def load_price_table(path: Path) -> dict[str, ModelPrice]:
+    """
+    Reads prices from a JSON file like {"model": {"input": 0.15, "output": 0.6, "cached_input": 0.075}}, in USD
+    per million tokens. They take precedence over the default prices.
+    """
+    prices = dict(DEFAULT_PRICES)
+    for model, price in json.loads(path.read_text()).items():
+        prices[model] = ModelPrice(price["input"], price["output"], price.get("cached_input"))
+    return prices
+
+
+@dataclass
+class RequestUsage:
+    """Usage of one LLM request, which answered the chunks `chunks` of `source_file`."""
+
+    source_file: str
+    chunks: list[str]
+    usage: TokenUsage
+    cached_response: bool = False
+
+
+class UsageReport:
+    """Token usage and estimated cost of a run, aggregated per chunk, per source file and for the whole run."""
+
+    def __init__(self: Self, model: str, requests: Iterable[RequestUsage], prices: dict[str, ModelPrice]) -> None:
+        self.model = model
+        self.requests = list(requests)
+        self.price = prices.get(model)
+        if self.price is None:
+            logger.warning(f"No price known for model {model}, costs are not estimated.")
+
+    def _cost(self: Self, usage: TokenUsage) -> float | None:
+        return None if self.price is None else round(self.price.cost(usage), 6)
+
+    def _entry(self: Self, usage: TokenUsage, requests: int, **fields: object) -> dict[str, Any]:
+        return {
+            **fields,
+            "requests": requests,
+            **asdict(usage),
+            "total_tokens": usage.total_tokens,
+            "cost_usd": self._cost(usage),
+        }
+
+    def total(self: Self) -> TokenUsage:
+        return sum((request.usage for request in self.requests), TokenUsage())
+
+    def to_dict(self: Self) -> dict[str, Any]:
+        chunks: list[dict[str, Any]] = []
+        files: dict[str, tuple[TokenUsage, int]] = {}
+        for request in self.requests:
+            # The usage of a batched request is shared evenly by its chunks
+            share = len(request.chunks)
+            for chunk in request.chunks:
+                chunk_usage = TokenUsage(
+                    round(request.usage.prompt_tokens / share),
+                    round(request.usage.completion_tokens / share),
+                    round(request.usage.cached_tokens / share),
+                )
+                chunks.append(
+                    self._entry(
+                        chunk_usage,
+                        1,
+                        source_file=request.source_file,
+                        chunk=chunk,
+                        batch_size=share,
+                        cached_response=request.cached_response,
+                    )
+                )
+            usage, count = files.get(request.source_file, (TokenUsage(), 0))
+            files[request.source_file] = (usage + request.usage, count + 1)
+        return {
+            "version": REPORT_VERSION,
+            "model": self.model,
+            "price_usd_per_million_tokens": None if self.price is None else asdict(self.price),
+            "run": self._entry(
+                self.total(),
+                len(self.requests),
+                cached_responses=sum(request.cached_response for request in self.requests),
+            ),
+            "files": [
+                self._entry(usage, count, source_file=source_file)
+                for source_file, (usage, count) in sorted(files.items(), key=lambda item: -item[1][0].total_tokens)
+            ],
+            "chunks": chunks,
+        }
+
+    def log_summary(self: Self) -> None:
+        total = self.total()
+        cost = self._cost(total)
+        logger.info(
+            f"Token usage over {len(self.requests)} requests: {total.prompt_tokens} prompt "
+            f"({total.cached_tokens} cached), {total.completion_tokens} completion"
+            + (f", estimated cost ${cost:.4f}" if cost is not None else "")
+        )
+
+    def write(self: Self, path: Path) -> None:
+        """Writes the report as JSON, atomically."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_file_atomic(path, json.dumps(self.to_dict(), indent=2))
+        logger.info(f"Run report written to {path}")
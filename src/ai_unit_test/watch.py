@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import shlex
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Self
+
+from ai_unit_test.tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_DEBOUNCE = 1.0
+
+Snapshot = dict[Path, tuple[int, int]]
+
+
+def snapshot(folders: Iterable[str], exclude_folders: Iterable[str] = ()) -> Snapshot:
+    """Returns the (mtime, size) of every Python file under `folders` and not under `exclude_folders`."""
+    excluded = tuple(Path(folder).absolute() for folder in exclude_folders)
+    stamps: Snapshot = {}
+    for folder in folders:
+        for path in Path(folder).rglob("*.py"):
+            if excluded and _is_under(path, excluded):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                # Removed between the listing and the stat
+                continue
+            stamps[path] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+
+def _is_under(path: Path, folders: tuple[Path, ...]) -> bool:
+    absolute = path.absolute()
+    return any(absolute.is_relative_to(folder) for folder in folders)
+
+
+def changed_files(before: Snapshot, after: Snapshot) -> set[Path]:
+    """Files added or modified between two snapshots. Removed files have nothing left to test."""
+    return {path for path, stamp in after.items() if before.get(path) != stamp}
+
+
+class PollingWatcher:
+    """
+    Polls the Python files of source folders every `interval` seconds. Changes are reported once no file has
+    changed for `debounce` seconds, so that an editor saving several files, or saving twice, triggers one run.
+    """
+
+    def __init__(
+        self: Self,
+        folders: list[str],
+        exclude_folders: list[str] | None = None,
+        interval: float = DEFAULT_POLL_INTERVAL,
+        debounce: float = DEFAULT_DEBOUNCE,
+    ) -> None:
+        self.folders = folders
+        self.exclude_folders = exclude_folders or []
+        self.interval = interval
+        self.debounce = debounce
+        self._snapshot = snapshot(folders, self.exclude_folders)
+
+    async def next_changes(self: Self) -> set[Path]:
+        """Waits for files to change, then for them to settle, and returns every file changed meanwhile."""
+        loop = asyncio.get_running_loop()
+        changed: set[Path] = set()
+        last_change = 0.0
+        while True:
+            await asyncio.sleep(self.interval)
+            current = snapshot(self.folders, self.exclude_folders)
+            new_changes = changed_files(self._snapshot, current)
+            self._snapshot = current
+            if new_changes:
+                changed |= new_changes
+                last_change = loop.time()
+            elif changed and loop.time() - last_change >= self.debounce:
+                return changed
+
+
+async def run_test_command(test_command: str, test_files: list[str]) -> int:
+    """Runs `test_command` on the given test files, e.g. `coverage run -m pytest` to refresh their coverage."""
+    command = [*shlex.split(test_command), *test_files]
+    logger.info(f"Running {shlex.join(command)}")
+    with span("tests"):
+        process = await asyncio.create_subprocess_exec(*command)
+        return await process.wait()
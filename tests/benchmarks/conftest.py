@@ -0,0 +1,106 @@
+import json
+import platform
+import statistics
+import subprocess
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from .synthetic_project import BenchmarkRecord
+
+BENCHMARK_RESULTS_VERSION = 1
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("ai-unit-test benchmarks")
+    group.addoption("--bench-scale", type=int, default=1, help="Multiplies the size of the synthetic projects.")
+    group.addoption("--bench-rounds", type=int, default=3, help="Rounds of every benchmark.")
+    group.addoption("--bench-json", default=None, help="Writes the benchmark results to this JSON file.")
+    group.addoption("--bench-compare", default=None, help="Compares the results with a previous JSON file.")
+
+
+_records_key = pytest.StashKey[list[BenchmarkRecord]]()
+
+
+@pytest.fixture(scope="session")
+def bench_records(request: pytest.FixtureRequest) -> list[BenchmarkRecord]:
+    """Collects the benchmark results of the session, reported in the terminal summary."""
+    records: list[BenchmarkRecord] = []
+    request.config.stash[_records_key] = records
+    return records
+
+
+def _git_revision() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def _stats(values: list[float]) -> dict[str, float]:
+    return {
+        "min": min(values),
+        "max": max(values),
+        "mean": statistics.fmean(values),
+        "median": statistics.median(values),
+        "stddev": statistics.stdev(values) if len(values) > 1 else 0.0,
+    }
+
+
+def _rows(records: list[BenchmarkRecord]) -> list[tuple[str, dict[str, float], int]]:
+    rows: list[tuple[str, dict[str, float], int]] = []
+    for record in records:
+        rows.append((record.name, _stats(record.rounds), len(record.rounds)))
+        for stage, values in record.stages.items():
+            rows.append((f"  {stage} ({record.calls.get(stage, 0)} calls)", _stats(values), len(values)))
+    return rows
+
+
+def pytest_terminal_summary(terminalreporter: pytest.TerminalReporter, config: pytest.Config) -> None:
+    records = config.stash.get(_records_key, [])
+    if not records:
+        return
+    previous: dict[str, float] = {}
+    compare_path = config.getoption("--bench-compare")
+    if compare_path:
+        data = json.loads(Path(compare_path).read_text())
+        previous = {row["name"]: row["median"] for row in data["rows"]}
+
+    write = terminalreporter.write_line
+    terminalreporter.section("benchmark (times in ms)")
+    header = f"{'Name':<58}{'Min':>10}{'Max':>10}{'Mean':>10}{'StdDev':>10}{'Median':>10}{'Rounds':>8}"
+    write(header + ("   vs base" if previous else ""))
+    write("-" * len(header))
+    results: list[dict[str, Any]] = []
+    for name, stats, rounds in _rows(records):
+        line = f"{name:<58}" + "".join(
+            f"{stats[key] * 1000:>10.2f}" for key in ("min", "max", "mean", "stddev", "median")
+        )
+        line += f"{rounds:>8}"
+        if name in previous and previous[name] > 0:
+            line += f"{(stats['median'] / previous[name] - 1) * 100:>+9.1f}%"
+        write(line)
+        results.append({"name": name, "rounds": rounds, **stats})
+    for record in records:
+        if record.peak_memory_mb is not None:
+            write(f"{record.name}: peak traced memory {record.peak_memory_mb:.1f} MB")
+
+    json_path = config.getoption("--bench-json")
+    if json_path:
+        Path(json_path).write_text(
+            json.dumps(
+                {
+                    "version": BENCHMARK_RESULTS_VERSION,
+                    "commit": _git_revision(),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "rows": results,
+                    "benchmarks": [asdict(record) for record in records],
+                },
+                indent=2,
+            )
+        )
+        write(f"Benchmark results written to {json_path}")
@@ -0,0 +1,229 @@
+import ast
+import asyncio
+import functools
+import inspect
+import json
+import re
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Self
+
+from coverage import CoverageData
+
+from ai_unit_test.cassette import LatencyModel
+from ai_unit_test.llm import GenerationTiming, LLMBackend
+from ai_unit_test.prompt import estimate_tokens
+
+
+@dataclass(frozen=True)
+class ProjectSpec:
+    """Shape of a generated project. Every other function and method is left uncovered."""
+
+    files: int = 20
+    functions_per_file: int = 6
+    classes_per_file: int = 2
+    methods_per_class: int = 4
+    tests_per_file: int = 10
+    packages: int = 4
+
+    @property
+    def label(self: Self) -> str:
+        return (
+            f"{self.files}f-{self.functions_per_file}fn-{self.classes_per_file}c"
+            f"x{self.methods_per_class}m-{self.tests_per_file}t"
+        )
+
+
+@dataclass
+class GeneratedProject:
+    root: Path
+    source_folder: Path
+    tests_folder: Path
+    coverage_file: Path
+    uncovered_chunks: int
+
+
+_FUNCTION_TEMPLATE = '''def {name}(value, limit=10):
+    """Returns a value derived from `value`."""
+    total = 0
+    for step in range(limit):
+        if value > step:
+            total += value - step
+        else:
+            total -= step
+    return total
+
+'''
+
+_METHOD_TEMPLATE = """    def {name}(self, value):
+        if value is None:
+            raise ValueError("value is required")
+        self.state = self.state + value
+        return self.state
+
+"""
+
+_TEST_TEMPLATE = """def test_case_{index}():
+    values = [value * {index} for value in range(5)]
+    assert sum(values) >= 0
+
+"""
+
+
+def _source_module(spec: ProjectSpec, file_index: int) -> str:
+    parts = ["import os\n\n\n"]
+    for i in range(spec.functions_per_file):
+        parts.append(_FUNCTION_TEMPLATE.format(name=f"function_{file_index}_{i}"))
+    for c in range(spec.classes_per_file):
+        parts.append(f"class Service{file_index}_{c}:\n    def __init__(self):\n        self.state = 0\n\n")
+        for m in range(spec.methods_per_class):
+            parts.append(_METHOD_TEMPLATE.format(name=f"method_{m}"))
+    return "".join(parts)
+
+
+def _executed_lines(source: str) -> tuple[list[int], int]:
+    """Every line except the bodies of every other function and method, as if half of them were tested."""
+    tree = ast.parse(source)
+    uncovered: set[int] = set()
+    uncovered_chunks = 0
+    definitions = [node for node in ast.walk(tree) if isinstance(node, ast.FunctionDef) and node.name != "__init__"]
+    for position, node in enumerate(sorted(definitions, key=lambda n: n.lineno)):
+        if position % 2:
+            assert node.end_lineno is not None
+            uncovered.update(range(node.body[0].lineno, node.end_lineno + 1))
+            uncovered_chunks += 1
+    line_count = len(source.splitlines())
+    return [line for line in range(1, line_count + 1) if line not in uncovered], uncovered_chunks
+
+
+def generate_project(root: Path, spec: ProjectSpec) -> GeneratedProject:
+    """Writes a synthetic project (sources, one test file per module) and its .coverage database under `root`."""
+    source_folder = root / "src"
+    tests_folder = root / "tests"
+    lines: dict[str, list[int]] = {}
+    uncovered_chunks = 0
+    for file_index in range(spec.files):
+        package = f"package_{file_index % spec.packages}"
+        module_path = source_folder / package / f"module_{file_index}.py"
+        test_path = tests_folder / package / f"test_module_{file_index}.py"
+        module_path.parent.mkdir(parents=True, exist_ok=True)
+        test_path.parent.mkdir(parents=True, exist_ok=True)
+        source = _source_module(spec, file_index)
+        module_path.write_text(source)
+        test_path.write_text(
+            "import pytest\n\n\n" + "".join(_TEST_TEMPLATE.format(index=i) for i in range(spec.tests_per_file))
+        )
+        lines[str(module_path.resolve())], chunks = _executed_lines(source)
+        uncovered_chunks += chunks
+
+    coverage_file = root / ".coverage"
+    data = CoverageData(basename=str(coverage_file))
+    data.add_lines(lines)
+    data.write()
+    return GeneratedProject(root, source_folder, tests_folder, coverage_file, uncovered_chunks)
+
+
+_CHUNK_DEFINITION = re.compile(r"<source_code_chunk>\s*(?:async\s+)?def\s+(\w+)")
+_BATCH_CHUNK_NAME = re.compile(r"^name: (\S+)$", re.MULTILINE)
+
+
+class SyntheticBackend(LLMBackend):
+    """Answers every request with a small valid test for the requested chunk(s), after a synthetic latency."""
+
+    def __init__(self: Self, latency: LatencyModel | None = None) -> None:
+        self.latency = latency or LatencyModel()
+        self.requests = 0
+
+    async def complete(
+        self: Self,
+        system_msg: str,
+        user_msg: str,
+        json_output: bool = False,
+        stream: bool = False,
+        timing: GenerationTiming | None = None,
+    ) -> str:
+        self.requests += 1
+        if json_output:
+            names = _BATCH_CHUNK_NAME.findall(user_msg)
+            response = json.dumps({name: self._test_for(name) for name in names})
+        else:
+            match = _CHUNK_DEFINITION.search(user_msg)
+            response = self._test_for(match.group(1) if match else f"chunk_{self.requests}")
+        first_token, total = self.latency.sample(estimate_tokens(response))
+        if total > 0:
+            await asyncio.sleep(total)
+        if timing is not None:
+            timing.time_to_first_token = first_token
+            timing.total_time = total
+        return response
+
+    def _test_for(self: Self, name: str) -> str:
+        test_name = name.replace(".", "_").lower()
+        return f"def test_{test_name}_generated_{self.requests}():\n    assert {name.split('.')[-1]!r}\n"
+
+
+@dataclass
+class StageTimer:
+    """Accumulates the wall time and the number of calls of instrumented functions, per stage."""
+
+    seconds: dict[str, float] = field(default_factory=dict)
+    calls: dict[str, int] = field(default_factory=dict)
+
+    def _add(self: Self, stage: str, started: float) -> None:
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - started
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def wrap(self: Self, stage: str, function: Callable[..., Any]) -> Callable[..., Any]:
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def timed_coroutine(*args: object, **kwargs: object) -> object:
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self._add(stage, started)
+
+            return timed_coroutine
+
+        @functools.wraps(function)
+        def timed(*args: object, **kwargs: object) -> object:
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._add(stage, started)
+
+        return timed
+
+    @contextmanager
+    def instrument(self: Self, targets: dict[str, tuple[object, str]]) -> Iterator[Self]:
+        """Wraps `getattr(owner, name)` for every `stage: (owner, name)` while the context is active."""
+        originals: list[tuple[object, str, Any]] = []
+        try:
+            for stage, (owner, name) in targets.items():
+                original = inspect.getattr_static(owner, name)
+                originals.append((owner, name, original))
+                if isinstance(original, classmethod):
+                    setattr(owner, name, classmethod(self.wrap(stage, original.__func__)))
+                else:
+                    setattr(owner, name, self.wrap(stage, original))
+            yield self
+        finally:
+            for owner, name, original in reversed(originals):
+                setattr(owner, name, original)
+
+
+@dataclass
+class BenchmarkRecord:
+    """Timings of one benchmark: total wall time per round, plus the time spent in each stage."""
+
+    name: str
+    rounds: list[float]
+    stages: dict[str, list[float]] = field(default_factory=dict)
+    calls: dict[str, int] = field(default_factory=dict)
+    peak_memory_mb: float | None = None
+    extra: dict[str, Any] = field(default_factory=dict)
@@ -0,0 +1,98 @@
+import asyncio
+import time
+import tracemalloc
+from dataclasses import replace
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from ai_unit_test import cli, overlay
+from ai_unit_test.file_helper import TestFileIndex, module_cache
+
+from .synthetic_project import BenchmarkRecord, ProjectSpec, StageTimer, SyntheticBackend, generate_project
+
+# Stages are timed cumulatively: concurrent LLM calls overlap, so their sum can exceed the total time
+STAGES: dict[str, tuple[object, str]] = {
+    "collect_missing_lines": (cli, "collect_missing_lines"),
+    "TestFileIndex.build": (TestFileIndex, "build"),
+    "find_test_file": (cli, "find_test_file"),
+    "_detect_test_style": (cli, "_detect_test_style"),
+    "get_source_code_chunks": (cli, "get_source_code_chunks"),
+    "update_test_with_llm": (cli, "update_test_with_llm"),
+    "update_tests_batch_with_llm": (cli, "update_tests_batch_with_llm"),
+    "insert_new_test": (overlay, "insert_new_test"),
+    "EditOverlay.flush": (overlay.EditOverlay, "flush"),
+}
+
+SCENARIOS = [
+    pytest.param(ProjectSpec(), {}, id="per-chunk"),
+    pytest.param(ProjectSpec(), {"batch_tokens": 2000}, id="batched"),
+    pytest.param(ProjectSpec(), {"fast_coverage": True}, id="fast-coverage"),
+    pytest.param(ProjectSpec(classes_per_file=0, functions_per_file=12, tests_per_file=200), {}, id="large-tests"),
+]
+
+
+def _run_main(root: Path, spec: ProjectSpec, options: dict[str, Any]) -> tuple[float, StageTimer, int, int]:
+    project = generate_project(root, spec)
+    module_cache.clear()
+    backend = SyntheticBackend()
+    timer = StageTimer()
+    with timer.instrument(STAGES):
+        started = time.perf_counter()
+        asyncio.run(
+            cli._main(
+                folders=[str(project.source_folder)],
+                tests_folder=str(project.tests_folder),
+                coverage_file=str(project.coverage_file),
+                use_cache=False,
+                backend=backend,
+                **options,
+            )
+        )
+        elapsed = time.perf_counter() - started
+    return elapsed, timer, backend.requests, project.uncovered_chunks
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("spec, options", SCENARIOS)
+def test_benchmark_main(
+    spec: ProjectSpec,
+    options: dict[str, Any],
+    tmp_path_factory: pytest.TempPathFactory,
+    monkeypatch: pytest.MonkeyPatch,
+    request: pytest.FixtureRequest,
+    bench_records: list[BenchmarkRecord],
+) -> None:
+    """
+    Benchmarks a whole `main` run over a synthetic project against a synthetic LLM backend.
+    """
+    spec = replace(spec, files=spec.files * request.config.getoption("--bench-scale"))
+    record = BenchmarkRecord(name=f"main[{request.node.callspec.id}] {spec.label}", rounds=[])
+
+    for round_index in range(request.config.getoption("--bench-rounds")):
+        root = tmp_path_factory.mktemp(f"project_{round_index}")
+        monkeypatch.chdir(root)
+        elapsed, timer, requests, uncovered_chunks = _run_main(root, spec, options)
+        record.rounds.append(elapsed)
+        for stage, seconds in timer.seconds.items():
+            record.stages.setdefault(stage, []).append(seconds)
+        record.calls = timer.calls
+        record.extra = {"llm_requests": requests, "uncovered_chunks": uncovered_chunks}
+        if "batch_tokens" in options:
+            assert requests < uncovered_chunks
+        else:
+            assert requests == uncovered_chunks
+        test_file = root / "tests" / "package_0" / "test_module_0.py"
+        assert "_generated_" in test_file.read_text()
+
+    # Memory is measured in a separate round, as tracing slows everything down
+    root = tmp_path_factory.mktemp("project_memory")
+    monkeypatch.chdir(root)
+    tracemalloc.start()
+    try:
+        _run_main(root, spec, options)
+        record.peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+    bench_records.append(record)
@@ -0,0 +1,75 @@
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from .synthetic_project import BenchmarkRecord
+
+SRC = Path(__file__).resolve().parents[2] / "src"
+# Only loaded by the code paths that talk to the API or read coverage data
+HEAVY_MODULES = ("openai", "httpx", "pydantic", "coverage")
+
+_IMPORT_TIME = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)$")
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess[str]:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(SRC), os.environ.get("PYTHONPATH")]))}
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True, env=env)
+
+
+def _import_times(module: str) -> dict[str, float]:
+    """Cumulative import time in seconds of `module` and of each module it imports directly, from -X importtime."""
+    times: dict[str, float] = {}
+    for line in _run_python("-X", "importtime", "-c", f"import {module}").stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match is None:
+            continue
+        cumulative, indent, name = match.groups()
+        # The module itself is at depth 0 and its direct imports at depth 1
+        if name == module or (len(indent) == 3 and name not in times):
+            times[name] = int(cumulative) / 1_000_000
+    return times
+
+
+@pytest.mark.benchmark
+def test_cli_import_does_not_load_heavy_dependencies() -> None:
+    """
+    Tests that importing the CLI does not import openai, httpx, pydantic or coverage.
+    """
+    loaded = _run_python(
+        "-c", f"import sys, ai_unit_test.main; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+
+    assert loaded.stdout.split() == []
+
+
+@pytest.mark.benchmark
+def test_benchmark_cli_startup(request: pytest.FixtureRequest, bench_records: list[BenchmarkRecord]) -> None:
+    """
+    Benchmarks the import time of the CLI, per direct import, and the wall time of `--help`.
+    """
+    rounds = request.config.getoption("--bench-rounds")
+    imports = BenchmarkRecord(name="import ai_unit_test.cli", rounds=[])
+    help_record = BenchmarkRecord(name="ai-unit-test --help", rounds=[])
+    for _ in range(rounds):
+        times = _import_times("ai_unit_test.cli")
+        imports.rounds.append(times.pop("ai_unit_test.cli"))
+        for name, seconds in times.items():
+            imports.stages.setdefault(f"import {name}", []).append(seconds)
+
+        started = time.perf_counter()
+        _run_python("-m", "ai_unit_test.main", "--help")
+        help_record.rounds.append(time.perf_counter() - started)
+
+    # Only the slowest direct imports are worth a row; a module imported in some rounds only is dropped
+    slowest = sorted(
+        (stage for stage, values in imports.stages.items() if len(values) == rounds),
+        key=lambda stage: -max(imports.stages[stage]),
+    )[:8]
+    imports.stages = {stage: imports.stages[stage] for stage in slowest}
+    imports.calls = {stage: 1 for stage in slowest}
+    bench_records.extend([imports, help_record])
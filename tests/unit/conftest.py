@@ -1,7 +1,11 @@
 from collections.abc import Iterator
-from unittest.mock import MagicMock, patch
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from fakes import EXISTING_TEST, SOURCE_FILE, FakeBackend, FakeProject
+
+from ai_unit_test.file_helper import Chunk
 
 
 @pytest.fixture
@@ -12,5 +16,48 @@ def mock_logger_error() -> Iterator[MagicMock]:
 
 @pytest.fixture
 def mock_read_file_content() -> Iterator[MagicMock]:
-    with patch("ai_unit_test.cli.read_file_content") as mock:
+    with patch("ai_unit_test.overlay.read_file_content") as mock:
         yield mock
+
+
+@pytest.fixture
+def mock_open_client() -> Iterator[MagicMock]:
+    with patch("ai_unit_test.cli.open_client") as mock:
+        mock.return_value.__aenter__.return_value = MagicMock()
+        yield mock
+
+
+@pytest.fixture
+def fake_backend() -> FakeBackend:
+    return FakeBackend()
+
+
+@pytest.fixture
+def mock_completion(mock_open_client: MagicMock) -> AsyncMock:
+    """The chat completion call of the mocked OpenAI client, answering every request with a test of `main`."""
+    completion = AsyncMock(
+        return_value=MagicMock(
+            choices=[MagicMock(message=MagicMock(content="def test_main():\n    pass\n"))], usage=None
+        )
+    )
+    mock_open_client.return_value.__aenter__.return_value.chat.completions.create = completion
+    return completion
+
+
+@pytest.fixture
+def fake_project(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[FakeProject]:
+    monkeypatch.chdir(tmp_path)
+    Path(".coverage").touch()
+    Path("tests").mkdir()
+    test_file = Path("tests/test_main.py")
+    test_file.write_text(EXISTING_TEST)
+    with (
+        patch("ai_unit_test.cli.collect_missing_lines") as mock_collect_missing_lines,
+        patch("ai_unit_test.cli.find_test_file", return_value=test_file) as mock_find_test_file,
+        patch("ai_unit_test.cli.get_source_code_chunks") as mock_get_source_code_chunks,
+    ):
+        mock_collect_missing_lines.return_value = {SOURCE_FILE: [1]}
+        mock_get_source_code_chunks.return_value = [
+            Chunk(name="main", type="function", source_code="def main(): pass", start_line=1, end_line=1)
+        ]
+        yield FakeProject(test_file, mock_collect_missing_lines, mock_find_test_file, mock_get_source_code_chunks)
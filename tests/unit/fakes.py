@@ -0,0 +1,52 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Self
+from unittest.mock import MagicMock
+
+from ai_unit_test.file_helper import Chunk
+from ai_unit_test.llm import GenerationTiming, LLMBackend
+
+EXISTING_TEST = "def test_existing():\n    pass\n"
+SOURCE_FILE = Path("src/main.py")
+
+
+class FakeBackend(LLMBackend):
+    """Answers every request with the same test and counts the requests."""
+
+    def __init__(self: Self) -> None:
+        self.calls = 0
+
+    async def complete(
+        self: Self,
+        system_msg: str,
+        user_msg: str,
+        json_output: bool = False,
+        stream: bool = False,
+        timing: GenerationTiming | None = None,
+    ) -> str:
+        self.calls += 1
+        return "def test_main():\n    pass\n"
+
+
+@dataclass
+class FakeProject:
+    """
+    A project in the working directory with a coverage file and the test file `tests/test_main.py`. The missing
+    lines, the test file lookup and the chunks of the source files are mocked: by default, `src/main.py` has a
+    function `main` with line 1 uncovered.
+    """
+
+    test_file: Path
+    collect_missing_lines: MagicMock
+    find_test_file: MagicMock
+    get_source_code_chunks: MagicMock
+
+    def uncover_functions(self: Self, count: int, source_file: Path = SOURCE_FILE) -> list[Chunk]:
+        """Makes `source_file` hold functions `func_1` to `func_<count>`, with line i of `func_i` uncovered."""
+        chunks = [
+            Chunk(name=f"func_{i}", type="function", source_code=f"def func_{i}(): pass", start_line=i, end_line=i)
+            for i in range(1, count + 1)
+        ]
+        self.collect_missing_lines.return_value = {source_file: list(range(1, count + 1))}
+        self.get_source_code_chunks.return_value = chunks
+        return chunks
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+from ai_unit_test.cache import ResponseCache
+
+
+def test_response_cache_roundtrip(tmp_path: Path) -> None:
+    """
+    Tests that a stored response is returned for the same key and persists across instances.
+    """
+    key = ResponseCache.make_key("model", "system", "user", 0.1)
+    cache = ResponseCache(tmp_path)
+    assert cache.get(key) is None
+    cache.set(key, "def test_x(): pass")
+    cache.close()
+
+    reopened = ResponseCache(tmp_path)
+    assert reopened.get(key) == "def test_x(): pass"
+    assert reopened.hits == 1
+    reopened.close()
+
+
+def test_response_cache_key_depends_on_all_inputs() -> None:
+    """
+    Tests that changing any prompt input changes the cache key.
+    """
+    base = ResponseCache.make_key("model", "system", "user", 0.1)
+    assert base == ResponseCache.make_key("model", "system", "user", 0.1)
+    assert base != ResponseCache.make_key("other-model", "system", "user", 0.1)
+    assert base != ResponseCache.make_key("model", "other-system", "user", 0.1)
+    assert base != ResponseCache.make_key("model", "system", "other-user", 0.1)
+    assert base != ResponseCache.make_key("model", "system", "user", 0.2)
+
+
+def test_response_cache_lru_eviction(tmp_path: Path) -> None:
+    """
+    Tests that the least recently used entries are evicted once the size cap is exceeded.
+    """
+    cache = ResponseCache(tmp_path, max_size_bytes=20)
+    cache.set("a", "x" * 8)
+    cache.set("b", "y" * 8)
+    assert cache.get("a") == "x" * 8  # "a" is now more recently used than "b"
+    cache.set("c", "z" * 8)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 8
+    assert cache.get("c") == "z" * 8
+    assert cache.total_size() <= 20
+    cache.close()
@@ -0,0 +1,97 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Self
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from ai_unit_test.cassette import (
+    Cassette,
+    CassetteMissError,
+    LatencyModel,
+    RecordingBackend,
+    ReplayBackend,
+)
+from ai_unit_test.llm import GenerationTiming, LLMBackend
+
+
+class EchoBackend(LLMBackend):
+    def __init__(self: Self) -> None:
+        self.calls = 0
+
+    async def complete(
+        self: Self,
+        system_msg: str,
+        user_msg: str,
+        json_output: bool = False,
+        stream: bool = False,
+        timing: GenerationTiming | None = None,
+    ) -> str:
+        self.calls += 1
+        if timing is not None:
+            timing.time_to_first_token = timing.total_time = 0.25
+        return f"def test_{len(user_msg)}():\n    pass\n"
+
+
+def test_record_then_replay_round_trip(tmp_path: Path) -> None:
+    """
+    Tests that recorded responses are saved with their latency and replayed without the recorded backend.
+    """
+    cassette_path = tmp_path / "cassette.json"
+    inner = EchoBackend()
+    recorder = RecordingBackend(inner, Cassette(cassette_path))
+
+    recorded = asyncio.run(recorder.complete("system", "user message"))
+    recorder.cassette.save()
+
+    data = json.loads(cassette_path.read_text())
+    assert [entry["total_time"] for entry in data["interactions"].values()] == [0.25]
+    replayer = ReplayBackend(Cassette.load(cassette_path))
+    timing = GenerationTiming()
+    assert asyncio.run(replayer.complete("system", "user message", timing=timing)) == recorded
+    assert inner.calls == 1
+    assert (timing.time_to_first_token, timing.total_time) == (0.0, 0.0)
+    with pytest.raises(CassetteMissError):
+        asyncio.run(replayer.complete("system", "another message"))
+    assert (replayer.hits, replayer.misses) == (1, 1)
+
+
+def test_cassette_load_rejects_other_versions(tmp_path: Path) -> None:
+    """
+    Tests that a cassette written by an incompatible version is refused.
+    """
+    cassette_path = tmp_path / "cassette.json"
+    cassette_path.write_text(json.dumps({"version": 0, "interactions": {}}))
+
+    with pytest.raises(ValueError):
+        Cassette.load(cassette_path)
+
+
+@patch("ai_unit_test.cassette.asyncio.sleep", new_callable=AsyncMock)
+def test_replay_applies_synthetic_latency(mock_sleep: AsyncMock, tmp_path: Path) -> None:
+    """
+    Tests that replayed responses wait for the time given by the latency model.
+    """
+    cassette = Cassette(tmp_path / "cassette.json")
+    cassette.record("system", "user", "x" * 400)
+    replayer = ReplayBackend(cassette, LatencyModel(time_to_first_token=0.5, tokens_per_second=100))
+    timing = GenerationTiming()
+
+    asyncio.run(replayer.complete("system", "user", timing=timing))
+
+    mock_sleep.assert_awaited_once_with(1.5)
+    assert (timing.time_to_first_token, timing.total_time) == (0.5, 1.5)
+
+
+def test_latency_model_jitter_is_reproducible() -> None:
+    """
+    Tests that the jitter stays within its bounds and is the same for the same seed.
+    """
+    samples = [LatencyModel(1.0, jitter=0.2, seed=7).sample(0)[0] for _ in range(2)]
+    model = LatencyModel(1.0, jitter=0.2, seed=7)
+    sequence = [model.sample(0)[0] for _ in range(50)]
+
+    assert samples[0] == samples[1] == sequence[0]
+    assert all(0.8 <= value <= 1.2 for value in sequence)
+    assert len(set(sequence)) > 1
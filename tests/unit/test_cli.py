@@ -1,19 +1,26 @@
+import ast
 import asyncio
+import json
 from pathlib import Path
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import pytest
+from fakes import EXISTING_TEST, FakeBackend, FakeProject
+from openai.types import CompletionUsage
+from openai.types.completion_usage import PromptTokensDetails
 from typer.testing import CliRunner
 
 from ai_unit_test.cli import (
     _detect_test_style,
     _main,
+    _process_missing_info,
     _resolve_paths_from_config,
     app,
     extract_from_pyproject,
     load_pyproject_config,
 )
 from ai_unit_test.file_helper import Chunk
+from ai_unit_test.manifest import Manifest
 
 
 def test_load_pyproject_config_exists() -> None:
@@ -44,7 +51,7 @@ def test_extract_from_pyproject() -> None:
     assert coverage_file == ".coverage.test"
 
 
-@patch("ai_unit_test.cli.write_file_content")
+@patch("ai_unit_test.overlay.write_file_atomic")
 @patch("ai_unit_test.cli.update_test_with_llm", new_callable=AsyncMock)
 @patch("ai_unit_test.cli.find_test_file")
 @patch("ai_unit_test.cli.collect_missing_lines")
@@ -62,8 +69,9 @@ def test_main_auto_discovery(
     mock_collect_missing_lines: MagicMock,
     mock_find_test_file: MagicMock,
     mock_update_test_with_llm: AsyncMock,
-    mock_write_file_content: MagicMock,
+    mock_write_file_atomic: MagicMock,
     mock_read_file_content: MagicMock,
+    mock_open_client: MagicMock,
 ) -> None:
     """
     Tests the _main function with auto-discovery enabled.
@@ -83,18 +91,22 @@ def test_main_auto_discovery(
     ]
     mock_update_test_with_llm.return_value = "updated_test_code"
 
-    asyncio.run(_main(auto=True, folders=["src"], tests_folder="tests", coverage_file=".coverage"))
+    asyncio.run(_main(auto=True, folders=["src"], tests_folder="tests", coverage_file=".coverage", use_cache=False))
 
     mock_load_pyproject_config.assert_called_once()
-    mock_collect_missing_lines.assert_called_once_with(".coverage")
-    mock_find_test_file.assert_called_once_with(str(Path("src/main.py")), "tests")
+    mock_collect_missing_lines.assert_called_once_with(
+        ".coverage", ["src"], ["tests"], None, fast=False, statement_cache_dir=None, only_files=None
+    )
+    mock_find_test_file.assert_called_once_with(str(Path("src/main.py")), "tests", ANY)
     mock_read_file_content.assert_any_call(Path("tests/test_main.py"))
     mock_update_test_with_llm.assert_called_once()
-    assert mock_write_file_content.call_args[0][0] == Path("tests/test_main.py")
-    assert "updated_test_code" in mock_write_file_content.call_args[0][1]
+    mock_open_client.assert_called_once()
+    assert mock_update_test_with_llm.call_args[0][6] is mock_open_client.return_value.__aenter__.return_value
+    assert mock_write_file_atomic.call_args[0][0] == Path("tests/test_main.py")
+    assert "updated_test_code" in mock_write_file_atomic.call_args[0][1]
 
 
-@patch("ai_unit_test.cli.write_file_content")
+@patch("ai_unit_test.overlay.write_file_atomic")
 @patch("ai_unit_test.cli.update_test_with_llm", new_callable=AsyncMock)
 @patch("ai_unit_test.cli.find_test_file")
 @patch("ai_unit_test.cli.collect_missing_lines")
@@ -108,8 +120,9 @@ def test_main_explicit_args(
     mock_collect_missing_lines: MagicMock,
     mock_find_test_file: MagicMock,
     mock_update_test_with_llm: AsyncMock,
-    mock_write_file_content: MagicMock,
+    mock_write_file_atomic: MagicMock,
     mock_read_file_content: MagicMock,
+    mock_open_client: MagicMock,
 ) -> None:
     """
     Tests the _main function with explicit arguments.
@@ -134,15 +147,18 @@ def test_main_explicit_args(
             tests_folder="tests",
             coverage_file=".coverage",
             auto=False,
+            use_cache=False,
         )
     )
 
-    mock_collect_missing_lines.assert_called_once_with(".coverage")
-    mock_find_test_file.assert_called_once_with(str(Path("src/main.py")), "tests")
+    mock_collect_missing_lines.assert_called_once_with(
+        ".coverage", ["src"], ["tests"], None, fast=False, statement_cache_dir=None, only_files=None
+    )
+    mock_find_test_file.assert_called_once_with(str(Path("src/main.py")), "tests", ANY)
     mock_read_file_content.assert_any_call(Path("tests/test_main.py"))
     mock_update_test_with_llm.assert_called_once()
-    assert mock_write_file_content.call_args[0][0] == Path("tests/test_main.py")
-    assert "updated_test_code" in mock_write_file_content.call_args[0][1]
+    assert mock_write_file_atomic.call_args[0][0] == Path("tests/test_main.py")
+    assert "updated_test_code" in mock_write_file_atomic.call_args[0][1]
 
 
 @patch("ai_unit_test.cli.logger.error")
@@ -256,7 +272,7 @@ def test_resolve_paths_from_config_with_auto(
     assert coverage_file == ".coverage"
 
 
-@patch("ai_unit_test.cli.read_file_content")
+@patch("ai_unit_test.file_helper.read_file_content")
 def test_detect_test_style_unittest_class(mock_read_file_content: MagicMock) -> None:
     """
     Tests the _detect_test_style function for unittest.TestCase classes.
@@ -268,7 +284,7 @@ def test_detect_test_style_unittest_class(mock_read_file_content: MagicMock) ->
     assert result == "unittest_class"
 
 
-@patch("ai_unit_test.cli.read_file_content")
+@patch("ai_unit_test.file_helper.read_file_content")
 def test_detect_test_style_pytest_function(mock_read_file_content: MagicMock) -> None:
     """
     Tests the _detect_test_style function for pytest function style.
@@ -278,7 +294,7 @@ def test_detect_test_style_pytest_function(mock_read_file_content: MagicMock) ->
     assert result == "pytest_function"
 
 
-@patch("ai_unit_test.cli.read_file_content")
+@patch("ai_unit_test.file_helper.read_file_content")
 def test_detect_test_style_empty_file(mock_read_file_content: MagicMock) -> None:
     """
     Tests the _detect_test_style function when the file is empty.
@@ -288,7 +304,7 @@ def test_detect_test_style_empty_file(mock_read_file_content: MagicMock) -> None
     assert result == "unknown"
 
 
-@patch("ai_unit_test.cli.read_file_content")
+@patch("ai_unit_test.file_helper.read_file_content")
 @patch("ai_unit_test.cli.logger.warning")
 def test_detect_test_style_syntax_error(mock_logger_warning: MagicMock, mock_read_file_content: MagicMock) -> None:
     """
@@ -311,6 +327,7 @@ def test_main_no_folders_or_tests_folder(mock_logger_error: MagicMock) -> None:
     mock_logger_error.assert_called_with("Coverage file not found: .coverage")
 
 
+@patch("ai_unit_test.file_helper.read_file_content")
 def test_detect_test_style_unittest_class_inheritance(mock_read_file_content: MagicMock) -> None:
     """
     Tests the _detect_test_style function for unittest.TestCase classes with inheritance.
@@ -323,7 +340,7 @@ def test_detect_test_style_unittest_class_inheritance(mock_read_file_content: Ma
     assert result == "unittest_class"
 
 
-@patch("ai_unit_test.cli.read_file_content")
+@patch("ai_unit_test.file_helper.read_file_content")
 def test_detect_test_style_pytest_function_with_decorator(mock_read_file_content: MagicMock) -> None:
     """
     Tests the _detect_test_style function for pytest function style with a decorator.
@@ -365,3 +382,225 @@ def test_func_command_no_tests_folder(
     assert result.exit_code == 0
     mock_logger_warning.assert_called_once_with("Test file not found for src/simple_math.py, skipping.")
     mock_exit.assert_called_once_with(0)
+
+
+@patch("ai_unit_test.cli.update_test_with_llm", new_callable=AsyncMock)
+def test_process_missing_info_concurrent_inserts_same_file(
+    mock_update_test_with_llm: AsyncMock, fake_project: FakeProject
+) -> None:
+    """
+    Tests that concurrent chunk updates to the same test file never overwrite each other.
+    """
+    fake_project.uncover_functions(5)
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_llm(source_code: str, *args: object, **kwargs: object) -> str:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return f"def test_{source_code.split()[1].split('(')[0]}():\n    pass\n"
+
+    mock_update_test_with_llm.side_effect = fake_llm
+
+    asyncio.run(_process_missing_info({Path("src/main.py"): [1, 2, 3, 4, 5]}, "tests", MagicMock(), concurrency=2))
+
+    content = fake_project.test_file.read_text()
+    assert "def test_existing" in content
+    for i in range(1, 6):
+        assert f"def test_func_{i}()" in content
+    assert max_in_flight == 2
+
+
+@patch("ai_unit_test.cli.update_test_with_llm", new_callable=AsyncMock)
+def test_process_missing_info_incremental_skips_unchanged(
+    mock_update_test_with_llm: AsyncMock, fake_project: FakeProject
+) -> None:
+    """
+    Tests that a second incremental run skips chunks handled successfully in the first run.
+    """
+    mock_update_test_with_llm.return_value = "def test_main():\n    pass\n"
+    manifest_path = Path("manifest.json")
+    missing_info = {Path("src/main.py"): [1]}
+
+    manifest = Manifest(manifest_path)
+    asyncio.run(_process_missing_info(missing_info, "tests", MagicMock(), manifest=manifest))
+    manifest.save()
+    asyncio.run(_process_missing_info(missing_info, "tests", MagicMock(), manifest=Manifest(manifest_path)))
+
+    mock_update_test_with_llm.assert_called_once()
+
+
+@patch("ai_unit_test.cli.update_tests_batch_with_llm", new_callable=AsyncMock)
+@patch("ai_unit_test.cli.update_test_with_llm", new_callable=AsyncMock)
+def test_process_missing_info_batches_chunks_of_a_file(
+    mock_update_test_with_llm: AsyncMock, mock_update_tests_batch_with_llm: AsyncMock, fake_project: FakeProject
+) -> None:
+    """
+    Tests that batch mode sends the chunks of a file in one request and records unanswered chunks as errors.
+    """
+    chunks = fake_project.uncover_functions(3)
+    mock_update_tests_batch_with_llm.return_value = {
+        "func_1": "def test_func_1():\n    pass\n",
+        "func_2": "def test_func_2():\n    pass\n",
+    }
+    manifest = Manifest(Path("manifest.json"))
+
+    asyncio.run(
+        _process_missing_info(
+            {Path("src/main.py"): [1, 2, 3]}, "tests", MagicMock(), manifest=manifest, batch_tokens=1000
+        )
+    )
+
+    mock_update_test_with_llm.assert_not_called()
+    mock_update_tests_batch_with_llm.assert_awaited_once()
+    assert [chunk.name for chunk, _ in mock_update_tests_batch_with_llm.call_args.args[0]] == [
+        "func_1",
+        "func_2",
+        "func_3",
+    ]
+    content = fake_project.test_file.read_text()
+    assert "def test_func_1()" in content and "def test_func_2()" in content
+    assert manifest.is_unchanged(Path("src/main.py"), chunks[0], [1])
+    assert not manifest.is_unchanged(Path("src/main.py"), chunks[2], [3])
+
+
+@patch("ai_unit_test.cli.update_test_with_llm", new_callable=AsyncMock)
+def test_main_patch_mode_leaves_tree_untouched(
+    mock_update_test_with_llm: AsyncMock, mock_open_client: MagicMock, fake_project: FakeProject
+) -> None:
+    """
+    Tests that with a patch file the new tests are written as a diff and the test file is not modified.
+    """
+    fake_project.uncover_functions(2)
+    mock_update_test_with_llm.side_effect = ["def test_func_1():\n    pass\n", "def test_func_2():\n    pass\n"]
+
+    asyncio.run(_main(folders=["src"], tests_folder="tests", use_cache=False, patch_file="out.diff"))
+
+    assert fake_project.test_file.read_text() == EXISTING_TEST
+    diff = Path("out.diff").read_text()
+    assert diff.startswith("--- a/tests/test_main.py\n+++ b/tests/test_main.py\n")
+    assert "+def test_func_1():" in diff and "+def test_func_2():" in diff
+
+
+def test_main_record_then_replay_offline(
+    mock_open_client: MagicMock, mock_completion: AsyncMock, fake_project: FakeProject
+) -> None:
+    """
+    Tests that a recorded run can be replayed without opening an API client, producing the same tests.
+    """
+    test_file = fake_project.test_file
+
+    asyncio.run(_main(folders=["src"], tests_folder="tests", use_cache=False, record_file="cassette.json"))
+    recorded = test_file.read_text()
+    mock_open_client.reset_mock()
+    test_file.write_text(EXISTING_TEST)
+    asyncio.run(_main(folders=["src"], tests_folder="tests", replay_file="cassette.json"))
+
+    assert "def test_main()" in recorded
+    assert test_file.read_text() == recorded
+    mock_open_client.assert_not_called()
+
+
+def test_main_profile_writes_trace(mock_completion: AsyncMock, fake_project: FakeProject) -> None:
+    """
+    Tests that --profile writes a Chrome trace with a span for every stage of the pipeline.
+    """
+    result = CliRunner().invoke(
+        app, ["main", "--folders", "src", "--tests-folder", "tests", "--no-cache", "--profile", "trace.json"]
+    )
+
+    assert result.exit_code == 0
+    events = json.loads(Path("trace.json").read_text())["traceEvents"]
+    stages = {event["name"] for event in events if event["ph"] == "X"}
+    assert stages == {
+        "config",
+        "coverage",
+        "test_index",
+        "test_lookup",
+        "parse",
+        "prompt_build",
+        "llm_wait",
+        "insert",
+        "write",
+    }
+    assert "def test_main()" in fake_project.test_file.read_text()
+
+
+def test_main_report_usage_per_chunk_file_and_run(mock_completion: AsyncMock, fake_project: FakeProject) -> None:
+    """
+    Tests that the token usage of every request is reported per chunk, source file and run, with its cost.
+    """
+    fake_project.uncover_functions(2)
+    Path("prices.json").write_text(json.dumps({"gpt-4o-mini": {"input": 1.0, "output": 2.0, "cached_input": 0.5}}))
+    usage = CompletionUsage(
+        prompt_tokens=1000,
+        completion_tokens=200,
+        total_tokens=1200,
+        prompt_tokens_details=PromptTokensDetails(cached_tokens=400),
+    )
+    mock_completion.return_value.usage = usage
+
+    asyncio.run(
+        _main(
+            folders=["src"], tests_folder="tests", use_cache=False, report_file="report.json", price_table="prices.json"
+        )
+    )
+
+    report = json.loads(Path("report.json").read_text())
+    # 600 uncached prompt tokens at 1.0, 400 cached at 0.5 and 200 completion tokens at 2.0 per million
+    assert report["run"]["requests"] == 2
+    assert report["run"]["prompt_tokens"] == 2000
+    assert report["run"]["cached_tokens"] == 800
+    assert report["run"]["completion_tokens"] == 400
+    assert report["run"]["cost_usd"] == pytest.approx(0.0024)
+    assert [(f["source_file"], f["requests"], f["total_tokens"]) for f in report["files"]] == [
+        (str(Path("src/main.py")), 2, 2400)
+    ]
+    assert {chunk["chunk"]: chunk["cost_usd"] for chunk in report["chunks"]} == {
+        "func_1": pytest.approx(0.0012),
+        "func_2": pytest.approx(0.0012),
+    }
+
+
+def test_main_chunks_of_one_test_file_do_not_shadow_each_other(
+    fake_project: FakeProject, fake_backend: FakeBackend
+) -> None:
+    """
+    Tests that two chunks answered with tests of the same name, each request seeing only its slice of the test
+    file, keep both tests in that file.
+    """
+    fake_project.uncover_functions(2)
+
+    asyncio.run(_main(folders=["src"], tests_folder="tests", use_cache=False, backend=fake_backend))
+
+    tree = ast.parse(fake_project.test_file.read_text())
+    names = [node.name for node in tree.body if isinstance(node, ast.FunctionDef)]
+    assert fake_backend.calls == 2
+    assert names == ["test_existing", "test_main", "test_main_2"]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["main", "--folders", "src", "--tests-folder", "tests", "--no-cache"],
+        ["func", "src/main.py", "main", "--tests-folder", "tests", "--no-cache"],
+    ],
+)
+def test_missing_api_key_exits_with_error(
+    args: list[str], mock_logger_error: MagicMock, fake_project: FakeProject, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Tests that main and func exit with a logged error, rather than a traceback, when OPENAI_API_KEY is not set.
+    """
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    Path("src").mkdir()
+    Path("src/main.py").write_text("def main():\n    pass\n")
+
+    result = CliRunner().invoke(app, args)
+
+    assert result.exit_code == 1
+    assert isinstance(result.exception, SystemExit)
+    mock_logger_error.assert_called_with("Set the OPENAI_API_KEY environment variable with your OpenAI key.")
@@ -1,10 +1,17 @@
+import os
+import subprocess  # nosec B404
+import sys
+import time
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
-from ai_unit_test.coverage_helper import collect_missing_lines
+import pytest
+from coverage import Coverage, CoverageData
 
+from ai_unit_test.coverage_helper import StatementTable, collect_missing_lines, filter_measured_files
 
-@patch("ai_unit_test.coverage_helper.Coverage")
+
+@patch("coverage.Coverage")
 def test_collect_missing_lines(mock_coverage_class: MagicMock) -> None:
     """
     Tests that collect_missing_lines correctly identifies missing lines.
@@ -35,7 +42,7 @@ def test_collect_missing_lines(mock_coverage_class: MagicMock) -> None:
     mock_cov_instance.analysis.assert_any_call("src/another_file.py")
 
 
-@patch("ai_unit_test.coverage_helper.Coverage")
+@patch("coverage.Coverage")
 def test_collect_missing_lines_no_missing(mock_coverage_class: MagicMock) -> None:
     """
     Tests that collect_missing_lines returns an empty dict when no missing lines.
@@ -51,3 +58,172 @@ def test_collect_missing_lines_no_missing(mock_coverage_class: MagicMock) -> Non
     mock_cov_instance.load.assert_called_once()
     mock_cov_instance.get_data.assert_called_once()
     mock_cov_instance.analysis.assert_called_once_with("src/main.py")
+
+
+@pytest.fixture
+def coverage_project(tmp_path: Path) -> tuple[str, Path]:
+    """
+    Creates a small project with source, test and third-party files and a matching .coverage file.
+    """
+    files: dict[Path, dict[int, None]] = {}
+    for folder in ["src", "tests", "site-packages"]:
+        (tmp_path / folder).mkdir()
+        for i in range(3):
+            source = tmp_path / folder / f"module_{i}.py"
+            source.write_text("a = 1\nif a:\n    b = 2\nelse:\n    b = 3\n")
+            files[source] = dict.fromkeys([1, 2, 3])
+    data_file = str(tmp_path / ".coverage")
+    data = CoverageData(basename=data_file)
+    data.add_lines({str(path): lines for path, lines in files.items()})
+    data.write()
+    return data_file, tmp_path
+
+
+def test_collect_missing_lines_filters_folders(coverage_project: tuple[str, Path]) -> None:
+    """
+    Tests that only files under the source folders, outside the excluded folders, are analyzed.
+    """
+    data_file, root = coverage_project
+
+    missing_info = collect_missing_lines(data_file, [str(root)], [str(root / "tests"), str(root / "site-packages")])
+
+    assert sorted(missing_info) == [root / "src" / f"module_{i}.py" for i in range(3)]
+    assert all(lines == [5] for lines in missing_info.values())
+
+
+def test_collect_missing_lines_parallel_matches_serial(coverage_project: tuple[str, Path]) -> None:
+    """
+    Tests that the process pool produces the same result as the serial analysis.
+    """
+    data_file, root = coverage_project
+
+    serial = collect_missing_lines(data_file, [str(root)], workers=1)
+    with patch("ai_unit_test.coverage_helper.PARALLEL_ANALYSIS_MIN_FILES", 1):
+        parallel = collect_missing_lines(data_file, [str(root)], workers=2)
+
+    assert len(serial) == 9
+    assert parallel == serial
+
+
+def test_filter_measured_files_relative_folders() -> None:
+    """
+    Tests that relative source folders match absolute measured paths.
+    """
+    measured = [os.path.abspath("src/pkg/a.py"), os.path.abspath("tests/test_a.py"), "/usr/lib/python3/os.py"]
+    assert filter_measured_files(measured, ["src"]) == [os.path.abspath("src/pkg/a.py")]
+    assert filter_measured_files(measured) == measured
+
+
+def test_filter_measured_files_only_files() -> None:
+    """
+    Tests that only the given files are kept when a list of files is given, even as relative paths.
+    """
+    measured = [os.path.abspath("src/pkg/a.py"), os.path.abspath("src/pkg/b.py")]
+    assert filter_measured_files(measured, ["src"], only_files=["src/pkg/b.py"]) == [os.path.abspath("src/pkg/b.py")]
+    assert filter_measured_files(measured, ["src"], only_files=[]) == []
+
+
+TRICKY_SOURCE = """def f(x):
+    y = (1 +
+         2)
+    if x:  # pragma: no cover
+        return 1
+    z = [
+        1,
+    ]
+    return y
+
+
+def g(flag):
+    if flag:
+        return 1
+    return 2
+
+
+class C:
+    def m(self):
+        return 3
+
+
+f(0)
+g(True)
+"""
+
+
+def _run_coverage(tmp_path: Path, branch: bool) -> tuple[str, Path]:
+    source = tmp_path / "src" / "tricky.py"
+    source.parent.mkdir(exist_ok=True)
+    source.write_text(TRICKY_SOURCE)
+    data_file = str(tmp_path / (".coverage.branch" if branch else ".coverage.lines"))
+    command = [sys.executable, "-m", "coverage", "run", f"--data-file={data_file}"]
+    if branch:
+        command.append("--branch")
+    subprocess.run([*command, str(source)], cwd=tmp_path, check=True)  # nosec B603
+    return data_file, source
+
+
+@pytest.mark.parametrize("branch", [False, True])
+def test_collect_missing_lines_fast_matches_analysis(tmp_path: Path, branch: bool) -> None:
+    """
+    Tests that the direct SQLite fast path finds the same missing lines as Coverage.analysis.
+    """
+    data_file, source = _run_coverage(tmp_path, branch)
+
+    expected = collect_missing_lines(data_file, [str(tmp_path / "src")])
+    fast = collect_missing_lines(data_file, [str(tmp_path / "src")], fast=True)
+    cached = collect_missing_lines(
+        data_file, [str(tmp_path / "src")], fast=True, statement_cache_dir=tmp_path / "cache"
+    )
+    from_disk = collect_missing_lines(
+        data_file, [str(tmp_path / "src")], fast=True, statement_cache_dir=tmp_path / "cache"
+    )
+
+    assert expected[source] == [15, 20]
+    assert fast == cached == from_disk == expected
+
+
+def test_statement_table_invalidated_on_change(tmp_path: Path) -> None:
+    """
+    Tests that a cached statement table is recomputed once the source file changes.
+    """
+    source = tmp_path / "module.py"
+    source.write_text("a = 1\n")
+    table = StatementTable(Coverage(data_file=None), tmp_path / "cache")
+    assert table.get(str(source))[0] == {1}
+    source.write_text("a = 1\nb = (2 +\n     3)\n")
+    assert table.get(str(source)) == ({1, 2}, {3: 2})
+    table.close()
+
+
+@pytest.mark.benchmark
+def test_benchmark_fast_path_against_analysis(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    """
+    Benchmarks the fast path (cold and with a warm statement cache) against Coverage.analysis.
+    """
+    lines: dict[str, list[int]] = {}
+    for i in range(200):
+        source = tmp_path / f"module_{i}.py"
+        source.write_text(TRICKY_SOURCE * 5)
+        lines[str(source)] = list(range(1, 60, 2))
+    data_file = str(tmp_path / ".coverage")
+    data = CoverageData(basename=data_file)
+    data.add_lines(lines)
+    data.write()
+
+    timings: dict[str, float] = {}
+    results = []
+    for name, kwargs in [
+        ("analysis", {"workers": 1}),
+        ("fast (cold)", {"fast": True, "statement_cache_dir": tmp_path / "cache"}),
+        ("fast (warm)", {"fast": True, "statement_cache_dir": tmp_path / "cache"}),
+    ]:
+        start = time.perf_counter()
+        results.append(collect_missing_lines(data_file, [str(tmp_path)], **kwargs))  # type: ignore[arg-type]
+        timings[name] = time.perf_counter() - start
+
+    assert results[0] == results[1] == results[2]
+    with capsys.disabled():
+        print(
+            "\n"
+            + "\n".join(f"collect_missing_lines {name}: {seconds * 1000:.1f} ms" for name, seconds in timings.items())
+        )
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any
+
+import pytest
+from fakes import FakeBackend, FakeProject
+from typer.testing import CliRunner
+
+from ai_unit_test.cli import app
+from ai_unit_test.daemon import Daemon, DaemonUnavailableError, send_request
+
+
+async def _serve_and_send(daemon: Daemon, *requests: tuple[str, dict[str, Any]]) -> list[int]:
+    """Starts the daemon, sends the requests one after the other, then stops it."""
+    server = asyncio.create_task(daemon.serve())
+    await daemon.listening.wait()
+    exit_codes = [
+        await asyncio.to_thread(send_request, daemon.socket_path, command, options) for command, options in requests
+    ]
+    await asyncio.to_thread(send_request, daemon.socket_path, "shutdown")
+    await server
+    return exit_codes
+
+
+def test_daemon_reuses_coverage_and_forwards_logs(
+    tmp_path: Path, caplog: pytest.LogCaptureFixture, fake_project: FakeProject, fake_backend: FakeBackend
+) -> None:
+    """
+    Tests that runs served by the daemon share its backend, collect the missing lines of an unchanged coverage
+    file only once, and send their logs back to the client.
+    """
+    caplog.set_level(logging.INFO)
+    daemon = Daemon(tmp_path / "d.sock", backend=fake_backend)
+    options = {"folders": ["src"], "tests_folder": "tests", "use_cache": False}
+
+    exit_codes = asyncio.run(_serve_and_send(daemon, ("main", options), ("main", options)))
+
+    assert exit_codes == [0, 0]
+    assert daemon.runs == 2
+    assert fake_backend.calls == 2
+    fake_project.collect_missing_lines.assert_called_once()
+    assert "def test_main()" in fake_project.test_file.read_text()
+    # Records logged again by the client, in the thread that sent the request
+    forwarded = [record.getMessage() for record in caplog.records if record.threadName != "MainThread"]
+    assert any("reusing the missing lines" in message for message in forwarded)
+    assert not daemon.socket_path.exists()
+
+
+def test_daemon_returns_exit_code_of_failed_run(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_backend: FakeBackend
+) -> None:
+    """
+    Tests that a run exiting with an error returns its exit code to the client and leaves the daemon serving.
+    """
+    monkeypatch.chdir(tmp_path)
+    daemon = Daemon(tmp_path / "d.sock", backend=fake_backend)
+
+    exit_codes = asyncio.run(_serve_and_send(daemon, ("main", {}), ("ping", {})))
+
+    assert exit_codes == [1, 0]
+
+
+def test_daemon_replaces_stale_socket(tmp_path: Path, fake_backend: FakeBackend) -> None:
+    """
+    Tests that a socket file left by a daemon that did not stop cleanly is replaced.
+    """
+    socket_path = tmp_path / "d.sock"
+    socket_path.touch()
+
+    assert asyncio.run(_serve_and_send(Daemon(socket_path, backend=fake_backend), ("ping", {}))) == [0]
+
+
+def test_send_request_without_daemon(tmp_path: Path) -> None:
+    """
+    Tests that the client raises DaemonUnavailableError when no daemon listens on the socket.
+    """
+    with pytest.raises(DaemonUnavailableError):
+        send_request(tmp_path / "missing.sock", "ping")
+
+
+def test_main_daemon_rejects_replay(tmp_path: Path) -> None:
+    """
+    Tests that --replay cannot be combined with --daemon, which uses the LLM client of the daemon.
+    """
+    result = CliRunner().invoke(app, ["main", "--daemon", str(tmp_path / "d.sock"), "--replay", "cassette.json"])
+
+    assert result.exit_code == 1
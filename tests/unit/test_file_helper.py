@@ -1,35 +1,54 @@
+import ast
 from pathlib import Path
 from unittest.mock import mock_open, patch
 
+import pytest
+
 from ai_unit_test.file_helper import (
     Chunk,
+    ModuleCache,
+    ParsedModule,
+    TestFileIndex,
+    assign_uncovered_lines,
     extract_function_source,
     find_relevant_tests,
     find_test_file,
     get_source_code_chunks,
+    insert_new_test,
+    parse_module,
     read_file_content,
+    slice_test_context,
+    write_file_atomic,
     write_file_content,
 )
 
 
-def test_find_test_file_found() -> None:
+@pytest.fixture
+def tests_tree(tmp_path: Path) -> Path:
+    """
+    Creates a tests folder with a few test files.
+    """
+    tests_folder = tmp_path / "tests"
+    tests_folder.mkdir()
+    for name in ["test_dummy_source.py", "test_another_source.py", "test_my_script.py"]:
+        (tests_folder / name).write_text("")
+    return tests_folder
+
+
+def test_find_test_file_found(tests_tree: Path) -> None:
     """
     Tests that find_test_file correctly finds an existing test file.
     """
-    with patch("pathlib.Path.rglob") as mock_rglob:
-        mock_rglob.return_value = [Path("tests/unit/test_dummy_source.py")]
-        test_file = find_test_file("src/dummy_source.py", "tests/unit")
-        assert test_file == Path("tests/unit/test_dummy_source.py")
+    test_file = find_test_file("src/dummy_source.py", str(tests_tree))
+    assert test_file == tests_tree / "test_dummy_source.py"
 
 
-def test_find_test_file_not_found() -> None:
+def test_find_test_file_not_found(tests_tree: Path) -> None:
     """
     Tests that find_test_file returns None when no test file is found.
     """
-    with patch("pathlib.Path.rglob") as mock_rglob:
-        mock_rglob.return_value = []
-        test_file = find_test_file("src/non_existent_source.py", "tests/unit")
-        assert test_file is None
+    test_file = find_test_file("src/non_existent_source.py", str(tests_tree))
+    assert test_file is None
 
 
 def test_read_file_content_exists() -> None:
@@ -142,7 +161,7 @@ def test_find_relevant_tests_not_found() -> None:
 
 def test_get_source_code_chunks_valid_file() -> None:
     """
-    Tests that get_source_code_chunks correctly extracts classes and functions from a valid Python file.
+    Tests that get_source_code_chunks correctly extracts classes, methods and functions from a valid Python file.
     """
     file_content = """class MyClass:
     def method_a(self):
@@ -153,7 +172,7 @@ def my_function():
 """
     with patch("ai_unit_test.file_helper.read_file_content", return_value=file_content):
         chunks = get_source_code_chunks(Path("dummy.py"))
-        assert len(chunks) == 2
+        assert len(chunks) == 3
         assert chunks[0] == Chunk(
             name="MyClass",
             type="class",
@@ -162,6 +181,14 @@ def my_function():
             end_line=3,
         )
         assert chunks[1] == Chunk(
+            name="MyClass.method_a",
+            type="method",
+            source_code="def method_a(self):\n        pass",
+            start_line=2,
+            end_line=3,
+            context="class MyClass:",
+        )
+        assert chunks[2] == Chunk(
             name="my_function",
             type="function",
             source_code="def my_function():\n    return 42",
@@ -194,54 +221,307 @@ def invalid_function(
         assert len(chunks) == 0
 
 
-def test_find_test_file_multiple_found() -> None:
+def test_find_test_file_multiple_found(tests_tree: Path) -> None:
     """
     Tests that find_test_file returns the first found test file when multiple exist.
     """
-    with patch("pathlib.Path.rglob") as mock_rglob:
-        mock_rglob.return_value = [Path("tests/unit/test_dummy_source.py"), Path("tests/unit/test_another_source.py")]
-        test_file = find_test_file("src/dummy_source.py", "tests/unit")
-        assert test_file == Path("tests/unit/test_dummy_source.py")
+    test_file = find_test_file("src/dummy_source.py", str(tests_tree))
+    assert test_file == tests_tree / "test_dummy_source.py"
 
 
-def test_find_test_file_empty_path() -> None:
+def test_find_test_file_empty_path(tests_tree: Path) -> None:
     """
     Tests that find_test_file returns None when the source file path is empty.
     """
-    with patch("pathlib.Path.rglob") as mock_rglob:
-        mock_rglob.return_value = []
-        test_file = find_test_file("", "tests/unit")
-        assert test_file is None
+    test_file = find_test_file("", str(tests_tree))
+    assert test_file is None
 
 
-def test_find_test_file_invalid_folder() -> None:
+def test_find_test_file_invalid_folder(tests_tree: Path) -> None:
     """
     Tests that find_test_file returns None when the tests folder does not exist.
     """
-    with patch("pathlib.Path.rglob") as mock_rglob:
-        mock_rglob.return_value = []
-        test_file = find_test_file("src/dummy_source.py", "invalid_folder")
-        assert test_file is None
+    test_file = find_test_file("src/dummy_source.py", str(tests_tree / "invalid_folder"))
+    assert test_file is None
 
 
-def test_find_test_file_source_file_not_found() -> None:
+def test_find_test_file_source_file_not_found(tests_tree: Path) -> None:
     """
     Tests that find_test_file returns None when the source file does not exist.
     """
-    with patch("pathlib.Path.rglob") as mock_rglob:
-        mock_rglob.return_value = []
-        test_file = find_test_file("src/non_existent_source.py", "tests/unit")
-        assert test_file is None
+    test_file = find_test_file("src/non_existent_source.py", str(tests_tree))
+    assert test_file is None
 
 
-def test_find_test_file_test_file_name_format() -> None:
+def test_find_test_file_test_file_name_format(tests_tree: Path) -> None:
     """
     Tests that find_test_file constructs the correct test file name from the source file name.
     """
     source_file_path = "src/my_script.py"
     expected_test_file_name = "test_my_script.py"
-    with patch("pathlib.Path.rglob") as mock_rglob:
-        mock_rglob.return_value = [Path(f"tests/unit/{expected_test_file_name}")]
-        test_file = find_test_file(source_file_path, "tests/unit")
-        assert test_file is not None
-        assert test_file.name == expected_test_file_name
+    test_file = find_test_file(source_file_path, str(tests_tree))
+    assert test_file is not None
+    assert test_file.name == expected_test_file_name
+
+
+def test_test_file_index_prefers_matching_directories(tmp_path: Path) -> None:
+    """
+    Tests that, among test files with the same name, the one in the directory matching the source wins.
+    """
+    tests_folder = tmp_path / "tests"
+    for sub in ["api", "core", "deep/nested"]:
+        (tests_folder / sub).mkdir(parents=True)
+        (tests_folder / sub / "test_models.py").write_text("")
+
+    index = TestFileIndex.build(str(tests_folder))
+
+    assert index.find("src/pkg/core/models.py") == tests_folder / "core" / "test_models.py"
+    assert index.find("src/pkg/api/models.py") == tests_folder / "api" / "test_models.py"
+    # No directory matches: the shallowest candidate, then the first by path, is chosen
+    assert index.find("src/models.py") == tests_folder / "api" / "test_models.py"
+
+
+def test_test_file_index_persistence(tmp_path: Path, tests_tree: Path) -> None:
+    """
+    Tests that a persisted index is reused while fresh and rebuilt once the tests tree changes.
+    """
+    index_path = tmp_path / "cache" / "test_index.json"
+    TestFileIndex.load_or_build(str(tests_tree), index_path)
+    assert index_path.exists()
+
+    with patch.object(TestFileIndex, "build") as mock_build:
+        reused = TestFileIndex.load_or_build(str(tests_tree), index_path)
+        mock_build.assert_not_called()
+    assert reused.find("src/my_script.py") == tests_tree / "test_my_script.py"
+
+    new_dir = tests_tree / "unit"
+    new_dir.mkdir()
+    (new_dir / "test_new_module.py").write_text("")
+    rebuilt = TestFileIndex.load_or_build(str(tests_tree), index_path)
+    assert rebuilt.find("src/new_module.py") == new_dir / "test_new_module.py"
+
+
+def test_module_cache_reads_and_parses_once(tmp_path: Path) -> None:
+    """
+    Tests that a file is read and parsed once and re-read only after it changes.
+    """
+    source = tmp_path / "module.py"
+    source.write_text("def func():\n    return 1\n")
+    cache = ModuleCache()
+
+    with patch("ai_unit_test.file_helper.read_file_content", wraps=read_file_content) as mock_read:
+        first = cache.get(source)
+        assert cache.get(source) is first
+        assert first.chunks is cache.get(source).chunks
+        assert mock_read.call_count == 1
+
+        source.write_text("def func():\n    return 2\n\n\ndef other():\n    pass\n")
+        second = cache.get(source)
+        assert mock_read.call_count == 2
+        assert [chunk.name for chunk in second.chunks] == ["func", "other"]
+
+
+def test_write_file_content_invalidates_module_cache(tmp_path: Path) -> None:
+    """
+    Tests that writing a file through write_file_content drops its cached parse.
+    """
+    test_file = tmp_path / "test_module.py"
+    test_file.write_text("def test_a():\n    pass\n")
+    before = parse_module(test_file)
+    write_file_content(test_file, "import unittest\n\n\nclass TestA(unittest.TestCase):\n    pass\n")
+    after = parse_module(test_file)
+    assert after is not before
+    assert after.test_style == "unittest_class"
+
+
+def test_parsed_module_segment_matches_ast() -> None:
+    """
+    Tests that ParsedModule.segment returns the same text as ast.get_source_segment.
+    """
+    text = 'x = "é"\r\nclass Café:\n    def método(self):\n        return "ü"  # ß\n\ndef f(): return 1\n'
+    module = ParsedModule("dummy.py", text)
+    assert module.tree is not None
+    for node in ast.walk(module.tree):
+        if isinstance(node, ast.stmt):
+            assert module.segment(node) == ast.get_source_segment(text, node)
+
+
+def test_get_source_code_chunks_hierarchy() -> None:
+    """
+    Tests that nested functions, async functions and class context are extracted.
+    """
+    file_content = """@dataclass
+class Service(Base):
+    \"\"\"A service.\"\"\"
+
+    def __init__(self, client):
+        self.client = client
+
+    async def fetch(self, key):
+        def normalize(value):
+            return value.strip()
+        return normalize(await self.client.get(key))
+
+
+async def main():
+    return 1
+"""
+    module = ParsedModule("dummy.py", file_content)
+    chunks = {chunk.name: chunk for chunk in module.chunks}
+
+    assert list(chunks) == ["Service", "Service.__init__", "Service.fetch", "Service.fetch.normalize", "main"]
+    assert chunks["Service.fetch"].type == "method"
+    assert chunks["Service.fetch"].context == (
+        '@dataclass\nclass Service(Base):\n    """A service."""\n'
+        "    def __init__(self, client):\n        self.client = client"
+    )
+    assert chunks["Service.__init__"].context == '@dataclass\nclass Service(Base):\n    """A service."""'
+    assert chunks["Service.fetch.normalize"].type == "function"
+    assert chunks["Service.fetch.normalize"].context.endswith("    async def fetch(self, key):")
+    assert chunks["main"] == Chunk(
+        name="main", type="function", source_code="async def main():\n    return 1", start_line=14, end_line=15
+    )
+
+
+def test_assign_uncovered_lines_innermost_chunk() -> None:
+    """
+    Tests that each uncovered line is assigned to the innermost chunk containing it.
+    """
+    chunks = [
+        Chunk(name="A", type="class", source_code="", start_line=1, end_line=20),
+        Chunk(name="A.m1", type="method", source_code="", start_line=3, end_line=8),
+        Chunk(name="A.m1.inner", type="function", source_code="", start_line=5, end_line=6),
+        Chunk(name="A.m2", type="method", source_code="", start_line=10, end_line=20),
+        Chunk(name="f", type="function", source_code="", start_line=22, end_line=25),
+    ]
+
+    assigned = assign_uncovered_lines(chunks, [2, 4, 6, 12, 30])
+
+    assert [(chunk.name, lines) for chunk, lines in assigned] == [
+        ("A", [2]),
+        ("A.m1", [4]),
+        ("A.m1.inner", [6]),
+        ("A.m2", [12]),
+    ]
+
+
+def test_write_file_atomic_keeps_mode_and_invalidates_cache(tmp_path: Path) -> None:
+    """
+    Tests that an atomic write replaces the content, keeps the file mode and leaves no temporary file.
+    """
+    test_file = tmp_path / "test_main.py"
+    test_file.write_text("def test_a():\n    pass\n")
+    test_file.chmod(0o640)
+    assert parse_module(test_file).test_style == "pytest_function"
+
+    write_file_atomic(test_file, "import unittest\n\n\nclass TestA(unittest.TestCase):\n    pass\n")
+
+    assert parse_module(test_file).test_style == "unittest_class"
+    assert test_file.stat().st_mode & 0o777 == 0o640
+    assert [path.name for path in tmp_path.iterdir()] == ["test_main.py"]
+
+
+SLICED_TESTS = """import unittest
+from pathlib import Path
+
+import pytest
+
+from pkg.parser import parse_body, parse_header
+
+SAMPLE = "a: 1"
+OTHER = "unused"
+
+
+def make_parser(text):
+    return parse_header(text)
+
+
+@pytest.fixture
+def body_text():
+    return SAMPLE + "body"
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    yield
+
+
+def test_parse_header():
+    assert make_parser(SAMPLE) == {"a": 1}
+
+
+def test_unrelated_path():
+    assert Path(OTHER)
+
+
+def test_parse_body(body_text):
+    assert parse_body(body_text)
+
+
+class TestParser(unittest.TestCase):
+    limit = 3
+
+    def setUp(self):
+        self.text = SAMPLE
+
+    def _check(self, value):
+        self.assertTrue(value)
+
+    def _unused(self):
+        pass
+
+    def test_header_limit(self):
+        self._check(parse_header(self.text))
+
+    def test_other_path(self):
+        self.assertEqual(OTHER, "x")
+
+
+if __name__ == "__main__":
+    unittest.main()
+"""
+
+
+def test_slice_test_context_keeps_similar_tests_and_dependencies() -> None:
+    """
+    Tests that the slice keeps the imports, the tests most similar to the target, the setUp and helpers of their
+    class, and the fixtures, helpers and constants they use, and drops everything else.
+    """
+    module = ParsedModule("tests/test_parser.py", SLICED_TESTS)
+    target = "def parse_header(text):\n    return dict(line.split(': ') for line in text.splitlines())\n"
+
+    sliced = slice_test_context(module, target, max_tests=3)
+
+    assert sliced.startswith("import unittest\nfrom pathlib import Path\n\nimport pytest\n")
+    for kept in ("def make_parser", "def body_text", "def reset", "SAMPLE =", "def setUp", "def _check", "limit = 3"):
+        assert kept in sliced
+    assert "def test_parse_header" in sliced and "def test_header_limit" in sliced
+    for dropped in ("OTHER", "def _unused", "def test_unrelated_path", "def test_other_path", "__main__"):
+        assert dropped not in sliced
+    ast.parse(sliced)
+
+
+def test_slice_test_context_small_or_invalid_module_whole() -> None:
+    """
+    Tests that modules with few tests, or with a syntax error, are returned whole.
+    """
+    small = ParsedModule("tests/test_small.py", "import os\n\n\ndef test_a():\n    pass\n")
+    invalid = ParsedModule("tests/test_invalid.py", "def test_a(:\n")
+
+    assert slice_test_context(small, "def a(): pass") == small.text
+    assert slice_test_context(invalid, "def a(): pass") == invalid.text
+
+
+def test_insert_new_test_renames_clashing_tests() -> None:
+    """
+    Tests that new tests named like existing ones are renamed rather than shadowing them, helpers left alone.
+    """
+    existing = "def helper():\n    pass\n\n\ndef test_a():\n    pass\n\n\ndef test_a_2():\n    pass\n"
+    new_test = "def helper():\n    pass\n\n\n@pytest.mark.slow\nasync def test_a():\n    await helper()\n"
+
+    updated = insert_new_test(existing, new_test)
+
+    names = [node.name for node in ast.parse(updated).body if isinstance(node, ast.AsyncFunctionDef)]
+    assert names == ["test_a_3"]
+    assert updated.count("def helper():") == 2
+    assert "    await helper()\n" in updated
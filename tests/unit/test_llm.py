@@ -1,10 +1,25 @@
 import os
 from collections.abc import Generator
-from unittest.mock import AsyncMock, MagicMock, patch
+from pathlib import Path
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
+import httpx
+import openai
 import pytest
+from openai.types import CompletionUsage
 
-from ai_unit_test.llm import update_test_with_llm
+from ai_unit_test.cache import ResponseCache
+from ai_unit_test.file_helper import Chunk
+from ai_unit_test.llm import (
+    GenerationTiming,
+    open_client,
+    parse_batch_response,
+    update_test_with_llm,
+    update_tests_batch_with_llm,
+)
+from ai_unit_test.scheduler import RateLimitScheduler
+from ai_unit_test.streaming import MalformedResponseError
+from ai_unit_test.usage import TokenUsage
 
 
 @pytest.fixture(autouse=True)
@@ -19,13 +34,14 @@ def mock_openai_api_key() -> Generator[None]:
         yield
 
 
-@patch("ai_unit_test.llm.AsyncOpenAI")
+@patch("openai.AsyncOpenAI")
 async def test_update_test_with_llm_success(mock_async_openai: MagicMock) -> None:
     """
     Tests that update_test_with_llm successfully calls the OpenAI API and returns the content.
     """
     # Mock the AsyncOpenAI client and its response
     mock_client_instance = mock_async_openai.return_value
+    mock_client_instance.close = AsyncMock()
     mock_create = AsyncMock()
     mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content="updated test content"))])
     mock_client_instance.chat.completions.create = mock_create
@@ -41,16 +57,18 @@ async def test_update_test_with_llm_success(mock_async_openai: MagicMock) -> Non
     )
 
     assert updated_content == "updated test content"
-    mock_async_openai.assert_called_once_with(api_key="test_key", base_url=None)
+    mock_async_openai.assert_called_once_with(api_key="test_key", base_url=None, http_client=ANY, max_retries=2)
     mock_client_instance.chat.completions.create.assert_called_once()
+    mock_client_instance.close.assert_awaited_once()
 
 
-@patch("ai_unit_test.llm.AsyncOpenAI")
+@patch("openai.AsyncOpenAI")
 async def test_update_test_with_llm_api_error(mock_async_openai: MagicMock) -> None:
     """
     Tests that update_test_with_llm raises an exception when the OpenAI API call fails.
     """
     mock_client_instance = mock_async_openai.return_value
+    mock_client_instance.close = AsyncMock()
     mock_client_instance.chat.completions.create.side_effect = Exception("API Error")
 
     source_code = "def func(): pass"
@@ -81,3 +99,219 @@ async def test_update_test_with_llm_no_api_key() -> None:
             await update_test_with_llm(
                 source_code, test_code, file_name, coverage_lines, other_tests_content, "pytest_function"
             )
+
+
+@patch("openai.AsyncOpenAI")
+async def test_update_test_with_llm_shared_client(mock_async_openai: MagicMock) -> None:
+    """
+    Tests that update_test_with_llm reuses a shared client instead of creating a new one.
+    """
+    shared_client = MagicMock()
+    shared_client.chat.completions.create = AsyncMock(
+        return_value=MagicMock(choices=[MagicMock(message=MagicMock(content="shared content"))])
+    )
+
+    for _ in range(3):
+        updated_content = await update_test_with_llm(
+            "def func(): pass", "import pytest", "test_file.py", [1], "", "pytest_function", shared_client
+        )
+        assert updated_content == "shared content"
+
+    mock_async_openai.assert_not_called()
+    assert shared_client.chat.completions.create.await_count == 3
+
+
+@patch("httpx.AsyncClient")
+@patch("openai.AsyncOpenAI")
+async def test_open_client_pool_settings_and_close(mock_async_openai: MagicMock, mock_http_client: MagicMock) -> None:
+    """
+    Tests that open_client configures the connection pool and closes the client on exit.
+    """
+    mock_async_openai.return_value.close = AsyncMock()
+
+    async with open_client(max_connections=7, keepalive_expiry=12.5) as client:
+        assert client is mock_async_openai.return_value
+
+    limits = mock_http_client.call_args.kwargs["limits"]
+    assert limits.max_connections == 7
+    assert limits.max_keepalive_connections == 7
+    assert limits.keepalive_expiry == 12.5
+    mock_async_openai.assert_called_once_with(
+        api_key="test_key", base_url=None, http_client=mock_http_client.return_value, max_retries=2
+    )
+    mock_async_openai.return_value.close.assert_awaited_once()
+
+
+@patch("openai.AsyncOpenAI")
+async def test_update_test_with_llm_cache_hit(mock_async_openai: MagicMock, tmp_path: Path) -> None:
+    """
+    Tests that an identical request is answered from the cache without calling the API again.
+    """
+    shared_client = MagicMock()
+    shared_client.chat.completions.create = AsyncMock(
+        return_value=MagicMock(choices=[MagicMock(message=MagicMock(content="cached content"))])
+    )
+    cache = ResponseCache(tmp_path)
+    args = ("def func(): pass", "import pytest", "test_file.py", [1], "", "pytest_function")
+
+    first = await update_test_with_llm(*args, shared_client, cache)
+    second = await update_test_with_llm(*args, shared_client, cache)
+    cache.close()
+
+    assert first == second == "cached content"
+    shared_client.chat.completions.create.assert_awaited_once()
+    mock_async_openai.assert_not_called()
+
+
+async def test_update_test_with_llm_chunk_context() -> None:
+    """
+    Tests that the enclosing context of a nested chunk is sent only when present.
+    """
+    shared_client = MagicMock()
+    shared_client.chat.completions.create = AsyncMock(
+        return_value=MagicMock(choices=[MagicMock(message=MagicMock(content="content"))])
+    )
+    args = ("def method(self): pass", "", "module.py", [1], "", "pytest_function", shared_client)
+
+    await update_test_with_llm(*args, chunk_context="class Service:")
+    await update_test_with_llm(*args)
+
+    with_context, without_context = (
+        call.kwargs["messages"][1]["content"] for call in shared_client.chat.completions.create.await_args_list
+    )
+    assert "<enclosing_context>\nclass Service:\n</enclosing_context>" in with_context
+    assert "<enclosing_context>" not in without_context
+
+
+async def test_update_test_with_llm_deduplicates_test_file() -> None:
+    """
+    Tests that a test file passed both as existing tests and as style reference is sent only once.
+    """
+    shared_client = MagicMock()
+    shared_client.chat.completions.create = AsyncMock(
+        return_value=MagicMock(choices=[MagicMock(message=MagicMock(content="content"))])
+    )
+    test_file = "import pytest\n\n\ndef test_existing():\n    assert True\n"
+
+    await update_test_with_llm(
+        "def func(): pass", test_file, "module.py", [1], test_file, "pytest_function", shared_client
+    )
+
+    user_msg = shared_client.chat.completions.create.await_args.kwargs["messages"][1]["content"]
+    assert user_msg.count("def test_existing()") == 1
+    assert "<existing_tests>" in user_msg
+    assert "<style_reference_tests>" not in user_msg
+
+
+def test_parse_batch_response() -> None:
+    """
+    Tests that batched responses are split per chunk, ignoring fences, unknown chunks and malformed JSON.
+    """
+    content = '```json\n{"func_a": "def test_a():\\n    pass\\n", "other": "def test_x(): pass", "func_b": ""}\n```'
+    assert parse_batch_response(content, ["func_a", "func_b"]) == {"func_a": "def test_a():\n    pass\n"}
+    assert parse_batch_response('{"tests": {"func_a": "code"}}', ["func_a"]) == {"func_a": "code"}
+    assert parse_batch_response("def test_a(): pass", ["func_a"]) == {}
+    assert parse_batch_response("[1, 2]", ["func_a"]) == {}
+
+
+async def test_update_tests_batch_with_llm_sends_one_request() -> None:
+    """
+    Tests that a batch of chunks is sent in one JSON-mode request with the shared context included once.
+    """
+    shared_client = MagicMock()
+    response = '{"Service.start": "def test_start(): pass", "Service.stop": "def test_stop(): pass"}'
+    shared_client.chat.completions.create = AsyncMock(
+        return_value=MagicMock(choices=[MagicMock(message=MagicMock(content=response))])
+    )
+    context = "class Service:\n    def __init__(self):\n        self.running = False"
+    chunks = [
+        (Chunk("Service.start", "method", "def start(self): ...", 4, 5, context), [5]),
+        (Chunk("Service.stop", "method", "def stop(self): ...", 7, 8, context), [8]),
+    ]
+
+    tests = await update_tests_batch_with_llm(
+        chunks, "def test_existing(): pass", "module.py", "", "pytest_function", shared_client
+    )
+
+    assert tests == {"Service.start": "def test_start(): pass", "Service.stop": "def test_stop(): pass"}
+    shared_client.chat.completions.create.assert_awaited_once()
+    kwargs = shared_client.chat.completions.create.await_args.kwargs
+    assert kwargs["response_format"] == {"type": "json_object"}
+    user_msg = kwargs["messages"][1]["content"]
+    assert user_msg.count("class Service:") == 1
+    assert "name: Service.start" in user_msg and "name: Service.stop" in user_msg
+
+
+def _stream_of(*deltas: str) -> MagicMock:
+    stream = MagicMock()
+    events = [MagicMock(choices=[MagicMock(delta=MagicMock(content=d))], usage=None) for d in deltas]
+    # With stream_options include_usage, the last event has the usage and no choices
+    events.append(MagicMock(choices=[], usage=CompletionUsage(prompt_tokens=10, completion_tokens=5, total_tokens=15)))
+    stream.__aiter__.return_value = events
+    stream.close = AsyncMock()
+    return stream
+
+
+async def test_update_test_with_llm_streaming_records_timing() -> None:
+    """
+    Tests that a streamed response is assembled from its deltas and its latency is recorded.
+    """
+    shared_client = MagicMock()
+    stream = _stream_of("def test_a():\n", "", "    pass\n")
+    shared_client.chat.completions.create = AsyncMock(return_value=stream)
+    timing = GenerationTiming()
+
+    result = await update_test_with_llm(
+        "def a(): pass", "", "module.py", [1], "", "pytest_function", shared_client, stream=True, timing=timing
+    )
+
+    assert result == "def test_a():\n    pass\n"
+    assert shared_client.chat.completions.create.await_args.kwargs["stream"] is True
+    assert timing.time_to_first_token is not None and timing.total_time is not None
+    assert timing.time_to_first_token <= timing.total_time
+    assert timing.usage == TokenUsage(prompt_tokens=10, completion_tokens=5, cached_tokens=0)
+    assert shared_client.chat.completions.create.await_args.kwargs["stream_options"] == {"include_usage": True}
+    stream.close.assert_awaited_once()
+
+
+async def test_update_test_with_llm_streaming_cancels_malformed_response() -> None:
+    """
+    Tests that a malformed streamed response is cancelled early and not cached.
+    """
+    shared_client = MagicMock()
+    stream = _stream_of("Sure! Here is the test:\n", "def test_a():\n", "    pass\n")
+    shared_client.chat.completions.create = AsyncMock(return_value=stream)
+    cache = MagicMock()
+    cache.get.return_value = None
+
+    with pytest.raises(MalformedResponseError):
+        await update_test_with_llm(
+            "def a(): pass", "", "module.py", [1], "", "pytest_function", shared_client, cache, stream=True
+        )
+
+    stream.close.assert_awaited_once()
+    cache.set.assert_not_called()
+
+
+@patch("ai_unit_test.scheduler.asyncio.sleep", new_callable=AsyncMock)
+async def test_update_test_with_llm_retries_through_scheduler(mock_sleep: AsyncMock) -> None:
+    """
+    Tests that a throttled request is retried by the scheduler instead of failing the chunk.
+    """
+    response = httpx.Response(429, headers={"retry-after": "1"}, request=httpx.Request("POST", "https://api.test"))
+    shared_client = MagicMock()
+    shared_client.chat.completions.create = AsyncMock(
+        side_effect=[
+            openai.RateLimitError("Rate limited", response=response, body=None),
+            MagicMock(choices=[MagicMock(message=MagicMock(content="def test_a(): pass"))]),
+        ]
+    )
+    scheduler = RateLimitScheduler(max_concurrency=2)
+
+    result = await update_test_with_llm(
+        "def a(): pass", "", "module.py", [1], "", "pytest_function", shared_client, scheduler=scheduler
+    )
+
+    assert result == "def test_a(): pass"
+    assert shared_client.chat.completions.create.await_count == 2
+    mock_sleep.assert_awaited_once()
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+from ai_unit_test.file_helper import Chunk
+from ai_unit_test.manifest import Manifest
+
+
+def _chunk(source_code: str = "def func():\n    return 1", start_line: int = 1) -> Chunk:
+    return Chunk(name="func", type="function", source_code=source_code, start_line=start_line, end_line=start_line + 1)
+
+
+def test_manifest_unchanged_after_success(tmp_path: Path) -> None:
+    """
+    Tests that a successfully handled chunk is reported unchanged after a save/load roundtrip.
+    """
+    manifest_path = tmp_path / "manifest.json"
+    manifest = Manifest(manifest_path)
+    assert not manifest.is_unchanged(Path("src/a.py"), _chunk(), [2])
+    manifest.record(Path("src/a.py"), _chunk(), [2], "success")
+    manifest.save()
+
+    reloaded = Manifest(manifest_path)
+    assert reloaded.is_unchanged(Path("src/a.py"), _chunk(), [2])
+
+
+def test_manifest_detects_changes(tmp_path: Path) -> None:
+    """
+    Tests that source changes, uncovered-line changes and failed attempts are not considered unchanged.
+    """
+    manifest = Manifest(tmp_path / "manifest.json")
+    manifest.record(Path("src/a.py"), _chunk(), [2], "success")
+
+    assert not manifest.is_unchanged(Path("src/a.py"), _chunk("def func():\n    return 2"), [2])
+    assert not manifest.is_unchanged(Path("src/a.py"), _chunk(), [1, 2])
+    assert not manifest.is_unchanged(Path("src/b.py"), _chunk(), [2])
+
+    manifest.record(Path("src/a.py"), _chunk(), [2], "error")
+    assert not manifest.is_unchanged(Path("src/a.py"), _chunk(), [2])
+
+
+def test_manifest_ignores_moved_chunk(tmp_path: Path) -> None:
+    """
+    Tests that a chunk that only moved inside its file is still considered unchanged.
+    """
+    manifest = Manifest(tmp_path / "manifest.json")
+    manifest.record(Path("src/a.py"), _chunk(start_line=1), [2], "success")
+    assert manifest.is_unchanged(Path("src/a.py"), _chunk(start_line=11), [12])
+
+
+def test_manifest_invalid_file(tmp_path: Path) -> None:
+    """
+    Tests that an unreadable manifest is ignored.
+    """
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text("not json")
+    assert Manifest(manifest_path).entries == {}
@@ -0,0 +1,66 @@
+import subprocess
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from ai_unit_test.file_helper import read_file_content
+from ai_unit_test.overlay import EditOverlay
+
+
+def test_overlay_reads_once_and_flushes_once(tmp_path: Path) -> None:
+    """
+    Tests that many inserts into a file read it once and write it once, with every test in it.
+    """
+    test_file = tmp_path / "test_main.py"
+    test_file.write_text('def test_existing():\n    pass\n\n\nif __name__ == "__main__":\n    test_existing()\n')
+    overlay = EditOverlay()
+
+    with (
+        patch("ai_unit_test.overlay.read_file_content", wraps=read_file_content) as mock_read,
+        patch("ai_unit_test.overlay.write_file_atomic") as mock_write,
+    ):
+        for i in range(5):
+            overlay.insert_test(test_file, f"def test_{i}():\n    pass\n")
+        assert overlay.changed_files == [test_file]
+        assert overlay.flush() == [test_file]
+
+    mock_read.assert_called_once_with(test_file)
+    mock_write.assert_called_once()
+    content = mock_write.call_args[0][1]
+    assert all(f"def test_{i}()" in content for i in range(5))
+    assert content.index("def test_4()") < content.index('if __name__ == "__main__":')
+    assert "def test_0()" not in test_file.read_text()
+
+
+def test_overlay_flush_skips_unchanged_files(tmp_path: Path) -> None:
+    """
+    Tests that files only read through the overlay are not rewritten.
+    """
+    test_file = tmp_path / "test_main.py"
+    test_file.write_text("def test_existing():\n    pass\n")
+    overlay = EditOverlay()
+
+    overlay.read(test_file)
+
+    assert overlay.flush() == []
+    assert overlay.diff() == ""
+
+
+def test_overlay_diff_applies_with_git(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Tests that the patch of the pending edits applies cleanly, even to a file without a final newline.
+    """
+    monkeypatch.chdir(tmp_path)
+    test_file = Path("tests/test_main.py")
+    test_file.parent.mkdir()
+    test_file.write_text("def test_existing():\n    pass")
+    overlay = EditOverlay()
+    overlay.insert_test(test_file, "def test_new():\n    pass\n")
+
+    overlay.write_patch(Path("out.diff"))
+
+    assert Path("out.diff").read_text().startswith("--- a/tests/test_main.py\n+++ b/tests/test_main.py\n")
+    assert test_file.read_text() == "def test_existing():\n    pass"
+    subprocess.run(["git", "apply", "out.diff"], check=True)
+    assert test_file.read_text() == "def test_existing():\n    pass\ndef test_new():\n    pass\n"
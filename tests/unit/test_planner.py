@@ -0,0 +1,180 @@
+import asyncio
+import json
+from pathlib import Path
+
+from fakes import EXISTING_TEST, FakeBackend, FakeProject
+
+from ai_unit_test.cache import ResponseCache
+from ai_unit_test.cli import _main, _process_missing_info
+from ai_unit_test.file_helper import Chunk
+from ai_unit_test.llm import MODEL, TEMPERATURE, GenerationTiming, build_chunk_prompt
+from ai_unit_test.planner import (
+    Budget,
+    PlannedRequest,
+    RequestEstimate,
+    RunPlan,
+    estimate_prompt_tokens,
+    estimate_wall_time,
+    prioritize,
+)
+from ai_unit_test.usage import ModelPrice, TokenUsage
+
+
+def _chunk(name: str, size: int, start_line: int = 1) -> Chunk:
+    return Chunk(name=name, type="function", source_code="x" * size, start_line=start_line, end_line=start_line + 10)
+
+
+def _request(name: str, lines: int, prompt_tokens: int, order: int) -> PlannedRequest:
+    chunks = [(_chunk(name, 10), list(range(lines)))]
+    return PlannedRequest(
+        Path("src/a.py"), Path("tests/test_a.py"), chunks, "pytest_function", "", prompt_tokens, order
+    )
+
+
+def test_estimate_prompt_tokens_trims_context_only() -> None:
+    """
+    Tests that the test file context counts until the prompt budget is reached, and the chunks always count.
+    """
+    chunks = [(_chunk("f", 400), [1, 2])]
+    chunk_tokens = estimate_prompt_tokens(chunks, 0, None)
+
+    assert estimate_prompt_tokens(chunks, 1000, None) == chunk_tokens + 1000
+    assert estimate_prompt_tokens(chunks, 1000, 500) == 500
+    assert estimate_prompt_tokens(chunks, 1000, 10) == chunk_tokens
+
+
+def test_prioritize_by_uncovered_lines_per_token() -> None:
+    """
+    Tests that requests are ordered by uncovered lines per prompt token, ties kept in coverage order.
+    """
+    requests = [_request("a", 1, 100, 0), _request("b", 10, 100, 1), _request("c", 2, 200, 2)]
+
+    assert [request.chunks[0][0].name for request in prioritize(requests)] == ["b", "a", "c"]
+
+
+def test_budget_limits() -> None:
+    """
+    Tests that the request and time limits stop the admissions, while the token limit only leaves out the
+    requests it cannot afford, counting actual usage once known and nothing for cached responses.
+    """
+    budget = Budget(max_requests=2)
+    assert budget.admit(10) and budget.admit(10)
+    assert not budget.admit(10)
+    budget.settle(10, None, cached=True)
+    assert not budget.admit(10), "stopped for good once exhausted"
+
+    now = [0.0]
+    budget = Budget(time_budget=5, clock=lambda: now[0])
+    assert budget.admit(10)
+    now[0] = 5.0
+    assert not budget.admit(10)
+    assert budget.exhausted == "time budget of 5s elapsed"
+
+    budget = Budget(max_tokens=100)
+    assert budget.admit(60)
+    assert not budget.admit(50)
+    assert budget.admit(40)
+    budget.settle(60, TokenUsage(prompt_tokens=20, completion_tokens=10))
+    assert budget.spent_tokens == 30
+    assert budget.admit(30)
+    assert budget.left_out == 1
+
+
+def test_process_missing_info_sends_best_requests_within_budget(
+    fake_project: FakeProject, fake_backend: FakeBackend
+) -> None:
+    """
+    Tests that a run limited to one request sends the one covering the most lines per token, and stops.
+    """
+    # The large chunk comes first in coverage order but has a single uncovered line
+    fake_project.get_source_code_chunks.return_value = [_chunk("large", 4000, 1), _chunk("small", 40, 20)]
+    timings: dict[tuple[Path, str], GenerationTiming] = {}
+    budget = Budget(max_requests=1)
+
+    asyncio.run(
+        _process_missing_info(
+            {Path("src/main.py"): [2, 21, 22, 23]},
+            "tests",
+            fake_backend,
+            concurrency=1,
+            timings=timings,
+            budget=budget,
+        )
+    )
+
+    assert fake_backend.calls == 1
+    assert list(timings) == [(Path("src/main.py"), "small")]
+    assert budget.left_out == 1
+    assert "def test_main()" in fake_project.test_file.read_text()
+
+
+def test_estimate_wall_time() -> None:
+    """
+    Tests that requests fill the free concurrency slots as they finish, and that the rate limits bound the time.
+    """
+    assert estimate_wall_time([], 4) == 0
+    assert estimate_wall_time([4, 1, 1, 1, 1], 2) == 4
+    assert estimate_wall_time([1, 1, 1, 1], 2) == 2
+    assert estimate_wall_time([1, 1, 1, 1], 4, requests_per_minute=2) == 120
+    assert estimate_wall_time([1], 1, tokens_per_minute=1000, total_tokens=500) == 30
+
+
+def test_run_plan_totals_and_cost(tmp_path: Path) -> None:
+    """
+    Tests that the plan sums requests and tokens per file and for the run, and that cached responses are counted
+    apart and cost nothing.
+    """
+    estimates = [
+        RequestEstimate("src/a.py", 1, 3, 1000, 500, 2.0),
+        RequestEstimate("src/a.py", 1, 1, 1000, 500, 0.0, cached=True),
+        RequestEstimate("src/b.py", 2, 5, 3000, 1000, 4.0),
+    ]
+    plan = RunPlan("model", estimates, 2, {"model": ModelPrice(input=1.0, output=2.0)})
+
+    data = plan.to_dict()
+
+    assert data["run"]["requests"] == 3
+    assert data["run"]["cached_requests"] == 1
+    assert data["run"]["prompt_tokens"] == 4000
+    assert data["run"]["completion_tokens"] == 1500
+    assert data["run"]["wall_time_s"] == 4.0
+    assert data["run"]["cost_usd"] == 0.007
+    assert [entry["source_file"] for entry in data["files"]] == ["src/b.py", "src/a.py"]
+    assert data["files"][1]["cost_usd"] == 0.002
+    assert RunPlan("unknown", estimates, 2, {}).to_dict()["run"]["cost_usd"] is None
+    plan.write(tmp_path / "plan.json")
+    assert json.loads((tmp_path / "plan.json").read_text()) == data
+
+
+def test_main_plan_sends_nothing(fake_project: FakeProject, fake_backend: FakeBackend) -> None:
+    """
+    Tests that a planned run builds the prompts and reports them without calling the LLM or editing the tests,
+    and that a response already in the cache is counted as cached.
+    """
+    fake_project.collect_missing_lines.return_value = {Path("src/main.py"): [2, 21]}
+    chunks = [_chunk("first", 40, 1), _chunk("second", 40, 20)]
+    fake_project.get_source_code_chunks.return_value = chunks
+    system_msg, prompt = build_chunk_prompt(
+        chunks[1].source_code, EXISTING_TEST, "src/main.py", [21], EXISTING_TEST, "pytest_function"
+    )
+    cache = ResponseCache(Path("cache"))
+    cache.set(cache.make_key(MODEL, system_msg, prompt.text, TEMPERATURE), "def test_second():\n    pass\n")
+    cache.close()
+
+    asyncio.run(
+        _main(
+            folders=["src"],
+            tests_folder="tests",
+            cache_dir="cache",
+            backend=fake_backend,
+            plan=True,
+            report_file="plan.json",
+        )
+    )
+    plan = json.loads(Path("plan.json").read_text())
+
+    assert fake_backend.calls == 0
+    assert fake_project.test_file.read_text() == EXISTING_TEST
+    assert plan["run"]["requests"] == 2
+    assert plan["run"]["cached_requests"] == 1
+    assert plan["run"]["cost_usd"] > 0
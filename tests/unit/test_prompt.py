@@ -0,0 +1,98 @@
+from ai_unit_test.prompt import (
+    TRUNCATION_MARKER,
+    PromptSection,
+    build_prompt,
+    deduplicate_sections,
+    estimate_tokens,
+    pack_batches,
+)
+
+
+def test_estimate_tokens() -> None:
+    """
+    Tests the character-based token approximation.
+    """
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+
+
+def test_deduplicate_sections_drops_repeated_context() -> None:
+    """
+    Tests that a less valuable section repeating a more valuable one is dropped, keeping the original order.
+    """
+    test_file = "import pytest\n\n\ndef test_a():\n    assert True\n"
+    sections = [
+        PromptSection("source_code_chunk", "def a(): pass", priority=90, trimmable=False),
+        PromptSection("existing_tests", test_file, priority=30),
+        PromptSection("style_reference_tests", test_file, priority=10),
+        PromptSection("enclosing_context", "", priority=50),
+    ]
+
+    kept, dropped = deduplicate_sections(sections)
+
+    assert [section.name for section in kept] == ["source_code_chunk", "existing_tests"]
+    assert sorted(dropped) == ["enclosing_context", "style_reference_tests"]
+
+
+def test_build_prompt_renders_sections() -> None:
+    """
+    Tests that the prompt is rendered as tagged sections under the header.
+    """
+    prompt = build_prompt(
+        "Header:",
+        [
+            PromptSection("file_to_be_tested", "module.py", priority=100, trimmable=False),
+            PromptSection("existing_tests", "def test_a(): pass", priority=30),
+        ],
+    )
+
+    assert prompt.text == (
+        "Header:\n\n<file_to_be_tested>\nmodule.py\n</file_to_be_tested>\n\n"
+        "<existing_tests>\ndef test_a(): pass\n</existing_tests>\n"
+    )
+    assert set(prompt.section_tokens) == {"file_to_be_tested", "existing_tests"}
+
+
+def test_build_prompt_trims_lowest_priority_first() -> None:
+    """
+    Tests that the budget is enforced by trimming the least valuable context first and keeping its head.
+    """
+    existing_tests = "\n".join(f"def test_{i}():\n    assert {i}" for i in range(200))
+    style_tests = "\n".join(f"def test_style_{i}():\n    assert {i}" for i in range(200))
+    source = "def func():\n    return 1"
+
+    prompt = build_prompt(
+        "Header:",
+        [
+            PromptSection("source_code_chunk", source, priority=90, trimmable=False),
+            PromptSection("existing_tests", existing_tests, priority=30),
+            PromptSection("style_reference_tests", style_tests, priority=10),
+        ],
+        max_tokens=1000,
+        reserved_tokens=100,
+    )
+
+    assert prompt.total_tokens + 100 <= 1000
+    assert source in prompt.text
+    assert "style_reference_tests" in prompt.dropped
+    assert prompt.trimmed == ["existing_tests"]
+    assert "def test_0():" in prompt.text
+    assert TRUNCATION_MARKER in prompt.text
+
+
+def test_build_prompt_never_trims_required_sections() -> None:
+    """
+    Tests that required sections are kept even when they alone exceed the budget.
+    """
+    source = "x = 1\n" * 1000
+    prompt = build_prompt("Header:", [PromptSection("source_code_chunk", source, priority=90, trimmable=False)], 10)
+    assert source in prompt.text
+
+
+def test_pack_batches_caps_total_cost() -> None:
+    """
+    Tests that consecutive items are grouped within the budget and an oversized item gets its own batch.
+    """
+    assert pack_batches([3, 4, 2, 10, 1], lambda item: item, 7) == [[3, 4], [2], [10], [1]]
+    assert pack_batches([], lambda item: item, 7) == []
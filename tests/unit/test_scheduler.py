@@ -0,0 +1,127 @@
+import asyncio
+from email.utils import formatdate
+from time import time
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import openai
+import pytest
+
+from ai_unit_test.scheduler import RateLimitScheduler, TokenBucket, is_retryable, retry_after
+
+
+def _status_error(status: int, headers: dict[str, str] | None = None) -> openai.APIStatusError:
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "https://api.test/v1"))
+    if status == 429:
+        return openai.RateLimitError("Rate limited", response=response, body=None)
+    return openai.InternalServerError("Server error", response=response, body=None)
+
+
+def test_token_bucket_refills_over_time() -> None:
+    """
+    Tests that the bucket starts full and refills at its rate.
+    """
+    now = 0.0
+    bucket = TokenBucket(rate=10.0, capacity=20.0, clock=lambda: now)
+
+    assert bucket.delay_for(20) == 0
+    asyncio.run(bucket.acquire(20))
+    assert bucket.delay_for(5) == pytest.approx(0.5)
+    now = 1.0
+    assert bucket.delay_for(10) == 0
+    assert bucket.delay_for(100) == pytest.approx(1.0)
+
+
+def test_retry_after_headers() -> None:
+    """
+    Tests that retry-after-ms, retry-after seconds and HTTP dates are understood.
+    """
+    assert retry_after(_status_error(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(_status_error(429, {"retry-after": "3"})) == 3.0
+    assert retry_after(_status_error(503, {"retry-after": formatdate(time() + 30)})) == pytest.approx(30, abs=2)
+    assert retry_after(_status_error(429, {"retry-after": "soon"})) is None
+    assert retry_after(ValueError("not an API error")) is None
+
+
+def test_is_retryable() -> None:
+    """
+    Tests that only throttling, server and connection errors are retried.
+    """
+    assert is_retryable(_status_error(429))
+    assert is_retryable(_status_error(502))
+    assert is_retryable(openai.APIConnectionError(request=httpx.Request("POST", "https://api.test/v1")))
+    response = httpx.Response(400, request=httpx.Request("POST", "https://api.test/v1"))
+    assert not is_retryable(openai.BadRequestError("Bad request", response=response, body=None))
+    assert not is_retryable(ValueError("bug"))
+
+
+@patch("ai_unit_test.scheduler.asyncio.sleep", new_callable=AsyncMock)
+def test_scheduler_retries_throttled_request_and_adapts_concurrency(mock_sleep: AsyncMock) -> None:
+    """
+    Tests that a 429 is retried after its retry-after delay, halves the concurrency, and that it grows back.
+    """
+    scheduler = RateLimitScheduler(max_concurrency=4, base_delay=0.5)
+    request = AsyncMock(side_effect=[_status_error(429, {"retry-after": "2"}), "response"])
+
+    assert asyncio.run(scheduler.run(request)) == "response"
+
+    assert request.await_count == 2
+    assert 2.0 <= mock_sleep.call_args.args[0] <= 2.5
+    assert scheduler.limit == 2
+    assert (scheduler.retries, scheduler.throttled) == (1, 1)
+
+    asyncio.run(scheduler.run(AsyncMock(return_value="ok")))
+    asyncio.run(scheduler.run(AsyncMock(return_value="ok")))
+    assert scheduler.limit == 3
+
+
+@patch("ai_unit_test.scheduler.asyncio.sleep", new_callable=AsyncMock)
+def test_scheduler_gives_up_after_max_retries(mock_sleep: AsyncMock) -> None:
+    """
+    Tests that server errors are retried with bounded backoff up to max_retries, then raised.
+    """
+    scheduler = RateLimitScheduler(max_concurrency=2, max_retries=3, base_delay=1.0, max_delay=3.0)
+    request = AsyncMock(side_effect=_status_error(500))
+
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(scheduler.run(request))
+
+    assert request.await_count == 4
+    assert all(0 <= call.args[0] <= 3.0 for call in mock_sleep.await_args_list)
+    assert scheduler.limit == 2
+
+
+def test_scheduler_does_not_retry_other_errors() -> None:
+    """
+    Tests that errors that are not transient are raised at once.
+    """
+    scheduler = RateLimitScheduler(max_concurrency=2)
+    request = AsyncMock(side_effect=ValueError("bug"))
+
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.run(request))
+
+    request.assert_awaited_once()
+
+
+def test_scheduler_limits_requests_in_flight() -> None:
+    """
+    Tests that no more requests than the concurrency limit run at once.
+    """
+    scheduler = RateLimitScheduler(max_concurrency=2)
+    in_flight = 0
+    max_in_flight = 0
+
+    async def request() -> None:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    async def run_all() -> None:
+        await asyncio.gather(*(scheduler.run(request) for _ in range(6)))
+
+    asyncio.run(run_all())
+
+    assert max_in_flight == 2
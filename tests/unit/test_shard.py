@@ -0,0 +1,133 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from fakes import FakeBackend, FakeProject
+from typer.testing import CliRunner
+
+from ai_unit_test.cli import _main, app
+from ai_unit_test.overlay import EditOverlay
+from ai_unit_test.shard import BundleError, Shard, assign_shards, merge_bundles, parse_shard
+
+
+def test_parse_shard() -> None:
+    """
+    Tests that shards are parsed from i/n and that out of range or malformed shards are rejected.
+    """
+    assert parse_shard("2/4") == Shard(2, 4)
+    assert str(parse_shard(" 1/1 ")) == "1/1"
+    for spec in ("0/4", "5/4", "1-4", "a/b"):
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+
+def test_assign_shards_groups_by_test_file_and_balances() -> None:
+    """
+    Tests that source files sharing a test file land in the same shard, that every file lands in exactly one
+    shard and that the uncovered lines are spread evenly.
+    """
+    missing_info = {Path(f"src/mod_{i}.py"): list(range(i + 1)) for i in range(8)}
+    test_files = {source: Path(f"tests/test_{source.stem}.py") for source in missing_info}
+    test_files[Path("src/mod_1.py")] = test_files[Path("src/mod_0.py")]
+
+    shards = assign_shards(missing_info, test_files.get, 3)
+
+    assert shards == assign_shards(dict(reversed(missing_info.items())), test_files.get, 3)
+    assert sorted(path for shard in shards for path in shard) == sorted(missing_info)
+    assert any(Path("src/mod_0.py") in shard and Path("src/mod_1.py") in shard for shard in shards)
+    loads = [sum(len(lines) for lines in shard.values()) for shard in shards]
+    # Greedy spreading: shards differ by at most the smallest group
+    assert max(loads) - min(loads) <= 3
+
+
+def _bundle(tmp_path: Path, name: str, test_file: Path, new_test: str) -> Path:
+    overlay = EditOverlay()
+    overlay.insert_test(test_file, new_test)
+    bundle_path = tmp_path / name
+    overlay.write_bundle(bundle_path, shard=name)
+    return bundle_path
+
+
+def test_merge_bundles(tmp_path: Path) -> None:
+    """
+    Tests that bundles editing distinct files are merged, and that bundles editing the same file, or a file
+    changed since, are refused.
+    """
+    test_a = tmp_path / "test_a.py"
+    test_b = tmp_path / "test_b.py"
+    test_a.write_text("def test_a():\n    pass\n")
+    test_b.write_text("def test_b():\n    pass\n")
+    bundle_a = _bundle(tmp_path, "a.json", test_a, "def test_new_a():\n    pass\n")
+    bundle_b = _bundle(tmp_path, "b.json", test_b, "def test_new_b():\n    pass\n")
+    assert test_a.read_text() == "def test_a():\n    pass\n"
+
+    merge_bundles([bundle_a, bundle_b]).flush()
+
+    assert "def test_new_a()" in test_a.read_text()
+    assert "def test_new_b()" in test_b.read_text()
+    with pytest.raises(BundleError, match="changed since"):
+        merge_bundles([bundle_a])
+    bundle_c = _bundle(tmp_path, "c.json", test_b, "def test_other():\n    pass\n")
+    with pytest.raises(BundleError, match="edited by both"):
+        merge_bundles([bundle_c, bundle_c])
+
+
+def test_sharded_runs_merge_into_test_files(fake_project: FakeProject, fake_backend: FakeBackend) -> None:
+    """
+    Tests that two shards each write a bundle for their own test file, and that merging the bundles updates
+    both test files.
+    """
+    for name in ("a", "b"):
+        Path(f"tests/test_{name}.py").write_text(f"def test_{name}():\n    pass\n")
+    fake_project.collect_missing_lines.return_value = {Path("src/a.py"): [1], Path("src/b.py"): [1, 2]}
+    fake_project.find_test_file.side_effect = lambda source, tests_folder, index: Path(
+        f"tests/test_{Path(source).stem}.py"
+    )
+
+    for index in (1, 2):
+        asyncio.run(
+            _main(
+                folders=["src"],
+                tests_folder="tests",
+                use_cache=False,
+                backend=fake_backend,
+                shard=f"{index}/2",
+                bundle_file=f"shard-{index}.json",
+            )
+        )
+    bundles = [json.loads(Path(f"shard-{index}.json").read_text()) for index in (1, 2)]
+    result = CliRunner().invoke(app, ["merge", "shard-1.json", "shard-2.json"])
+
+    assert fake_backend.calls == 2
+    assert [list(bundle["files"]) for bundle in bundles] == [["tests/test_b.py"], ["tests/test_a.py"]]
+    assert result.exit_code == 0
+    assert "def test_main()" in Path("tests/test_a.py").read_text()
+    assert "def test_main()" in Path("tests/test_b.py").read_text()
+
+
+def test_shard_with_nothing_to_do_still_writes_its_bundle(fake_project: FakeProject, fake_backend: FakeBackend) -> None:
+    """
+    Tests that a shard without files to cover, or a run without missing coverage, writes an empty bundle, so
+    that merging the bundles of every shard succeeds.
+    """
+    for index in (1, 2):
+        asyncio.run(
+            _main(
+                folders=["src"],
+                tests_folder="tests",
+                use_cache=False,
+                backend=fake_backend,
+                shard=f"{index}/2",
+                bundle_file=f"shard-{index}.json",
+            )
+        )
+    fake_project.collect_missing_lines.return_value = {}
+    asyncio.run(_main(folders=["src"], tests_folder="tests", use_cache=False, shard="1/1", bundle_file="covered.json"))
+    result = CliRunner().invoke(app, ["merge", "shard-1.json", "shard-2.json", "covered.json"])
+
+    assert fake_backend.calls == 1
+    assert json.loads(Path("shard-2.json").read_text())["files"] == {}
+    assert json.loads(Path("covered.json").read_text()) == {"version": 1, "shard": "1/1", "files": {}}
+    assert result.exit_code == 0
+    assert "def test_main()" in fake_project.test_file.read_text()
@@ -0,0 +1,92 @@
+import pytest
+
+from ai_unit_test.streaming import IncrementalTestParser, MalformedResponseError
+
+
+def _feed_in_pieces(parser: IncrementalTestParser, text: str, size: int = 7) -> None:
+    for start in range(0, len(text), size):
+        parser.feed(text[start : start + size])  # noqa: E203
+
+
+def test_incremental_parser_checks_complete_blocks() -> None:
+    """
+    Tests that streamed tests are validated once complete, decorators staying with their function.
+    """
+    response = (
+        "```python\nimport pytest\n\n\n@pytest.mark.parametrize('value', [1, 2])\ndef test_one(value):\n"
+        "    assert value\n\n\nasync def test_two():\n    assert (\n        True\n)\n```\n"
+    )
+    parser = IncrementalTestParser()
+
+    _feed_in_pieces(parser, response)
+    assert parser.tests == ["test_one"]
+    parser.close()
+
+    assert parser.tests == ["test_one", "test_two"]
+    assert parser.text == response
+
+
+def test_incremental_parser_keeps_multi_line_decorators_with_their_function() -> None:
+    """
+    Tests that a decorator spanning several lines is not split from the function it decorates.
+    """
+    response = (
+        'import pytest\n\n\n@pytest.mark.parametrize(\n"a, b",\n[(1, 2), (3, 4)],\n)\n'
+        "def test_add(a, b):\n    assert a < b\n\n\ndef test_other():\n    pass\n"
+    )
+    parser = IncrementalTestParser()
+
+    _feed_in_pieces(parser, response)
+    parser.close()
+
+    assert parser.tests == ["test_add", "test_other"]
+
+
+def test_incremental_parser_keeps_multi_line_statements_together() -> None:
+    """
+    Tests that continuation lines looking like the start of a block stay in their unfinished statement.
+    """
+    response = (
+        'HELP = """\nimport this\n"""\nproduct = (matrix\n@ other)\ntotal = 1 + \\\nclass_count\n\n\n'
+        "def test_a():\n    pass\n"
+    )
+    parser = IncrementalTestParser()
+
+    _feed_in_pieces(parser, response)
+    parser.close()
+
+    assert parser.tests == ["test_a"]
+
+
+def test_incremental_parser_handles_indented_methods() -> None:
+    """
+    Tests that unittest methods indented as inside a class are split into blocks at their own indentation.
+    """
+    parser = IncrementalTestParser()
+
+    _feed_in_pieces(parser, "    def test_a(self):\n        pass\n\n    def test_b(self):\n        pass\n")
+    parser.close()
+
+    assert parser.tests == ["test_a", "test_b"]
+
+
+def test_incremental_parser_rejects_malformed_block_early() -> None:
+    """
+    Tests that prose before the code is detected as soon as the first definition starts.
+    """
+    parser = IncrementalTestParser()
+
+    with pytest.raises(MalformedResponseError):
+        _feed_in_pieces(parser, "Here is the test you asked for:\ndef test_a():\n")
+
+
+def test_incremental_parser_tolerates_invalid_last_block() -> None:
+    """
+    Tests that an invalid last block is only reported, leaving the decision to the caller.
+    """
+    parser = IncrementalTestParser()
+
+    _feed_in_pieces(parser, "def test_a():\n    pass\n\ndef test_b(:\n")
+    parser.close()
+
+    assert parser.tests == ["test_a"]
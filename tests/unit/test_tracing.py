@@ -0,0 +1,90 @@
+import asyncio
+import json
+import logging
+from pathlib import Path
+from typing import Self
+
+import pytest
+
+from ai_unit_test import tracing
+from ai_unit_test.tracing import Tracer, percentile, profiling, span
+
+
+class FakeClock:
+    def __init__(self: Self) -> None:
+        self.now = 100.0
+
+    def __call__(self: Self) -> float:
+        return self.now
+
+
+def test_summary_percentiles_per_stage() -> None:
+    """
+    Tests that the summary gives the count, total and nearest-rank percentiles of each stage.
+    """
+    clock = FakeClock()
+    tracer = Tracer(clock)
+    for duration in range(1, 101):
+        with tracer.span("llm_wait"):
+            clock.now += duration / 1000
+    with tracer.span("coverage"):
+        clock.now += 2.0
+
+    summary = tracer.summary()
+
+    assert list(summary) == ["llm_wait", "coverage"]
+    assert summary["llm_wait"].count == 100
+    assert summary["llm_wait"].total == pytest.approx(5.05)
+    assert summary["llm_wait"].p50 == pytest.approx(0.050)
+    assert summary["llm_wait"].p95 == pytest.approx(0.095)
+    assert summary["llm_wait"].p99 == pytest.approx(0.099)
+    assert summary["coverage"].p99 == pytest.approx(2.0)
+    assert percentile([1.0], 99) == 1.0
+
+
+def test_chrome_trace_puts_concurrent_tasks_on_their_own_track() -> None:
+    """
+    Tests that spans become complete events in microseconds, with one named track per asyncio task.
+    """
+    tracer = Tracer()
+
+    async def request(name: str) -> None:
+        with tracer.span("llm_wait", chunk=name):
+            await asyncio.sleep(0.01)
+
+    async def run() -> None:
+        with tracer.span("coverage"):
+            pass
+        await asyncio.gather(
+            asyncio.create_task(request("a"), name="request-a"), asyncio.create_task(request("b"), name="request-b")
+        )
+
+    asyncio.run(run())
+    events = tracer.chrome_trace()["traceEvents"]
+
+    names = {event["args"]["name"]: event["tid"] for event in events if event["ph"] == "M"}
+    waits = [event for event in events if event["name"] == "llm_wait"]
+    assert {"request-a", "request-b"} <= set(names)
+    assert {event["tid"] for event in waits} == {names["request-a"], names["request-b"]}
+    assert all(event["ph"] == "X" and event["dur"] >= 10_000 for event in waits)
+    assert {event["args"]["chunk"] for event in waits} == {"a", "b"}
+
+
+def test_profiling_writes_trace_and_logs_summary(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    """
+    Tests that spans are only recorded while profiling, and that the trace and the summary are written at the end.
+    """
+    with span("config"):
+        pass
+    assert tracing._tracer is None
+
+    trace_file = tmp_path / "trace.json"
+    with caplog.at_level(logging.INFO, logger="ai_unit_test.tracing"), profiling(trace_file) as tracer:
+        with span("coverage", files=3):
+            pass
+    assert tracer is not None and tracing._tracer is None
+
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    assert [event["name"] for event in events if event["ph"] == "X"] == ["coverage"]
+    assert events[-1]["args"] == {"files": "3"}
+    assert any(record.getMessage().startswith("coverage") for record in caplog.records)
@@ -0,0 +1,58 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from ai_unit_test.usage import DEFAULT_PRICES, ModelPrice, RequestUsage, TokenUsage, UsageReport, load_price_table
+
+
+def test_model_price_cost_bills_cached_prompt_tokens_at_their_price() -> None:
+    """
+    Tests that cached prompt tokens are billed at the cached price, or at the input price when it is unknown.
+    """
+    usage = TokenUsage(prompt_tokens=1_000_000, completion_tokens=500_000, cached_tokens=400_000)
+
+    assert ModelPrice(input=1.0, output=4.0, cached_input=0.25).cost(usage) == pytest.approx(0.6 + 0.1 + 2.0)
+    assert ModelPrice(input=1.0, output=4.0).cost(usage) == pytest.approx(1.0 + 2.0)
+
+
+def test_load_price_table_overrides_defaults(tmp_path: Path) -> None:
+    """
+    Tests that prices read from a file are added to the default ones and take precedence over them.
+    """
+    path = tmp_path / "prices.json"
+    path.write_text(json.dumps({"gpt-4o-mini": {"input": 1.0, "output": 2.0}, "local": {"input": 0, "output": 0}}))
+
+    prices = load_price_table(path)
+
+    assert prices["gpt-4o-mini"] == ModelPrice(1.0, 2.0)
+    assert prices["local"] == ModelPrice(0, 0)
+    assert prices["gpt-4o"] == DEFAULT_PRICES["gpt-4o"]
+
+
+def test_usage_report_shares_batched_requests_and_ranks_files() -> None:
+    """
+    Tests that a batched request is shared by its chunks, files are ranked by tokens and cached responses are free.
+    """
+    report = UsageReport(
+        "model",
+        [
+            RequestUsage("a.py", ["f", "g"], TokenUsage(100, 20, 0)),
+            RequestUsage("b.py", ["h"], TokenUsage(300, 40, 100)),
+            RequestUsage("a.py", ["k"], TokenUsage(), cached_response=True),
+        ],
+        {"model": ModelPrice(input=1.0, output=1.0)},
+    )
+
+    data = report.to_dict()
+
+    assert data["run"]["requests"] == 3 and data["run"]["cached_responses"] == 1
+    assert data["run"]["total_tokens"] == 460
+    assert [(f["source_file"], f["requests"], f["total_tokens"]) for f in data["files"]] == [
+        ("b.py", 1, 340),
+        ("a.py", 2, 120),
+    ]
+    chunks = {chunk["chunk"]: chunk for chunk in data["chunks"]}
+    assert chunks["f"]["prompt_tokens"] == 50 and chunks["f"]["batch_size"] == 2
+    assert chunks["k"]["cost_usd"] == 0
+    assert UsageReport("unknown", [], {}).to_dict()["run"]["cost_usd"] is None
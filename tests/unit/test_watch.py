@@ -0,0 +1,114 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fakes import FakeBackend, FakeProject
+
+from ai_unit_test.cli import _watch
+from ai_unit_test.watch import PollingWatcher, changed_files, snapshot
+
+
+def _touch(path: Path, content: str) -> None:
+    path.write_text(content)
+    # Some file systems have a coarse mtime: bump it so that the change is always seen
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_snapshot_reports_added_and_modified_files(tmp_path: Path) -> None:
+    """
+    Tests that files added or modified between two snapshots are reported, and excluded folders are ignored.
+    """
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "tests").mkdir()
+    _touch(tmp_path / "src" / "a.py", "a = 1\n")
+    _touch(tmp_path / "src" / "b.py", "b = 1\n")
+    before = snapshot([str(tmp_path / "src")], [str(tmp_path / "src" / "tests")])
+
+    _touch(tmp_path / "src" / "a.py", "a = 2\n")
+    _touch(tmp_path / "src" / "c.py", "c = 1\n")
+    _touch(tmp_path / "src" / "tests" / "test_a.py", "def test_a(): pass\n")
+    (tmp_path / "src" / "b.py").unlink()
+    after = snapshot([str(tmp_path / "src")], [str(tmp_path / "src" / "tests")])
+
+    assert changed_files(before, after) == {tmp_path / "src" / "a.py", tmp_path / "src" / "c.py"}
+
+
+async def _run_tests(command: str, test_files: list[str]) -> int:
+    # Running the tests writes coverage data newer than the saved source files
+    later = time.time_ns() + 2_000_000_000
+    os.utime(".coverage", ns=(later, later))
+    return 0
+
+
+def test_polling_watcher_debounces_changes(tmp_path: Path) -> None:
+    """
+    Tests that files saved in quick succession are reported together, once they settled.
+    """
+
+    async def save_twice() -> set[Path]:
+        watcher = PollingWatcher([str(tmp_path)], interval=0.01, debounce=0.1)
+        changes = asyncio.create_task(watcher.next_changes())
+        await asyncio.sleep(0.03)
+        _touch(tmp_path / "a.py", "a = 1\n")
+        await asyncio.sleep(0.03)
+        _touch(tmp_path / "b.py", "b = 1\n")
+        return await changes
+
+    assert asyncio.run(save_twice()) == {tmp_path / "a.py", tmp_path / "b.py"}
+
+
+@patch("ai_unit_test.cli.run_test_command", new_callable=AsyncMock, side_effect=_run_tests)
+def test_watch_regenerates_tests_of_changed_files(
+    mock_run_test_command: AsyncMock, fake_project: FakeProject, fake_backend: FakeBackend
+) -> None:
+    """
+    Tests that a saved source file has its tests run, only its coverage analyzed and a test generated for its
+    uncovered code.
+    """
+    Path("src").mkdir()
+    _touch(Path("src/main.py"), "def main():\n    return 1\n")
+    _touch(Path("src/other.py"), "def other():\n    return 1\n")
+    options = {"folders": ["src"], "tests_folder": "tests", "use_cache": False}
+
+    async def save_and_watch() -> None:
+        watching = asyncio.create_task(_watch(options, "pytest", 0.01, 0.05, fake_backend, max_runs=1))
+        await asyncio.sleep(0.05)
+        _touch(Path("src/main.py"), "def main():\n    return 2\n")
+        await watching
+
+    asyncio.run(save_and_watch())
+
+    mock_run_test_command.assert_awaited_once_with("pytest", [str(fake_project.test_file)])
+    assert fake_project.collect_missing_lines.call_args.kwargs["only_files"] == [str(Path("src/main.py"))]
+    assert fake_backend.calls == 1
+    assert "def test_main()" in fake_project.test_file.read_text()
+
+
+@patch("ai_unit_test.cli.logger.warning")
+def test_watch_skips_files_newer_than_coverage(
+    mock_logger_warning: MagicMock, fake_project: FakeProject, fake_backend: FakeBackend
+) -> None:
+    """
+    Tests that without a test command, a file saved after the coverage data was written is skipped with a warning
+    rather than given tests for stale uncovered lines.
+    """
+    Path("src").mkdir()
+    _touch(Path("src/main.py"), "def main():\n    return 1\n")
+    options = {"folders": ["src"], "tests_folder": "tests", "use_cache": False}
+
+    async def save_and_watch() -> None:
+        watching = asyncio.create_task(_watch(options, None, 0.01, 0.05, fake_backend, max_runs=1))
+        await asyncio.sleep(0.05)
+        _touch(Path("src/main.py"), "def main():\n    return 2\n")
+        await watching
+
+    asyncio.run(save_and_watch())
+
+    mock_logger_warning.assert_called_once_with(
+        f"{Path('src/main.py')} changed after .coverage was written, skipping it until its tests run again."
+    )
+    fake_project.collect_missing_lines.assert_not_called()
+    assert fake_backend.calls == 0